@@ -1,14 +1,16 @@
 from typing import Annotated
-from fastapi import Request, HTTPException, Depends
+from fastapi import Request, HTTPException, Depends, Header
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pocketbase import PocketBase
 from pocketbase.models import Record
 
+from app.core.cassette import pocketbase_client
 from app.core.config import settings
+from app.core.executors import pools, run_in_pool
 
 
-def get_pocketbase() -> PocketBase:
-    return PocketBase(settings.POCKETBASE_URL)
+async def get_pocketbase() -> PocketBase:
+    return pocketbase_client(settings.POCKETBASE_URL)
 
 
 class TokenBearer(HTTPBearer):
@@ -28,12 +30,16 @@ TokenDep = Annotated[str, Depends(TokenBearer())]
 PocketBaseDep = Annotated[PocketBase, Depends(get_pocketbase)]
 
 
-def get_current_user(token: TokenDep, pb: PocketBaseDep):
+def _refresh_auth(pb: PocketBase, token: str) -> Record | None:
+    pb.auth_store.save(token, None)
+    pb.collection("users").auth_refresh()
+    return pb.auth_store.model
+
+
+async def get_current_user(token: TokenDep, pb: PocketBaseDep):
     try:
-        print("Token", token)
-        pb.auth_store.save(token, None)
-        pb.collection("users").auth_refresh()   
-        pb_user = pb.auth_store.model
+        # The PocketBase round trip runs on the I/O pool instead of Starlette's shared one
+        pb_user = await run_in_pool(pools.io, _refresh_auth, pb, token)
         if not pb_user:
             raise HTTPException(status_code=403, detail="Invalid authentication token")
         return pb_user
@@ -42,3 +48,33 @@ def get_current_user(token: TokenDep, pb: PocketBaseDep):
 
 
 CurrentUser = Annotated[Record, Depends(get_current_user)]
+
+
+def is_profiling_admin(user: Record) -> bool:
+    return bool(
+        user.id in settings.PROFILING_ADMINS
+        or getattr(user, "email", None) in settings.PROFILING_ADMINS
+    )
+
+
+async def get_profiling_admin(current_user: CurrentUser):
+    if not is_profiling_admin(current_user):
+        raise HTTPException(status_code=403, detail="Profiling is restricted to administrators")
+    return current_user
+
+
+ProfilingAdmin = Annotated[Record, Depends(get_profiling_admin)]
+
+
+async def get_profile_requested(
+    current_user: CurrentUser, x_profile: Annotated[bool, Header()] = False
+) -> bool:
+    """
+    Whether the request asked to be profiled with ``X-Profile: true``; only admins may.
+    """
+    if x_profile and not is_profiling_admin(current_user):
+        raise HTTPException(status_code=403, detail="Profiling is restricted to administrators")
+    return x_profile
+
+
+ProfileRequested = Annotated[bool, Depends(get_profile_requested)]
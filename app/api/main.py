@@ -8,6 +8,9 @@ api_router = APIRouter()
 from .routes import users
 from .routes import user_story
 from .routes import test_case
+from .routes import project
+from .routes import system
+from .routes import batch_job
 
 # Combine all routes
 api_router.include_router(
@@ -30,3 +33,24 @@ api_router.include_router(
     tags=["test-case"],
     dependencies=[Depends(get_current_user)],
 )
+
+api_router.include_router(
+    project.router,
+    prefix="/project",
+    tags=["project"],
+    dependencies=[Depends(get_current_user)],
+)
+
+api_router.include_router(
+    batch_job.router,
+    prefix="/batch_job",
+    tags=["batch-job"],
+    dependencies=[Depends(get_current_user)],
+)
+
+api_router.include_router(
+    system.router,
+    prefix="/system",
+    tags=["system"],
+    dependencies=[Depends(get_current_user)],
+)
@@ -0,0 +1,38 @@
+import re
+import uuid
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.core.logs import log_context
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Accept a caller's ID only if it is short and safe to echo back and log
+_VALID_REQUEST_ID = re.compile(r"^[\w\-.]{1,64}$")
+
+
+class RequestIdMiddleware:
+    """
+    Gives every request a correlation ID, taken from the X-Request-ID header or
+    generated, which is attached to its log records and returned in the response.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        header = REQUEST_ID_HEADER.lower().encode("latin-1")
+        incoming = dict(scope["headers"]).get(header, b"").decode("latin-1")
+        request_id = incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex
+
+        async def send_with_id(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"].append((header, request_id.encode("latin-1")))
+            await send(message)
+
+        with log_context(request_id=request_id):
+            await self.app(scope, receive, send_with_id)
@@ -0,0 +1,30 @@
+import hashlib
+import json
+from typing import Any, Tuple
+
+from fastapi import Request, Response
+
+# Clients may reuse a response only after revalidating it with If-None-Match
+CACHE_CONTROL = "private, no-cache"
+
+
+def render_json(payload: Any) -> Tuple[bytes, str]:
+    """
+    Serializes a payload once and derives its ETag, so both can be cached together.
+    """
+    body = json.dumps(payload, separators=(",", ":"), default=str).encode("utf-8")
+    return body, '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def conditional_json(request: Request, rendered: Tuple[bytes, str]) -> Response:
+    """
+    Returns the rendered JSON, or an empty 304 if the client already has this version.
+    """
+    body, etag = rendered
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    if etag in candidates or "*" in candidates:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
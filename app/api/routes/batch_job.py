@@ -0,0 +1,84 @@
+from typing import Annotated
+
+from fastapi import APIRouter, HTTPException, Path
+from pocketbase import PocketBase
+
+from app.core.executors import pools, run_in_pool
+from app.src.deferred import list_jobs, load_job, poll_job
+from app.api.deps import PocketBaseDep
+
+router = APIRouter()
+
+JobId = Annotated[str, Path(pattern=r"^[a-z0-9]{15}$")]
+
+
+async def _get_job(pb: PocketBase, job_id: str) -> dict:
+    """
+    Loads a job the user may see: one of a project they have access to.
+    """
+    job = await run_in_pool(pools.io, load_job, pb, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found.")
+    try:
+        await run_in_pool(pools.io, pb.collection("project").get_one, job["project_id"])
+    except Exception:
+        raise HTTPException(status_code=404, detail="Batch job not found.")
+    return job
+
+
+@router.get("/")
+async def read_batch_jobs(project_id: str, pb: PocketBaseDep):
+    """
+    List the deferred batch jobs of a project, newest first.
+
+    Args:
+        project_id (str): The ID of the project.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+
+    Returns:
+        dict: The jobs.
+    """
+    try:
+        await run_in_pool(pools.io, pb.collection("project").get_one, project_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Project not found.")
+    return {"batch_jobs": await run_in_pool(pools.io, list_jobs, pb, project_id)}
+
+
+@router.get("/{job_id}")
+async def read_batch_job(job_id: JobId, pb: PocketBaseDep):
+    """
+    Get a deferred batch job as of its last poll.
+
+    Args:
+        job_id (str): The ID of the job.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+
+    Returns:
+        dict: The job.
+    """
+    return await _get_job(pb, job_id)
+
+
+@router.post("/{job_id}/poll")
+async def poll_batch_job(job_id: JobId, pb: PocketBaseDep):
+    """
+    Check a deferred batch job with its provider. Once the batch has finished, its
+    results are saved to PocketBase. Results that could not be saved leave the job
+    ``partial``, and polling it again retries only those.
+
+    Args:
+        job_id (str): The ID of the job.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+
+    Returns:
+        dict: The job, with a result summary once applied.
+    """
+    await _get_job(pb, job_id)
+    try:
+        job = await run_in_pool(pools.jobs, poll_job, pb, job_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if job is None:
+        raise HTTPException(status_code=404, detail="Batch job not found.")
+    return job
@@ -0,0 +1,53 @@
+from fastapi import APIRouter, HTTPException
+
+from app.api.deps import PocketBaseDep
+from app.core.cache import project_namespace, read_cache
+from app.core.executors import pools, run_in_pool
+from app.crud.project_stats import get_summary, recompute
+
+router = APIRouter()
+
+
+@router.get("/{project_id}/summary")
+async def read_project_summary(project_id: str, pb: PocketBaseDep):
+    """
+    Get dashboard counts for a project: user stories by priority and status, total story
+    points, stale stories, test cases and test case coverage.
+
+    The counts are maintained incrementally as user stories and test cases are
+    generated, so this reads a single record regardless of project size.
+
+    Args:
+        project_id (str): The ID of the project.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+
+    Returns:
+        dict: The project's aggregates.
+    """
+    try:
+        await run_in_pool(pools.io, pb.collection("project").get_one, project_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Project not found.")
+    return await run_in_pool(pools.io, get_summary, pb, project_id)
+
+
+@router.post("/{project_id}/summary/recompute")
+async def recompute_project_summary(project_id: str, pb: PocketBaseDep):
+    """
+    Rebuild a project's aggregates from all of its records, e.g. after records were
+    edited or deleted outside the API.
+
+    Args:
+        project_id (str): The ID of the project.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+
+    Returns:
+        dict: The recomputed aggregates.
+    """
+    try:
+        await run_in_pool(pools.io, pb.collection("project").get_one, project_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Project not found.")
+    await run_in_pool(pools.io, recompute, pb, project_id)
+    read_cache.invalidate(project_namespace(project_id))
+    return await run_in_pool(pools.io, get_summary, pb, project_id)
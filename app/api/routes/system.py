@@ -0,0 +1,63 @@
+import os
+from typing import Annotated, Literal
+
+from fastapi import APIRouter, HTTPException, Path
+from fastapi.responses import FileResponse
+
+from app.api.deps import ProfilingAdmin
+from app.core.cassette import cassette
+from app.core.config import settings
+from app.core.email_outbox import outbox
+from app.core.executors import pools
+from app.core.llm import llm_caller
+from app.core.profiling import profile_paths
+
+router = APIRouter()
+
+
+@router.get("/pools")
+async def read_pool_stats():
+    """
+    Get utilization and queue depth of this worker's execution pools.
+    """
+    return pools.stats()
+
+
+@router.get("/llm")
+async def read_llm_stats():
+    """
+    Get this worker's LLM request, hedging and failover counters and circuit breaker states.
+    """
+    return llm_caller.stats()
+
+
+@router.get("/cassette")
+async def read_cassette_stats():
+    """
+    Get this worker's cassette mode and recorded/replayed call counts.
+    """
+    return cassette.stats()
+
+
+@router.get("/email")
+async def read_email_stats():
+    """
+    Get this worker's email outbox queue depth and delivery counters.
+    """
+    return outbox.stats()
+
+
+@router.get("/profiles/{job_id}/{kind}")
+async def read_profile(
+    job_id: Annotated[str, Path(pattern=r"^[0-9a-f]{8,64}$")],
+    kind: Literal["flamegraph", "allocations", "summary"],
+    admin: ProfilingAdmin,
+):
+    """
+    Download a file of a profiled job: collapsed stacks for a flame graph, the top
+    allocations report, or the JSON summary. Admins only.
+    """
+    path = profile_paths(settings.PROFILE_DIR, job_id)[kind]
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return FileResponse(path)
@@ -1,70 +1,221 @@
-from fastapi import APIRouter, HTTPException, Depends
+import uuid
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Depends, Query, Request
 from pocketbase import PocketBase
+from app.api.responses import conditional_json, render_json
+from app.core.executors import pools, run_in_pool
+from app.core.cache import project_namespace, read_cache, user_story_namespace
+from app.core.config import settings
+from app.core.logs import log_context
+from app.core.profiling import ProfilerBusyError, profiled
+from app.crud.pagination import InvalidCursorError, fetch_page, quote, select_fields
+from app.crud.test_case import TEST_CASE_FIELDS
+from app.core.single_flight import single_flight
+from app.src.deferred import defer_test_cases
 from app.src.test_case_generator import TestCaseGenerator
-from app.api.deps import CurrentUser, PocketBaseDep
+from app.src.test_case_service import (
+    IncompleteUserStoryError,
+    UserStoryNotFoundError,
+    generate_for_user_story,
+)
+from app.api.deps import CurrentUser, PocketBaseDep, ProfileRequested
 
 router = APIRouter()
 
+LIST_FIELDS = (*TEST_CASE_FIELDS, "user_story", "created", "updated")
+# Steps and expected results are long, so they are only returned when asked for
+DEFAULT_LIST_FIELDS = ("id", "name", "user_story")
 
-@router.post("/generate_from_user_story")
-async def generate_and_save_test_cases(
-    user_story_id: str,
+
+@router.get("/")
+async def list_test_cases_page(
+    request: Request,
     current_user: CurrentUser,
     pb: PocketBaseDep,
+    user_story: Optional[str] = None,
+    project: Optional[str] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
 ):
     """
-    Generate and save test cases for a specific user story.
+    List the test cases of a user story or project, one page at a time.
 
     Args:
-        user_story_id (str): The ID of the user story to generate test cases for.
+        request (Request): The incoming request, used for If-None-Match.
         current_user (CurrentUser): The currently authenticated user.
         pb (PocketBaseDep): The PocketBase dependency for database interaction.
+        user_story (str): Only return test cases of this user story.
+        project (str): Only return test cases of this project's user stories.
+        fields (str): Comma separated fields to return (default: id, name and user story).
+        cursor (str): The next_cursor of the previous page.
+        limit (int): The maximum number of test cases to return.
 
     Returns:
-        dict: A message indicating the success of the operation.
+        dict: The test cases (items) and the cursor of the next page, with an ETag.
     """
+    if not user_story and not project:
+        raise HTTPException(
+            status_code=400, detail="Either user_story or project is required."
+        )
     try:
-        # Fetch the user story details
-        user_story = pb.collection("user_story").get_one(user_story_id)
-        if not user_story:
-            raise HTTPException(status_code=404, detail="User story not found.")
-
-        # Extract user story details
-        story_text = user_story.title
-        acceptance_criteria = user_story.acceptance_criteria
-        if not story_text or not acceptance_criteria:
-            raise HTTPException(
-                status_code=400,
-                detail="User story or acceptance criteria is missing.",
-            )
+        selected = select_fields(fields, LIST_FIELDS, DEFAULT_LIST_FIELDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filters, namespaces = [], []
+    if user_story:
+        filters.append(f"user_story={quote(user_story)}")
+        namespaces.append(user_story_namespace(user_story))
+    if project:
+        filters.append(f"user_story.project={quote(project)}")
+        namespaces.append(project_namespace(project))
 
-        # Initialize TestCaseGenerator
-        test_case_generator = TestCaseGenerator()
+    def render():
+        items, next_cursor = fetch_page(pb, "test_case", filters, selected, cursor, limit)
+        return render_json({"items": items, "next_cursor": next_cursor})
 
-        # Generate test cases for the user story
-        test_cases = test_case_generator.generate_test_cases(
-            user_story=story_text,
-            acceptance_criteria=acceptance_criteria,
+    # Keyed by user as well, since PocketBase access rules decide what each user sees
+    key = ("test_case", current_user.id, tuple(filters), tuple(selected), cursor, limit)
+    try:
+        rendered = await run_in_pool(
+            pools.io, read_cache.get_or_set, namespaces, key, render
         )
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return conditional_json(request, rendered)
+
 
-        # Save the generated test cases to PocketBase
-        for test_case in test_cases.test_cases:
-            pb.collection("test_case").create(
-                {
-                    "user_story": user_story_id,
-                    "name": test_case.name,
-                    "description": test_case.description,
-                    "preconditions": test_case.preconditions,
-                    "steps": test_case.steps,
-                    "expected_result": test_case.expected_result,
-                    "created_by": current_user.id,
-                }
+def _generate_test_cases(
+    user_story_id: str,
+    user_id: str,
+    pb: PocketBase,
+    force: bool,
+    fanout: bool,
+    reuse: bool = False,
+    profile: bool = False,
+) -> dict:
+    """
+    Generates the test cases of a user story in its own log context (see
+    ``generate_for_user_story``). A profiled run links its profile files in the response.
+    """
+    job_id = uuid.uuid4().hex
+    with log_context(job_id=job_id), profiled(job_id, profile) as profiler:
+        try:
+            result = generate_for_user_story(
+                pb, user_story_id, user_id, force=force, fanout=fanout, reuse=reuse
             )
+        except UserStoryNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except IncompleteUserStoryError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        response = {
+            "message": (
+                "Test cases are up to date."
+                if result["cached"]
+                else "Test cases generated and saved successfully."
+            ),
+            **result,
+        }
+        if profiler is not None:
+            response["profile"] = profiler.paths
+        return response
+
+
+@router.post("/generate_from_user_story")
+async def generate_and_save_test_cases(
+    user_story_id: str,
+    current_user: CurrentUser,
+    pb: PocketBaseDep,
+    profile: ProfileRequested,
+    force: bool = False,
+    fanout: Optional[bool] = None,
+    reuse: Optional[bool] = None,
+):
+    """
+    Generate and save test cases for a specific user story.
 
-        return {"message": "Test cases generated and saved successfully."}
+    Generation is idempotent: if the story's title and acceptance criteria (and the
+    prompt version and model) are unchanged since the last run, the existing test cases
+    are returned without calling the LLM. Concurrent requests for the same story wait
+    for the first one and share its result.
+
+    Args:
+        user_story_id (str): The ID of the user story to generate test cases for.
+        current_user (CurrentUser): The currently authenticated user.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+        profile (ProfileRequested): Whether an admin asked to profile the generation
+            with the ``X-Profile`` header.
+        force (bool): Regenerate even if the user story has not changed.
+        fanout (bool): Generate each acceptance criterion and category (functional,
+            non-functional) in parallel calls and merge them (default: TEST_CASE_FANOUT).
+        reuse (bool): Copy the test cases of similar acceptance criteria already covered
+            in the project instead of generating them, and generate the rest per
+            criterion (default: TEST_CASE_REUSE).
+
+    Returns:
+        dict: A message, whether the result was reused, the test cases, the reuse
+            counts in reuse mode and, when profiled, the paths of the profile files.
+    """
+    if fanout is None:
+        fanout = settings.TEST_CASE_FANOUT
+    if reuse is None:
+        reuse = settings.TEST_CASE_REUSE
+    try:
+        # Concurrent requests for the same story by the same user share a single generation;
+        # the user is part of the key so no one receives results read under another's token
+        return await run_in_pool(
+            pools.jobs,
+            single_flight.do,
+            f"test_case:{current_user.id}:{user_story_id}:{force}:{fanout}:{reuse}:{profile}",
+            lambda: _generate_test_cases(
+                user_story_id, current_user.id, pb, force, fanout, reuse, profile
+            ),
+        )
 
     except HTTPException as http_err:
         raise http_err
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
-        raise e
         raise HTTPException(status_code=500, detail=f"Internal Server Error: {str(e)}")
+
+
+@router.post("/generate_for_project")
+async def defer_project_test_cases(
+    project_id: str,
+    current_user: CurrentUser,
+    pb: PocketBaseDep,
+    force: bool = False,
+):
+    """
+    Submit test case generation for all of a project's current user stories as one
+    deferred batch job, at a lower price and outside the interactive rate limits. Stories
+    whose test cases are up to date are skipped. The test cases are saved when the job
+    is polled at /batch_job/{id}/poll after the batch has finished.
+
+    Args:
+        project_id (str): The ID of the project.
+        current_user (CurrentUser): The currently authenticated user.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+        force (bool): Also regenerate test cases that are up to date.
+
+    Returns:
+        dict: The batch job.
+    """
+    try:
+        # Concurrent submissions for the same project by the same user share a single batch
+        return await run_in_pool(
+            pools.jobs,
+            single_flight.do,
+            f"test_case_batch:{current_user.id}:{project_id}:{force}",
+            lambda: defer_test_cases(
+                TestCaseGenerator(), pb, project_id, current_user.id, force
+            ),
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
@@ -1,50 +1,394 @@
 import json
-from fastapi import APIRouter, HTTPException, UploadFile, File, Depends
+import logging
+import uuid
+from fastapi import APIRouter, HTTPException, UploadFile, File, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from pocketbase import PocketBase
-from typing import List, Annotated
+from pocketbase.utils import ClientResponseError
+from typing import List, Annotated, Optional
 
-import requests
-from app.schemas.user_story import UserStory
+from app.api.responses import conditional_json, render_json
+from app.core.cache import project_namespace, read_cache
+from app.core.config import settings
+from app.core.email_outbox import outbox
+from app.core.executors import pools, run_in_pool
+from app.core.logs import log_context
+from app.core.profiling import ProfilerBusyError, profiled
+from app.core.single_flight import single_flight
+from app.crud.pagination import InvalidCursorError, fetch_page, quote, select_fields
+from app.schemas.user_story import Priority, Status, UserStory
+from app.src.deferred import defer_user_stories
+from app.src.brd_download import (
+    BRDNotPDFError,
+    BRDTooLargeError,
+    StoredBRD,
+    download_brd,
+    receive_brd,
+)
+from app.src.export import EXPORTERS, MEDIA_TYPES, ExportFormat
+from app.src.planner import ImportTooLargeError, plan_import
 from app.src.user_story_generator import UserStoryGenerator
-from app.api.deps import CurrentUser, PocketBaseDep
-import tempfile
-import os
+from app.utils import generate_import_complete_email
+from app.api.deps import CurrentUser, PocketBaseDep, ProfileRequested
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
+USER_STORY_FIELDS = (
+    "id",
+    "title",
+    "description",
+    "acceptance_criteria",
+    "priority",
+    "story_points",
+    "status",
+    "project",
+    "stale",
+    "created",
+    "updated",
+)
+# Long text fields are only returned when asked for
+DEFAULT_USER_STORY_FIELDS = ("id", "title", "priority", "story_points", "status", "stale")
 
-@router.post("/generate_from_pdf")
-async def generate_and_save_user_stories(
-    project_id: str,
+
+@router.get("/")
+async def list_user_stories(
+    request: Request,
+    project: str,
     current_user: CurrentUser,
     pb: PocketBaseDep,
+    priority: Optional[Priority] = None,
+    status: Optional[Status] = None,
+    fields: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200),
 ):
+    """
+    List the user stories of a project, one page at a time.
+
+    Args:
+        request (Request): The incoming request, used for If-None-Match.
+        project (str): The ID of the project.
+        current_user (CurrentUser): The currently authenticated user.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+        priority (Priority): Only return user stories with this priority.
+        status (Status): Only return user stories with this status.
+        fields (str): Comma separated fields to return (default: a summary without long text).
+        cursor (str): The next_cursor of the previous page.
+        limit (int): The maximum number of user stories to return.
+
+    Returns:
+        dict: The user stories (items) and the cursor of the next page, with an ETag.
+    """
     try:
+        selected = select_fields(fields, USER_STORY_FIELDS, DEFAULT_USER_STORY_FIELDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
 
-        # # Get project and BRD document
-        project = pb.collection("project").get_one(project_id)
-        brd_file = pb.collection("projects").get_file_url(project, project.brd_document)
-        
-
-        # Download and save BRD temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
-            response = requests.get(brd_file)
-            tmp_file.write(response.content)
-            tmp_file_path = tmp_file.name
-
-        # Initialize generator and process PDF
-        generator = UserStoryGenerator(
-            pb = pb
+    filters = [f"project={quote(project)}"]
+    if priority:
+        filters.append(f"priority={quote(priority.value)}")
+    if status:
+        filters.append(f"status={quote(status.value)}")
+
+    def render():
+        items, next_cursor = fetch_page(pb, "user_story", filters, selected, cursor, limit)
+        return render_json({"items": items, "next_cursor": next_cursor})
+
+    # Keyed by user as well, since PocketBase access rules decide what each user sees
+    key = ("user_story", current_user.id, tuple(filters), tuple(selected), cursor, limit)
+    try:
+        rendered = await run_in_pool(
+            pools.io, read_cache.get_or_set, [project_namespace(project)], key, render
         )
-        chunks = generator.extract_text_from_pdf(tmp_file_path)
-        generator.generate_user_stories(chunks, project_id, current_user.id)
-    # # Cleanup temporary file
-        os.unlink(tmp_file_path)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return conditional_json(request, rendered)
+
+
+@router.get("/export")
+async def export_user_stories(
+    project_id: str,
+    pb: PocketBaseDep,
+    format: ExportFormat = ExportFormat.JSONL,
+):
+    """
+    Stream all user stories of a project with their test cases as JSONL, CSV or XLSX.
+    Records are fetched from PocketBase page by page while the response is being sent,
+    so memory use does not grow with the project size.
+
+    Args:
+        project_id (str): The ID of the project to export.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+        format (ExportFormat): jsonl (one story per line, test cases nested), csv or xlsx
+            (one row per test case).
 
-        return {
+    Returns:
+        StreamingResponse: The export file.
+    """
+    # Fail before the response starts if the project is missing or not accessible
+    try:
+        await run_in_pool(pools.io, pb.collection("project").get_one, project_id)
+    except Exception:
+        raise HTTPException(status_code=404, detail="Project not found.")
+
+    return StreamingResponse(
+        EXPORTERS[format](pb, project_id),
+        media_type=MEDIA_TYPES[format],
+        headers={
+            "Content-Disposition": f'attachment; filename="{project_id}.{format.value}"'
+        },
+    )
+
+
+def _generate_from_brd(
+    brd: StoredBRD,
+    project_id: str,
+    user_id: str,
+    pb: PocketBase,
+    incremental: bool,
+    dry_run: bool = False,
+    notify_email: Optional[str] = None,
+    profile: bool = False,
+    deferred: bool = False,
+) -> dict:
+    """
+    Runs the user story pipeline over a BRD document stored on disk. In incremental mode
+    only sections that changed since the previous BRD version are sent to the LLM. A dry
+    run stops after chunking and only returns the plan; a deferred run submits the
+    prompts as a batch job. When the import finishes, ``notify_email`` is sent a
+    summary. A profiled run links its profile files in the response.
+    """
+    job_id = uuid.uuid4().hex
+    with log_context(job_id=job_id), profiled(job_id, profile) as profiler:
+        generator = UserStoryGenerator(pb=pb)
+        chunks = generator.extract_text_from_pdf(brd.path)
+        plan = plan_import(generator, chunks, pb, project_id, incremental)
+        logger.info(
+            "Importing BRD %s for project %s: %d chunks",
+            brd.sha256[:12],
+            project_id,
+            len(chunks),
+            extra={"dry_run": dry_run, "incremental": incremental},
+        )
+
+        response = {
             "message": "User stories created successfully",
-            # "count": len(user_stories),
+            "job_id": job_id,
+            "document": {"sha256": brd.sha256, "size": brd.size},
+            "cleanup": generator.cleanup_report.as_dict(),
+            "plan": plan.as_dict(),
         }
+        if profiler is not None:
+            response["profile"] = profiler.paths
+        if dry_run:
+            response["message"] = "Dry run: no user stories were generated"
+            return response
+
+        plan.check_limits()
+        if deferred:
+            response["message"] = "User story generation was submitted as a batch job"
+            response["batch_job"] = defer_user_stories(
+                generator, chunks, project_id, user_id, incremental
+            )
+            return response
+        if incremental:
+            response["changes"] = generator.regenerate_user_stories(
+                chunks, project_id, user_id
+            )
+        else:
+            user_stories = generator.generate_user_stories(chunks, project_id, user_id)
+            response["user_stories_created"] = len(user_stories)
+
+        if notify_email:
+            _notify_import_complete(pb, project_id, notify_email, response)
+        return response
+
+
+def _notify_import_complete(
+    pb: PocketBase, project_id: str, email_to: str, summary: dict
+) -> None:
+    """
+    Queues the import summary email on the outbox; a failure never fails the import.
+    """
+    if not (settings.emails_enabled and settings.NOTIFY_IMPORT_COMPLETE):
+        return
+    try:
+        project = pb.collection("project").get_one(project_id)
+        email_data = generate_import_complete_email(
+            email_to, getattr(project, "name", None) or project_id, summary
+        )
+        outbox.enqueue(email_to, email_data.subject, email_data.html_content)
+    except Exception:
+        logger.exception("Could not queue the import notification for %s", project_id)
+
+
+def _download_and_generate(
+    project_id: str,
+    user_id: str,
+    pb: PocketBase,
+    incremental: bool,
+    dry_run: bool,
+    notify_email: Optional[str] = None,
+    profile: bool = False,
+    deferred: bool = False,
+) -> dict:
+    """
+    Downloads the project's BRD from PocketBase and runs the user story pipeline over it.
+    """
+    # # Get project and BRD document
+    project = pb.collection("project").get_one(project_id)
+    brd_file = pb.collection("projects").get_file_url(project, project.brd_document)
+
+    # Stream the BRD to a temporary file that is removed even if generation fails
+    with download_brd(
+        brd_file,
+        max_bytes=settings.BRD_MAX_BYTES,
+        chunk_size=settings.BRD_CHUNK_SIZE,
+        timeout=settings.BRD_DOWNLOAD_TIMEOUT,
+    ) as brd:
+        return _generate_from_brd(
+            brd,
+            project_id,
+            user_id,
+            pb,
+            incremental,
+            dry_run,
+            notify_email,
+            profile,
+            deferred,
+        )
+
+
+@router.post("/generate_from_pdf")
+async def generate_and_save_user_stories(
+    project_id: str,
+    current_user: CurrentUser,
+    pb: PocketBaseDep,
+    profile: ProfileRequested,
+    incremental: bool = False,
+    dry_run: bool = False,
+    deferred: bool = False,
+):
+    """
+    Generate user stories from the project's BRD stored in PocketBase.
+
+    Args:
+        project_id (str): The ID of the project the user stories belong to.
+        current_user (CurrentUser): The currently authenticated user.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+        profile (ProfileRequested): Whether an admin asked to profile the import with
+            the ``X-Profile`` header.
+        incremental (bool): Only process sections that changed since the previous BRD version.
+        dry_run (bool): Only extract and chunk the BRD and estimate the LLM calls, tokens,
+            cost and wall time of the import, without calling the LLM.
+        deferred (bool): Submit the LLM requests as a batch job instead, at a lower price
+            and outside the interactive rate limits; poll it at /batch_job/{id}/poll.
+
+    Returns:
+        dict: A message, document and cleanup details, the import plan, the batch job
+            when deferred and, when profiled, the paths of the profile files.
+    """
+    try:
+        # Concurrent imports of the same project's BRD by the same user share a single run;
+        # the user is part of the key so no one receives results read under another's token
+        return await run_in_pool(
+            pools.jobs,
+            single_flight.do,
+            f"user_story:{current_user.id}:{project_id}:{incremental}:{dry_run}:"
+            f"{profile}:{deferred}",
+            lambda: _download_and_generate(
+                project_id,
+                current_user.id,
+                pb,
+                incremental,
+                dry_run,
+                getattr(current_user, "email", None),
+                profile,
+                deferred,
+            ),
+        )
+
+    except (BRDTooLargeError, ImportTooLargeError) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BRDNotPDFError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@router.post("/generate_from_upload")
+async def generate_and_save_user_stories_from_upload(
+    project_id: str,
+    current_user: CurrentUser,
+    pb: PocketBaseDep,
+    profile: ProfileRequested,
+    file: UploadFile = File(...),
+    incremental: bool = False,
+    dry_run: bool = False,
+    deferred: bool = False,
+):
+    """
+    Generate user stories from a BRD uploaded directly with the request, skipping the
+    download from PocketBase when the client already has the file.
+
+    Args:
+        project_id (str): The ID of the project the user stories belong to.
+        current_user (CurrentUser): The currently authenticated user.
+        pb (PocketBaseDep): The PocketBase dependency for database interaction.
+        profile (ProfileRequested): Whether an admin asked to profile the import with
+            the ``X-Profile`` header.
+        file (UploadFile): The BRD document as a PDF.
+        incremental (bool): Only process sections that changed since the previous BRD version.
+        dry_run (bool): Only extract and chunk the BRD and estimate the LLM calls, tokens,
+            cost and wall time of the import, without calling the LLM.
+        deferred (bool): Submit the LLM requests as a batch job instead, at a lower price
+            and outside the interactive rate limits; poll it at /batch_job/{id}/poll.
+
+    Returns:
+        dict: A message, document and cleanup details, the import plan, the batch job
+            when deferred and, when profiled, the paths of the profile files.
+    """
+    try:
+        await run_in_pool(pools.io, pb.collection("project").get_one, project_id)
+    except ClientResponseError as e:
+        if e.status == 404:
+            raise HTTPException(status_code=404, detail="Project not found.")
+        raise HTTPException(status_code=500, detail=str(e))
+
+    try:
+        async with receive_brd(
+            file,
+            max_bytes=settings.BRD_MAX_BYTES,
+            chunk_size=settings.BRD_CHUNK_SIZE,
+        ) as brd:
+            # Concurrent uploads of the same document for a project by the same user share
+            # a single run
+            return await run_in_pool(
+                pools.jobs,
+                single_flight.do,
+                f"user_story:{current_user.id}:{project_id}:{brd.sha256}:"
+                f"{incremental}:{dry_run}:{profile}:{deferred}",
+                lambda: _generate_from_brd(
+                    brd,
+                    project_id,
+                    current_user.id,
+                    pb,
+                    incremental,
+                    dry_run,
+                    getattr(current_user, "email", None),
+                    profile,
+                    deferred,
+                ),
+            )
 
+    except (BRDTooLargeError, ImportTooLargeError) as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except BRDNotPDFError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
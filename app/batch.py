@@ -0,0 +1,559 @@
+"""
+Offline batch import of BRDs, one document per worker process.
+
+    python -m app.batch brds/ --output-dir out --workers 4 --test-cases
+    python -m app.batch manifest.jsonl --pocketbase --workers 2
+
+Inputs are a directory (searched recursively for PDFs), a JSONL manifest of
+``{"path": ..., "project": ...}`` objects, or a text manifest with one path per line.
+Progress is recorded in a state file after every document, so rerunning the same
+command skips what is already done.
+"""
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Nothing from app.core is imported at module level: worker processes first put their
+# share of the LLM rate limits into the environment, then load the settings
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "batch_state.json"
+
+
+def _find_pdfs(directory: str) -> Iterator[str]:
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield os.path.join(root, name)
+
+
+def load_jobs(
+    inputs: List[str], project: Optional[str] = None
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Expands directories and manifests into one job per distinct document, identified
+    by the SHA-256 of its content so a renamed file is still recognised on resume.
+
+    :return: The jobs, and the entries whose file could not be read, each with the
+        ``error``, so one bad manifest line does not stop the run.
+    """
+    entries = []
+    for source in inputs:
+        if os.path.isdir(source):
+            entries += [{"path": path} for path in sorted(_find_pdfs(source))]
+        elif source.lower().endswith(".pdf"):
+            entries.append({"path": source})
+        else:
+            base = os.path.dirname(os.path.abspath(source))
+            with open(source) as f:
+                for line in f:
+                    line = line.strip()
+                    if not line or line.startswith("#"):
+                        continue
+                    entry = json.loads(line) if line.startswith("{") else {"path": line}
+                    entry["path"] = os.path.join(base, entry["path"])
+                    entries.append(entry)
+
+    jobs, unreadable, seen = [], [], set()
+    for entry in entries:
+        digest = hashlib.sha256()
+        try:
+            with open(entry["path"], "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+        except OSError as e:
+            unreadable.append({"project": project, **entry, "error": str(e)})
+            continue
+        sha256 = digest.hexdigest()
+        if sha256 in seen:
+            continue
+        seen.add(sha256)
+        jobs.append({"project": project, **entry, "sha256": sha256})
+    return jobs, unreadable
+
+
+class BatchState:
+    """
+    The outcome of every document processed so far, rewritten atomically after each.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.documents: Dict[str, dict] = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.documents = json.load(f).get("documents", {})
+
+    def is_done(self, sha256: str) -> bool:
+        return self.documents.get(sha256, {}).get("status") == "done"
+
+    def update(self, sha256: str, entry: dict) -> None:
+        self.documents[sha256] = entry
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"documents": self.documents}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+def _write_rows(path: str, rows: List[dict], output_format: str) -> str:
+    """
+    Writes rows to ``path`` plus the format's extension, via a temporary file so an
+    interrupted run never leaves a partial file behind.
+    """
+    path = f"{path}.{output_format}"
+    tmp_path = f"{path}.tmp"
+    if output_format == "parquet":
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        pq.write_table(pa.Table.from_pylist(rows), tmp_path)
+    else:
+        with open(tmp_path, "w") as f:
+            for row in rows:
+                f.write(json.dumps(row, default=str) + "\n")
+    os.replace(tmp_path, path)
+    return path
+
+
+def _generate_local(job: dict, options: dict) -> dict:
+    """
+    Generates a document's user stories (and optionally test cases) into local files.
+    """
+    from app.core.config import settings
+    from app.core.executors import pools
+    from app.src.chunking import fingerprint
+    from app.src.test_case_generator import TestCaseGenerator
+    from app.src.user_story_generator import UserStoryGenerator
+    from app.src.vector_index import build_index, retrieve_context
+
+    generator = UserStoryGenerator(model=options["model"])
+    chunks = generator.extract_text_from_pdf(job["path"])
+    document_id = job["sha256"][:16]
+    index_key = job.get("project") or f"batch-{document_id}"
+    if options["test_cases"]:
+        build_index(index_key, chunks)
+
+    stories: List[dict] = []
+    failed_chunks = 0
+    for chunk_fingerprint, future in generator.iter_chunk_results(
+        {fingerprint(chunk): chunk for chunk in chunks}
+    ):
+        if future.exception() is not None:
+            logger.error("Chunk %s failed: %s", chunk_fingerprint[:12], future.exception())
+            failed_chunks += 1
+            continue
+        for story in future.result():
+            stories.append(
+                {
+                    "id": f"{document_id}-{len(stories) + 1}",
+                    "document": job["path"],
+                    "document_sha256": job["sha256"],
+                    "project": job.get("project"),
+                    "source_chunk": chunk_fingerprint,
+                    **story.model_dump(mode="json"),
+                }
+            )
+
+    test_cases: List[dict] = []
+    failed_stories = 0
+    if options["test_cases"]:
+        test_case_generator = TestCaseGenerator(model=options["test_case_model"])
+
+        def generate(story: dict):
+            context = retrieve_context(
+                index_key,
+                f"{story['title']}\n{story['acceptance_criteria']}",
+                k=settings.RAG_TOP_K,
+                token_budget=settings.RAG_TOKEN_BUDGET,
+                min_score=settings.RAG_MIN_SCORE,
+            )
+            return test_case_generator.generate_test_cases(
+                story["title"],
+                story["acceptance_criteria"],
+                context=context,
+                fanout=settings.TEST_CASE_FANOUT,
+                max_calls=settings.TEST_CASE_FANOUT_MAX_CALLS,
+            )
+
+        # Stories are generated concurrently; each waits on the LLM pool from the job pool
+        futures = {pools.jobs.submit(generate, story): story for story in stories}
+        for future in as_completed(futures):
+            story = futures[future]
+            if future.exception() is not None:
+                logger.error("Test cases for %s failed: %s", story["id"], future.exception())
+                failed_stories += 1
+                continue
+            test_cases += [
+                {"user_story": story["id"], **test_case.model_dump()}
+                for test_case in future.result().test_cases
+            ]
+
+    stem = os.path.join(
+        options["output_dir"],
+        f"{os.path.splitext(os.path.basename(job['path']))[0]}-{job['sha256'][:12]}",
+    )
+    files = [_write_rows(f"{stem}.user_stories", stories, options["format"])]
+    if options["test_cases"]:
+        files.append(_write_rows(f"{stem}.test_cases", test_cases, options["format"]))
+
+    return {
+        "pages": generator.cleanup_report.pages,
+        "chunks": len(chunks),
+        "failed_chunks": failed_chunks,
+        "user_stories": len(stories),
+        "test_cases": len(test_cases),
+        "failed_stories": failed_stories,
+        "files": files,
+    }
+
+
+def _generate_to_pocketbase(job: dict, options: dict) -> dict:
+    """
+    Imports a document into its PocketBase project incrementally, like the
+    generate_from_upload endpoint with incremental=True, then generates test cases for
+    the project's stories that need them.
+    """
+    from app.core.config import settings
+    from app.crud.pagination import iter_records, quote
+    from app.src.test_case_service import generate_for_user_story
+    from app.src.user_story_generator import UserStoryGenerator
+
+    project_id = _require_project(job)
+    pb, user_id = _pocketbase(options)
+
+    generator = UserStoryGenerator(pb=pb, model=options["model"])
+    chunks = generator.extract_text_from_pdf(job["path"])
+    # Incremental: a document interrupted after its stories were saved is not
+    # regenerated, and neither are sections shared with other documents of the project
+    changes = generator.regenerate_user_stories(chunks, project_id, user_id)
+
+    test_cases = 0
+    failed_stories = 0
+    if options["test_cases"]:
+        # Stories whose test cases are up to date are skipped by their fingerprint
+        for story in iter_records(
+            pb, "user_story", [f"project={quote(project_id)}", "stale=false"], ("id",)
+        ):
+            try:
+                result = generate_for_user_story(
+                    pb,
+                    story["id"],
+                    user_id,
+                    fanout=settings.TEST_CASE_FANOUT,
+                    reuse=settings.TEST_CASE_REUSE,
+                    model=options["test_case_model"],
+                )
+            except Exception as e:
+                logger.error("Test cases for %s failed: %s", story["id"], e)
+                failed_stories += 1
+                continue
+            if not result["cached"]:
+                test_cases += len(result["test_cases"])
+
+    return {
+        "pages": generator.cleanup_report.pages,
+        "chunks": len(chunks),
+        "failed_chunks": changes["failed_sections"],
+        "user_stories": changes["user_stories_created"],
+        "test_cases": test_cases,
+        "failed_stories": failed_stories,
+        "changes": changes,
+    }
+
+
+def _require_project(job: dict) -> str:
+    if not job.get("project"):
+        raise ValueError("A project is required to push to PocketBase (--project or manifest)")
+    return job["project"]
+
+
+def _pocketbase(options: dict):
+    from app.core.cassette import pocketbase_client
+    from app.core.config import settings
+
+    pb = pocketbase_client(settings.POCKETBASE_URL)
+    pb.collection("users").auth_with_password(options["pb_email"], options["pb_password"])
+    return pb, pb.auth_store.model.id
+
+
+def _defer_to_pocketbase(job: dict, options: dict) -> dict:
+    """
+    Moves a document one step through deferred import: submits its user story batch,
+    or polls the batch submitted on an earlier run and, once its results are saved,
+    submits the project's test case batch if asked to. The document is done when no
+    batch is left outstanding.
+    """
+    from app.src.deferred import (
+        APPLIED,
+        PARTIAL,
+        SUBMITTED,
+        defer_test_cases,
+        defer_user_stories,
+        poll_job,
+    )
+    from app.src.test_case_generator import TestCaseGenerator
+    from app.src.user_story_generator import UserStoryGenerator
+
+    project_id = _require_project(job)
+    pb, user_id = _pocketbase(options)
+    result = {
+        "pages": 0,
+        "chunks": 0,
+        "failed_chunks": 0,
+        "user_stories": 0,
+        "test_cases": 0,
+        "failed_stories": 0,
+    }
+
+    if job.get("batch_job"):
+        batch_job = poll_job(pb, job["batch_job"])
+        if batch_job is None:
+            raise ValueError(f"Batch job {job['batch_job']} not found")
+    else:
+        generator = UserStoryGenerator(pb=pb, model=options["model"])
+        chunks = generator.extract_text_from_pdf(job["path"])
+        result.update(pages=generator.cleanup_report.pages, chunks=len(chunks))
+        batch_job = defer_user_stories(generator, chunks, project_id, user_id, incremental=True)
+
+    # A partial job is polled again to save the results it could not save yet
+    if batch_job["status"] in (SUBMITTED, PARTIAL):
+        return {**result, "deferred": True, "batch_job": batch_job["id"]}
+    if batch_job["status"] != APPLIED:
+        raise RuntimeError(f"Batch job {batch_job['id']} {batch_job['status']}")
+
+    summary = batch_job.get("result") or {}
+    if batch_job["kind"] == "test_cases":
+        return {
+            **result,
+            "test_cases": summary.get("test_cases_created", 0),
+            "failed_stories": summary.get("failed_user_stories", 0),
+        }
+
+    result.update(
+        user_stories=summary.get("user_stories_created", 0),
+        failed_chunks=summary.get("failed_sections", 0),
+    )
+    if options["test_cases"]:
+        test_case_job = defer_test_cases(
+            TestCaseGenerator(model=options["test_case_model"]), pb, project_id, user_id
+        )
+        if test_case_job["status"] == SUBMITTED:
+            return {**result, "deferred": True, "batch_job": test_case_job["id"]}
+    return result
+
+
+def process_document(job: dict, options: dict) -> dict:
+    """
+    Runs one document in this process and reports its outcome and timings.
+    """
+    from app.core.llm import llm_caller
+    from app.core.logs import log_context
+    from app.core.profiling import profiled
+
+    start = time.monotonic()
+    calls_before = llm_caller.budget.requests
+    job_id = job["sha256"][:12]
+    with log_context(job_id=job_id), profiled(job_id, options["profile"]) as profiler:
+        if options["deferred"]:
+            result = _defer_to_pocketbase(job, options)
+        elif options["pocketbase"]:
+            result = _generate_to_pocketbase(job, options)
+        else:
+            result = _generate_local(job, options)
+    if profiler is not None:
+        result["profile"] = profiler.paths
+    result["llm_calls"] = llm_caller.budget.requests - calls_before
+    result["seconds"] = round(time.monotonic() - start, 2)
+    return result
+
+
+def _init_worker(env: Dict[str, str]) -> None:
+    os.environ.update(env)
+    from app.core.logs import setup_logging
+
+    setup_logging()
+
+
+def _worker_env(workers: int) -> Dict[str, str]:
+    """
+    Each worker process gets 1/N of the LLM rate limits and of the CPUs for PDF parsing,
+    so N workers together stay within the configured totals.
+    """
+    from app.core.config import settings
+
+    env = {"CPU_POOL_SIZE": str(max(1, (os.cpu_count() or 1) // workers))}
+    if settings.LLM_MAX_RPM:
+        env["LLM_MAX_RPM"] = str(max(1, settings.LLM_MAX_RPM // workers))
+    if settings.LLM_MAX_TPM:
+        env["LLM_MAX_TPM"] = str(max(1, settings.LLM_MAX_TPM // workers))
+    return env
+
+
+def _summary_line(done: int, total: int, job: dict, result: dict) -> str:
+    if result.get("deferred"):
+        return (
+            f"[{done}/{total}] {os.path.basename(job['path'])}: waiting for batch job "
+            f"{result['batch_job']}"
+        )
+    line = (
+        f"[{done}/{total}] {os.path.basename(job['path'])}: {result['pages']} pages, "
+        f"{result['chunks']} chunks, {result['user_stories']} user stories, "
+        f"{result['test_cases']} test cases, {result['llm_calls']} LLM calls "
+        f"in {result['seconds']:.1f}s"
+    )
+    if "profile" in result:
+        line += f" (profile: {result['profile']['summary']})"
+    return line
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Generate user stories for many BRDs")
+    parser.add_argument("inputs", nargs="+", help="PDFs, directories of PDFs or manifests")
+    parser.add_argument("-o", "--output-dir", default="batch_output")
+    parser.add_argument("-f", "--format", choices=("jsonl", "parquet"), default="jsonl")
+    parser.add_argument("-w", "--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--project", help="Project of documents the manifest does not assign")
+    parser.add_argument("--model", default="gpt-4o-mini", help="User story model")
+    parser.add_argument("--test-case-model", default="gpt-4", help="Test case model")
+    parser.add_argument("--test-cases", action="store_true", help="Also generate test cases")
+    parser.add_argument(
+        "--pocketbase", action="store_true", help="Save to PocketBase instead of files"
+    )
+    parser.add_argument("--pb-email", default=os.environ.get("BATCH_PB_EMAIL"))
+    parser.add_argument("--pb-password", default=os.environ.get("BATCH_PB_PASSWORD"))
+    parser.add_argument("--state", help=f"State file (default: <output-dir>/{STATE_FILE})")
+    parser.add_argument("--retry-failed", action="store_true", help="Also rerun failed documents")
+    parser.add_argument(
+        "--profile", action="store_true", help="Profile each document into PROFILE_DIR"
+    )
+    parser.add_argument(
+        "--deferred",
+        action="store_true",
+        help="Submit to the batch API; rerun the same command to collect the results",
+    )
+    args = parser.parse_args(argv)
+
+    if args.format == "parquet" and not args.pocketbase:
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            parser.error("--format parquet requires pyarrow")
+    if args.deferred and not args.pocketbase:
+        parser.error("--deferred saves its results to PocketBase and requires --pocketbase")
+    if args.pocketbase and not (args.pb_email and args.pb_password):
+        parser.error("--pocketbase requires --pb-email and --pb-password")
+
+    from app.core.logs import setup_logging
+
+    setup_logging()
+    os.makedirs(args.output_dir, exist_ok=True)
+    state = BatchState(args.state or os.path.join(args.output_dir, STATE_FILE))
+
+    jobs, unreadable = load_jobs(args.inputs, args.project)
+    for entry in unreadable:
+        # Keyed by path, as there is no content to digest
+        state.update(
+            entry["path"],
+            {
+                "path": entry["path"],
+                "project": entry.get("project"),
+                "status": "failed",
+                "error": entry["error"],
+            },
+        )
+        print(f"{entry['path']} failed: {entry['error']}", flush=True)
+    pending = [
+        job
+        for job in jobs
+        if not state.is_done(job["sha256"])
+        and (args.retry_failed or state.documents.get(job["sha256"], {}).get("status") != "failed")
+    ]
+    for job in pending:
+        # Documents waiting on a batch job are polled rather than submitted again
+        entry = state.documents.get(job["sha256"], {})
+        if entry.get("status") == "deferred" and args.deferred:
+            job["batch_job"] = entry["batch_job"]
+    print(f"{len(jobs)} documents, {len(jobs) - len(pending)} already processed", flush=True)
+
+    options = {
+        "output_dir": args.output_dir,
+        "format": args.format,
+        "model": args.model,
+        "test_case_model": args.test_case_model,
+        "test_cases": args.test_cases,
+        "pocketbase": args.pocketbase,
+        "pb_email": args.pb_email,
+        "pb_password": args.pb_password,
+        "profile": args.profile,
+        "deferred": args.deferred,
+    }
+    workers = max(1, min(args.workers, len(pending) or 1))
+    totals = {"pages": 0, "user_stories": 0, "test_cases": 0, "llm_calls": 0}
+    failed = 0
+    waiting = 0
+    start = time.monotonic()
+
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+        initargs=(_worker_env(workers),),
+    )
+    try:
+        futures: Dict[Future, dict] = {
+            executor.submit(process_document, job, options): job for job in pending
+        }
+        for done, future in enumerate(as_completed(futures), 1):
+            job = futures[future]
+            entry = {"path": job["path"], "project": job.get("project")}
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                state.update(job["sha256"], {**entry, "status": "failed", "error": str(e)})
+                print(f"[{done}/{len(pending)}] {job['path']} failed: {e}", flush=True)
+                continue
+
+            complete = not result["failed_chunks"] and not result["failed_stories"]
+            failed += not complete
+            if result.get("deferred"):
+                status = "deferred"
+                waiting += 1
+            else:
+                status = "done" if complete else "failed"
+            state.update(job["sha256"], {**entry, **result, "status": status})
+            for key in totals:
+                totals[key] += result[key]
+            print(_summary_line(done, len(pending), job, result), flush=True)
+    except KeyboardInterrupt:
+        print("Interrupted; rerun the same command to resume", flush=True)
+        executor.shutdown(wait=False, cancel_futures=True)
+        return 130
+    executor.shutdown()
+
+    elapsed = time.monotonic() - start
+    per_minute = 60.0 / elapsed if elapsed else 0.0
+    print(
+        f"Processed {len(pending) - failed} documents ({failed} failed) in {elapsed:.1f}s: "
+        f"{len(pending) * per_minute:.2f} documents/min, "
+        f"{totals['pages'] / elapsed if elapsed else 0.0:.1f} pages/s, "
+        f"{totals['user_stories'] * per_minute:.1f} user stories/min, "
+        f"{totals['test_cases'] * per_minute:.1f} test cases/min, "
+        f"{totals['llm_calls']} LLM calls",
+        flush=True,
+    )
+    if waiting:
+        print(f"{waiting} documents waiting for batch jobs; rerun to collect them", flush=True)
+    return 1 if failed or unreadable else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.llm import api_model_name, llm_caller, provider_of
+from app.core.single_flight import host_lock
+from app.schemas.llm_models import AllModelEnum, GroqModelName, OpenAIModelName, Provider
+
+logger = logging.getLogger(__name__)
+
+# Batch states after which no more results will arrive. An expired or cancelled batch
+# still returns the requests it completed.
+FINISHED = ("completed", "expired", "cancelled")
+FAILED = ("failed",)
+
+
+@dataclass
+class BatchRequest:
+    """
+    One chat completion in a batch; ``custom_id`` maps its result back.
+    """
+
+    custom_id: str
+    model: AllModelEnum
+    prompt: str
+    temperature: float
+
+
+def write_batch_file(path: str, requests: List[BatchRequest]) -> None:
+    """
+    Writes requests as an OpenAI Batch API input file: one chat completion per line.
+    """
+    with open(path, "w") as f:
+        for request in requests:
+            line = {
+                "custom_id": request.custom_id,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": api_model_name(request.model),
+                    "messages": [{"role": "user", "content": request.prompt}],
+                    "temperature": request.temperature,
+                },
+            }
+            f.write(json.dumps(line) + "\n")
+
+
+def read_batch_output(lines: Iterator[str]) -> Dict[str, Tuple[Optional[str], Optional[str]]]:
+    """
+    Parses Batch API output and error files.
+
+    :return: For each custom ID, the completion text or None, and the error or None.
+    """
+    results: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        if entry.get("error"):
+            results[entry["custom_id"]] = (None, entry["error"].get("message", "unknown error"))
+        elif response.get("status_code") != 200:
+            error = (response.get("body") or {}).get("error") or {}
+            results[entry["custom_id"]] = (
+                None,
+                error.get("message") or f"HTTP {response.get('status_code')}",
+            )
+        else:
+            message = response["body"]["choices"][0]["message"]
+            results[entry["custom_id"]] = (message.get("content") or "", None)
+    return results
+
+
+class BatchProvider(ABC):
+    """
+    Submits batch input files and fetches their results.
+    """
+
+    name: str = ""
+
+    def check_model(self, model: AllModelEnum) -> None:
+        """
+        :raises ValueError: If the provider cannot run ``model``.
+        """
+
+    @abstractmethod
+    def submit(self, input_path: str) -> str:
+        """
+        :return: The provider's ID of the batch.
+        """
+
+    @abstractmethod
+    def status(self, batch_id: str) -> dict:
+        """
+        :return: The batch ``status`` and its ``request_counts``.
+        """
+
+    @abstractmethod
+    def output(self, batch_id: str) -> Iterator[str]:
+        """
+        Yields the lines of the batch's output and error files.
+        """
+
+
+class OpenAIBatchProvider(BatchProvider):
+    """
+    The OpenAI Batch API: results within BATCH_API_COMPLETION_WINDOW at half the price
+    of synchronous calls, under a rate limit separate from interactive traffic.
+    """
+
+    name = "openai"
+
+    def __init__(self):
+        from openai import OpenAI
+
+        self._client = OpenAI(timeout=settings.LLM_REQUEST_TIMEOUT)
+
+    def check_model(self, model: AllModelEnum) -> None:
+        if provider_of(model) != Provider.OPENAI:
+            raise ValueError(f"{model.value} is not available through the OpenAI Batch API")
+
+    def submit(self, input_path: str) -> str:
+        with open(input_path, "rb") as f:
+            input_file = self._client.files.create(file=f, purpose="batch")
+        batch = self._client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window=settings.BATCH_API_COMPLETION_WINDOW,
+        )
+        return batch.id
+
+    def status(self, batch_id: str) -> dict:
+        batch = self._client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        return {
+            "status": batch.status,
+            "request_counts": counts.model_dump() if counts is not None else {},
+        }
+
+    def output(self, batch_id: str) -> Iterator[str]:
+        batch = self._client.batches.retrieve(batch_id)
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                yield from self._client.files.content(file_id).text.splitlines()
+
+
+class LocalBatchProvider(BatchProvider):
+    """
+    A stand-in with the Batch API's file and status lifecycle, for testing without
+    OpenAI. A batch completes on the first status check at least ``delay`` seconds after
+    it was submitted, by sending each request through the normal LLM path; with
+    CASSETTE_MODE=replay that needs no network at all.
+    """
+
+    name = "local"
+
+    def __init__(self, directory: str, delay: float = 0.0):
+        self.directory = directory
+        self.delay = delay
+
+    def _path(self, batch_id: str, name: str) -> str:
+        return os.path.join(self.directory, batch_id, name)
+
+    def _write_meta(self, batch_id: str, meta: dict) -> None:
+        path = self._path(batch_id, "batch.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        os.replace(path + ".tmp", path)
+
+    def submit(self, input_path: str) -> str:
+        batch_id = f"local_batch_{uuid.uuid4().hex}"
+        os.makedirs(os.path.join(self.directory, batch_id))
+        shutil.copyfile(input_path, self._path(batch_id, "input.jsonl"))
+        self._write_meta(
+            batch_id, {"status": "validating", "submitted": time.time(), "request_counts": {}}
+        )
+        return batch_id
+
+    def status(self, batch_id: str) -> dict:
+        with host_lock(f"local_batch:{batch_id}"):
+            with open(self._path(batch_id, "batch.json")) as f:
+                meta = json.load(f)
+            if meta["status"] == "validating" and time.time() - meta["submitted"] >= self.delay:
+                meta.update(status="completed", request_counts=self._run(batch_id))
+                self._write_meta(batch_id, meta)
+        return {"status": meta["status"], "request_counts": meta["request_counts"]}
+
+    def _run(self, batch_id: str) -> dict:
+        models = {api_model_name(model): model for model in (*OpenAIModelName, *GroqModelName)}
+        futures = []
+        with open(self._path(batch_id, "input.jsonl")) as f:
+            for line in f:
+                request = json.loads(line)
+                body = request["body"]
+                futures.append(
+                    (
+                        request["custom_id"],
+                        llm_caller.submit(
+                            models[body["model"]],
+                            body["messages"][-1]["content"],
+                            lambda text: text,
+                            temperature=body.get("temperature", 0.7),
+                        ),
+                    )
+                )
+
+        failed = 0
+        with open(self._path(batch_id, "output.jsonl"), "w") as f:
+            for number, (custom_id, future) in enumerate(futures):
+                line = {"id": f"batch_req_{number}", "custom_id": custom_id}
+                try:
+                    content = future.result()
+                    message = {"role": "assistant", "content": content}
+                    line["response"] = {
+                        "status_code": 200,
+                        "body": {"choices": [{"message": message}]},
+                    }
+                    line["error"] = None
+                except Exception as e:
+                    failed += 1
+                    line["response"] = None
+                    line["error"] = {"code": "request_failed", "message": str(e)}
+                f.write(json.dumps(line) + "\n")
+        return {"total": len(futures), "completed": len(futures) - failed, "failed": failed}
+
+    def output(self, batch_id: str) -> Iterator[str]:
+        with open(self._path(batch_id, "output.jsonl")) as f:
+            yield from f
+
+
+def get_batch_provider(name: Optional[str] = None) -> BatchProvider:
+    """
+    Returns the configured batch provider, or the one a job was submitted to (by name).
+    """
+    name = name or settings.BATCH_API_PROVIDER
+    if name == "openai":
+        return OpenAIBatchProvider()
+    if name == "local":
+        return LocalBatchProvider(
+            os.path.join(settings.BATCH_API_DIR, "local"), settings.BATCH_API_LOCAL_DELAY
+        )
+    raise ValueError(f"Unsupported batch provider: {name}")
@@ -0,0 +1,86 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+
+from app.core.config import settings
+
+
+class ReadCache:
+    """
+    A short-lived in-memory cache for read endpoints, grouped into namespaces (e.g. one
+    per project) that are invalidated when the generators write.
+
+    Each namespace has a stamp file on local disk; invalidating touches it, and cached
+    entries filled before the last touch are ignored. That keeps every uvicorn worker
+    on the host coherent without a shared cache server, at the cost of one ``stat``
+    per lookup.
+    """
+
+    def __init__(self, stamp_dir: str, ttl: float, max_entries: int = 1024):
+        self.stamp_dir = stamp_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: Dict[Hashable, Tuple[float, Tuple[int, ...], Any]] = {}
+
+    def _stamp_path(self, namespace: str) -> str:
+        name = hashlib.sha256(namespace.encode("utf-8")).hexdigest()
+        return os.path.join(self.stamp_dir, name)
+
+    def _stamp(self, namespace: str) -> int:
+        try:
+            return os.stat(self._stamp_path(namespace)).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def invalidate(self, *namespaces: str) -> None:
+        """
+        Drops everything cached under the given namespaces, in every worker on the host.
+        """
+        os.makedirs(self.stamp_dir, exist_ok=True)
+        for namespace in namespaces:
+            path = self._stamp_path(namespace)
+            with open(path, "a"):
+                pass
+            # Force a fresh mtime even on filesystems with coarse timestamps
+            now = time.time_ns()
+            os.utime(path, ns=(now, now))
+
+    def get_or_set(
+        self, namespaces: Iterable[str], key: Hashable, producer: Callable[[], Any]
+    ) -> Any:
+        """
+        Returns the cached value for ``key``, calling ``producer`` if it is missing,
+        expired or one of its namespaces was invalidated since it was cached.
+        """
+        namespaces = tuple(namespaces)
+        stamps = tuple(self._stamp(namespace) for namespace in namespaces)
+        now = time.monotonic()
+
+        entry: Optional[Tuple[float, Tuple[int, ...], Any]] = self._entries.get(key)
+        if entry and entry[0] > now and entry[1] == stamps:
+            return entry[2]
+
+        value = producer()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries = {
+                    k: v for k, v in self._entries.items() if v[0] > now
+                }
+                if len(self._entries) >= self.max_entries:
+                    self._entries.clear()
+            self._entries[key] = (now + self.ttl, stamps, value)
+        return value
+
+
+read_cache = ReadCache(settings.READ_CACHE_DIR, settings.READ_CACHE_TTL)
+
+
+def project_namespace(project_id: str) -> str:
+    return f"project:{project_id}"
+
+
+def user_story_namespace(user_story_id: str) -> str:
+    return f"user_story:{user_story_id}"
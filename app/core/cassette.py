@@ -0,0 +1,229 @@
+import atexit
+import glob
+import gzip
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, Optional
+
+from pocketbase import PocketBase
+from pocketbase.utils import ClientResponseError
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class CassetteMissError(LookupError):
+    """
+    Raised in replay mode for a call that the cassette has no recording of.
+    """
+
+
+class Cassette:
+    """
+    Records outbound LLM and PocketBase calls, with their timings, to gzipped JSONL files
+    and serves them back without touching the network.
+
+    In record mode each process appends to its own file in ``directory``; replay loads
+    every file there. Calls are keyed by a hash of everything that determines the
+    response. Recordings of the same key are served in the order they were made, and the
+    last one is repeated once they run out, so a load test can run a recorded pipeline
+    many times over. Replayed latencies are multiplied by ``latency_scale`` (0 disables
+    the delays).
+    """
+
+    OFF = "off"
+    RECORD = "record"
+    REPLAY = "replay"
+
+    def __init__(self, directory: str, mode: str = OFF, latency_scale: float = 1.0):
+        self.directory = directory
+        self.mode = mode
+        self.latency_scale = latency_scale
+        self._lock = threading.Lock()
+        self._file = None
+        self._entries: Optional[Dict[str, Deque[dict]]] = None
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == self.RECORD
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == self.REPLAY
+
+    @staticmethod
+    def key(kind: str, *parts: Any) -> str:
+        payload = json.dumps([kind, *parts], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def record(
+        self,
+        kind: str,
+        key: str,
+        response: Any = None,
+        elapsed: float = 0.0,
+        error: Optional[dict] = None,
+        **timings: float,
+    ) -> None:
+        """
+        Appends one call to this process's cassette file.
+
+        :param kind: ``"llm"`` or ``"pocketbase"``.
+        :param key: The call's key, from ``Cassette.key``.
+        :param response: The JSON-serializable response.
+        :param elapsed: Seconds the call took.
+        :param error: A description of the error the call raised, if any.
+        :param timings: Extra timings, e.g. ``ttft`` for LLM calls.
+        """
+        entry = {"kind": kind, "key": key, "response": response, "elapsed": elapsed, **timings}
+        if error is not None:
+            entry["error"] = error
+        line = json.dumps(entry, default=str) + "\n"
+        with self._lock:
+            if self._file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(
+                    self.directory, f"{int(time.time())}-{os.getpid()}.jsonl.gz"
+                )
+                self._file = gzip.open(path, "at", encoding="utf-8")
+                atexit.register(self.close)
+                logger.info("Recording cassette to %s", path)
+            self._file.write(line)
+            self.recorded += 1
+
+    def replay(self, kind: str, key: str) -> dict:
+        """
+        Returns the next recording for a call.
+
+        :raises CassetteMissError: If the call was never recorded.
+        """
+        with self._lock:
+            if self._entries is None:
+                self._entries = self._load()
+            recordings = self._entries.get(key)
+            if not recordings:
+                self.misses += 1
+                raise CassetteMissError(f"No {kind} recording for {key}")
+            self.hits += 1
+            return recordings.popleft() if len(recordings) > 1 else recordings[0]
+
+    def _load(self) -> Dict[str, Deque[dict]]:
+        entries: Dict[str, Deque[dict]] = defaultdict(deque)
+        paths = sorted(glob.glob(os.path.join(self.directory, "*.jsonl.gz")))
+        for path in paths:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A process killed mid-write leaves a truncated last line
+                        continue
+                    entries[entry["key"]].append(entry)
+        logger.info("Loaded %d recorded calls from %d cassette files", len(entries), len(paths))
+        return entries
+
+    def sleep(self, seconds: float) -> None:
+        if self.latency_scale > 0 and seconds > 0:
+            time.sleep(seconds * self.latency_scale)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "mode": self.mode,
+            "recorded": self.recorded,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+cassette = Cassette(
+    settings.CASSETTE_DIR, settings.CASSETTE_MODE, settings.CASSETTE_LATENCY_SCALE
+)
+
+
+# Stored in place of the auth tokens PocketBase issues
+REDACTED_TOKEN = "<redacted>"
+
+
+def _is_auth_call(path: str) -> bool:
+    # auth-refresh, auth-with-password, auth-with-oauth2, ...
+    return "/auth-" in path
+
+
+class CassettePocketBase(PocketBase):
+    """
+    A PocketBase client whose HTTP calls are recorded to, or replayed from, the cassette.
+    Headers are not part of the key, so most recordings replay for any user. Auth calls
+    are the exception: their key includes a hash of the presented token (and the
+    credentials in the body), so they only replay for the same token or password, and
+    the tokens they issue are not stored.
+    """
+
+    def send(self, path: str, req_config: Dict[str, Any]) -> Any:
+        parts = [
+            req_config.get("method", "GET"),
+            path,
+            req_config.get("params"),
+            req_config.get("body"),
+        ]
+        auth_call = _is_auth_call(path)
+        token = (req_config.get("headers") or {}).get("Authorization") or self.auth_store.token
+        if auth_call:
+            parts.append(hashlib.sha256(token.encode("utf-8")).hexdigest() if token else None)
+        key = cassette.key("pocketbase", *parts)
+        if cassette.replaying:
+            entry = cassette.replay("pocketbase", key)
+            cassette.sleep(entry["elapsed"])
+            error = entry.get("error")
+            if error is not None:
+                raise ClientResponseError(
+                    error["message"],
+                    url=self.build_url(path),
+                    status=error["status"],
+                    data=error["data"],
+                )
+            response = entry["response"]
+            if auth_call and isinstance(response, dict) and "token" in response:
+                # A refresh hands back the token it was called with
+                response = {**response, "token": token or REDACTED_TOKEN}
+            return response
+
+        start = time.monotonic()
+        try:
+            response = super().send(path, req_config)
+        except ClientResponseError as e:
+            cassette.record(
+                "pocketbase",
+                key,
+                elapsed=time.monotonic() - start,
+                error={"message": str(e), "status": e.status, "data": e.data},
+            )
+            raise
+        recorded = response
+        if auth_call and isinstance(response, dict) and "token" in response:
+            recorded = {**response, "token": REDACTED_TOKEN}
+        cassette.record("pocketbase", key, recorded, elapsed=time.monotonic() - start)
+        return response
+
+
+def pocketbase_client(url: str) -> PocketBase:
+    """
+    A PocketBase client for ``url`` that goes through the cassette when one is active.
+    """
+    if cassette.mode == Cassette.OFF:
+        return PocketBase(url)
+    return CassettePocketBase(url)
@@ -1,4 +1,6 @@
+import os
 import secrets
+import tempfile
 import warnings
 from typing import Annotated, Any, Literal
 from urllib.parse import quote_plus
@@ -49,7 +51,161 @@ class Settings(BaseSettings):
 
     PROJECT_NAME: str
     POCKETBASE_URL: str
-    
+
+    SMTP_TLS: bool = True
+    SMTP_SSL: bool = False
+    SMTP_PORT: int = 587
+    SMTP_HOST: str | None = None
+    SMTP_USER: str | None = None
+    SMTP_PASSWORD: str | None = None
+    EMAILS_FROM_EMAIL: str | None = None
+    EMAILS_FROM_NAME: str | None = None
+
+    @model_validator(mode="after")
+    def _set_default_emails_from(self) -> Self:
+        if not self.EMAILS_FROM_NAME:
+            self.EMAILS_FROM_NAME = self.PROJECT_NAME
+        return self
+
+    EMAIL_RESET_TOKEN_EXPIRE_HOURS: int = 48
+
+    @computed_field  # type: ignore[prop-decorator]
+    @property
+    def emails_enabled(self) -> bool:
+        return bool(self.SMTP_HOST and self.EMAILS_FROM_EMAIL)
+
+    # Compiled email templates are cached here across restarts
+    EMAIL_TEMPLATE_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "qa-email-templates")
+
+    # Background email outbox: messages are sent in batches of up to EMAIL_BATCH_SIZE
+    # over one SMTP connection, which is closed after EMAIL_IDLE_TIMEOUT idle seconds.
+    # EMAIL_SEND_SYNC sends on the calling thread instead, and is implied on AWS Lambda,
+    # which freezes background threads as soon as the response is returned
+    EMAIL_SEND_SYNC: bool = False
+    EMAIL_BATCH_SIZE: int = 50
+    EMAIL_FLUSH_INTERVAL: float = 2.0
+    EMAIL_MAX_RETRIES: int = 3
+    EMAIL_IDLE_TIMEOUT: float = 30.0
+    NOTIFY_IMPORT_COMPLETE: bool = True
+
+    # Logging: JSON lines on stdout; LOG_SAMPLING maps logger names to the share of
+    # their sub-WARNING records to keep, e.g. {"app.core.llm": 0.1}
+    LOG_LEVEL: str = "INFO"
+    LOG_JSON: bool = True
+    LOG_SAMPLING: dict[str, float] = {}
+
+    # Execution pools per worker; 0 CPU workers means one less than the CPU count.
+    # The I/O pool serves short calls (authentication, PocketBase reads, downloads);
+    # the job pool runs whole generations, which hold a thread until they finish.
+    IO_POOL_SIZE: int = 64
+    JOB_POOL_SIZE: int = 32
+    LLM_POOL_SIZE: int = 16
+    CPU_POOL_SIZE: int = 0
+
+    # Uvicorn workers; 0 sizes from CPU count and WORKER_MEMORY_MB per worker
+    WEB_CONCURRENCY: int = 0
+    WORKER_MEMORY_MB: int = 512
+
+    # Per-worker LLM throttling (0 = unlimited)
+    LLM_MAX_RPM: int = 0
+    LLM_MAX_TPM: int = 0
+
+    # Imports estimated to exceed these are rejected before any LLM call (0 = no limit)
+    IMPORT_MAX_LLM_CALLS: int = 0
+    IMPORT_MAX_COST_USD: float = 0.0
+
+    # LLM request hedging: duplicate a request that is slower than the given
+    # percentile of recent latencies, for at most LLM_HEDGE_BUDGET_PCT of requests
+    LLM_HEDGING: bool = False
+    LLM_HEDGE_PERCENTILE: float = 95.0
+    LLM_HEDGE_MIN_DELAY: float = 2.0
+    LLM_HEDGE_MAX_DELAY: float = 30.0
+    LLM_HEDGE_BUDGET_PCT: float = 5.0
+    LLM_HEDGE_MODEL: str | None = None
+
+    # LLM provider failover: a provider's circuit opens when LLM_BREAKER_FAILURE_RATE
+    # percent of its last LLM_BREAKER_WINDOW calls failed or took longer than
+    # LLM_BREAKER_SLOW_CALL_SECONDS; calls then go to the equivalent model below
+    LLM_REQUEST_TIMEOUT: float = 120.0
+    LLM_FAILOVER: bool = True
+    LLM_FAILOVER_MODELS: dict[str, str] = {
+        "gpt-4o": "groq-llama-3.1-70b",
+        "gpt-4": "groq-llama-3.1-70b",
+        "gpt-4o-mini": "groq-llama-3.1-8b",
+        "groq-llama-3.1-70b": "gpt-4o",
+        "groq-llama-3.1-8b": "gpt-4o-mini",
+    }
+    LLM_BREAKER_FAILURE_RATE: float = 50.0
+    LLM_BREAKER_SLOW_CALL_SECONDS: float = 60.0
+    LLM_BREAKER_MIN_CALLS: int = 10
+    LLM_BREAKER_WINDOW: int = 50
+    LLM_BREAKER_OPEN_SECONDS: float = 30.0
+
+    # Record/replay of LLM and PocketBase calls for offline load testing: "record"
+    # captures calls to CASSETTE_DIR, "replay" serves them back with their original
+    # latencies multiplied by CASSETTE_LATENCY_SCALE
+    CASSETTE_MODE: Literal["off", "record", "replay"] = "off"
+    CASSETTE_DIR: str = "cassettes"
+    CASSETTE_LATENCY_SCALE: float = 1.0
+
+    # Per-project index of BRD chunks; the most relevant chunks (up to RAG_TOP_K,
+    # RAG_TOKEN_BUDGET tokens in total) are added to test case prompts. The default
+    # directory is writable everywhere, including Lambda, but local to the host; point
+    # it at shared storage for every host to see every index
+    VECTOR_INDEX_DIR: str = os.path.join(tempfile.gettempdir(), "qa-vector-index")
+    EMBEDDER: Literal["hashing", "openai"] = "hashing"
+    EMBEDDING_DIM: int = 512
+    RAG_TOP_K: int = 3
+    RAG_TOKEN_BUDGET: int = 600
+    RAG_MIN_SCORE: float = 0.1
+
+    # Test case fan-out: one smaller LLM call per acceptance criterion and category,
+    # run in parallel, at most TEST_CASE_FANOUT_MAX_CALLS per user story
+    TEST_CASE_FANOUT: bool = False
+    TEST_CASE_FANOUT_MAX_CALLS: int = 16
+
+    # Test case reuse: an acceptance criterion at least TEST_CASE_REUSE_MIN_SCORE similar
+    # to one covered earlier in the project, with the same numbers and key terms, gets
+    # copies of its test cases instead of an LLM call; the per-project library is kept
+    # in TEST_CASE_LIBRARY_DIR (local to the host unless pointed at shared storage)
+    TEST_CASE_REUSE: bool = False
+    TEST_CASE_REUSE_MIN_SCORE: float = 0.88
+    TEST_CASE_LIBRARY_DIR: str = os.path.join(tempfile.gettempdir(), "qa-test-case-library")
+
+    # Deferred generation through the provider's batch API (lower price, results within
+    # the completion window, separate rate limits). Jobs are kept in PocketBase's
+    # batch_job collection. The "local" provider completes batches in-process through the
+    # normal LLM path after BATCH_API_LOCAL_DELAY seconds, for testing; it keeps its
+    # batches in BATCH_API_DIR, which must be shared storage (e.g. EFS on Lambda) when
+    # another worker or host may poll the job
+    BATCH_API_PROVIDER: Literal["openai", "local"] = "openai"
+    BATCH_API_DIR: str = os.path.join(tempfile.gettempdir(), "qa-batch-api")
+    BATCH_API_COMPLETION_WINDOW: str = "24h"
+    BATCH_API_LOCAL_DELAY: float = 0.0
+
+    # Opt-in profiling of single jobs (X-Profile header, or --profile in app.batch),
+    # allowed for the PocketBase user IDs or emails in PROFILING_ADMINS. Reports are
+    # written to PROFILE_DIR on the host that ran the job
+    PROFILING_ADMINS: Annotated[list[str] | str, BeforeValidator(parse_cors)] = []
+    PROFILE_DIR: str = os.path.join(tempfile.gettempdir(), "qa-profiles")
+    PROFILE_INTERVAL: float = 0.005
+    PROFILE_TOP_ALLOCATIONS: int = 25
+
+    # PDF parsing
+    PDF_PARALLEL_MIN_PAGES: int = 40
+
+    # BRD ingestion
+    BRD_MAX_BYTES: int = 50 * 1024 * 1024
+    BRD_CHUNK_SIZE: int = 1024 * 1024
+    BRD_DOWNLOAD_TIMEOUT: float = 30.0
+
+    # Lock/result files used to coalesce identical generation requests across workers
+    SINGLE_FLIGHT_DIR: str = os.path.join(tempfile.gettempdir(), "qa-single-flight")
+
+    # Server-side cache for the read endpoints; the directory holds invalidation stamps
+    READ_CACHE_TTL: float = 30.0
+    READ_CACHE_DIR: str = os.path.join(tempfile.gettempdir(), "qa-read-cache")
+
     
 
 
@@ -0,0 +1,209 @@
+import logging
+import os
+import queue
+import smtplib
+import socket
+import threading
+import time
+from email.message import EmailMessage
+from email.utils import formataddr
+from typing import Any, Dict, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the connection is unusable and the message should be retried.
+# Every SMTPException is an OSError, so socket errors are listed one by one.
+_CONNECTION_ERRORS = (
+    smtplib.SMTPServerDisconnected,
+    smtplib.SMTPConnectError,
+    ConnectionError,
+    TimeoutError,
+    socket.gaierror,
+)
+
+
+def running_on_lambda() -> bool:
+    # Set by the Lambda runtime, which freezes the process between invocations
+    return "AWS_LAMBDA_FUNCTION_NAME" in os.environ
+
+
+class EmailOutbox:
+    """
+    Sends emails from a background thread so request and job threads never wait on
+    SMTP. Queued messages are sent in batches over a single connection that is kept
+    open between batches and closed once idle. A message that fails because the
+    connection broke is retried on a new connection with exponential backoff; one the
+    server rejects is logged and dropped.
+
+    A ``synchronous`` outbox sends each message on the calling thread instead, for
+    deployments (AWS Lambda behind Mangum) where a background thread does not run once
+    the response has been returned.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 50,
+        flush_interval: float = 2.0,
+        max_retries: int = 3,
+        idle_timeout: float = 30.0,
+        synchronous: bool = False,
+    ):
+        self.synchronous = synchronous
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.idle_timeout = idle_timeout
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._connection: Optional[smtplib.SMTP] = None
+        self.sent = 0
+        self.failed = 0
+        self.batches = 0
+        self.connections = 0
+
+    def enqueue(self, email_to: str, subject: str, html_content: str) -> None:
+        """
+        Queues an email for delivery.
+        """
+        message = EmailMessage()
+        message["Subject"] = subject
+        message["From"] = formataddr((settings.EMAILS_FROM_NAME, settings.EMAILS_FROM_EMAIL))
+        message["To"] = email_to
+        message.set_content("This email requires an HTML capable client.")
+        message.add_alternative(html_content, subtype="html")
+        if self.synchronous:
+            with self._send_lock:
+                try:
+                    self._send_batch([message])
+                finally:
+                    self._disconnect()
+            return
+        self._queue.put(message)
+
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="email-outbox", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            try:
+                first = self._queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            if first is None:
+                self._disconnect()
+                return
+
+            # Gather whatever else arrives shortly after, up to a full batch
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while len(batch) < self.batch_size:
+                try:
+                    message = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if message is None:
+                    stop = True
+                    break
+                batch.append(message)
+
+            self._send_batch(batch)
+            if stop:
+                self._disconnect()
+                return
+
+    def _send_batch(self, batch: List[EmailMessage]) -> None:
+        self.batches += 1
+        for message in batch:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    refused = self._connect().send_message(message)
+                    if refused:
+                        logger.warning("Email to %s was refused for %s", message["To"], refused)
+                    self.sent += 1
+                    break
+                except _CONNECTION_ERRORS as e:
+                    # SMTPConnectError is also a response error; it is checked first so
+                    # the connection is retried
+                    self._disconnect()
+                    if attempt == self.max_retries:
+                        logger.error("Giving up on email to %s: %s", message["To"], e)
+                        self.failed += 1
+                    else:
+                        time.sleep(min(30.0, 2.0**attempt))
+                except smtplib.SMTPException as e:
+                    # The server refused the message, its recipients or the login
+                    # (SMTPResponseException, SMTPRecipientsRefused); a retry would get
+                    # the same answer
+                    logger.error("Email to %s was rejected: %s", message["To"], e)
+                    self.failed += 1
+                    break
+        logger.info("Sent %d queued emails", len(batch))
+
+    def _connect(self) -> smtplib.SMTP:
+        if self._connection is not None:
+            return self._connection
+        if settings.SMTP_SSL:
+            connection: smtplib.SMTP = smtplib.SMTP_SSL(
+                settings.SMTP_HOST, settings.SMTP_PORT, timeout=30
+            )
+        else:
+            connection = smtplib.SMTP(settings.SMTP_HOST, settings.SMTP_PORT, timeout=30)
+        try:
+            if settings.SMTP_TLS and not settings.SMTP_SSL:
+                connection.starttls()
+            if settings.SMTP_USER:
+                connection.login(settings.SMTP_USER, settings.SMTP_PASSWORD or "")
+        except BaseException:
+            # Don't leak the socket of a connection that never became usable
+            connection.close()
+            raise
+        self.connections += 1
+        self._connection = connection
+        return connection
+
+    def _disconnect(self) -> None:
+        if self._connection is None:
+            return
+        try:
+            self._connection.quit()
+        except (smtplib.SMTPException, OSError):
+            pass
+        self._connection = None
+
+    def close(self, timeout: float = 10.0) -> None:
+        """
+        Sends what is queued and stops the background thread.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "batches": self.batches,
+            "connections": self.connections,
+        }
+
+
+outbox = EmailOutbox(
+    batch_size=settings.EMAIL_BATCH_SIZE,
+    flush_interval=settings.EMAIL_FLUSH_INTERVAL,
+    max_retries=settings.EMAIL_MAX_RETRIES,
+    idle_timeout=settings.EMAIL_IDLE_TIMEOUT,
+    synchronous=settings.EMAIL_SEND_SYNC or running_on_lambda(),
+)
@@ -0,0 +1,185 @@
+import asyncio
+import contextvars
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.core.config import settings
+from app.core.profiling import run_profiled
+
+logger = logging.getLogger(__name__)
+
+
+class BoundedPool:
+    """
+    A fixed-size executor that keeps count of running and queued work so pool
+    saturation can be observed. Work submitted to a thread pool runs in a copy of the
+    submitter's context, so log correlation IDs and an active profile follow it.
+    """
+
+    def __init__(
+        self, name: str, executor: Executor, max_workers: int, copy_context: bool = True
+    ):
+        self.name = name
+        self.max_workers = max_workers
+        self.copy_context = copy_context
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._submitted = 0
+        self._completed = 0
+        self._failed = 0
+
+    def submit(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        with self._lock:
+            self._submitted += 1
+        if self.copy_context:
+            context = contextvars.copy_context()
+            future = self._executor.submit(context.run, run_profiled, fn, *args, **kwargs)
+        else:
+            future = self._executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future: Future) -> None:
+        with self._lock:
+            self._completed += 1
+            if not future.cancelled() and future.exception() is not None:
+                self._failed += 1
+
+    @property
+    def executor(self) -> Executor:
+        return self._executor
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = self._submitted - self._completed
+            completed, failed = self._completed, self._failed
+        active = min(pending, self.max_workers)
+        return {
+            "max_workers": self.max_workers,
+            "active": active,
+            "queued": pending - active,
+            "utilization": round(active / self.max_workers, 3),
+            "completed": completed,
+            "failed": failed,
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def cpu_workers() -> int:
+    return settings.CPU_POOL_SIZE or max(1, (os.cpu_count() or 1) - 1)
+
+
+class ExecutionPools:
+    """
+    The per-worker execution layer. Short blocking I/O (authentication, PocketBase
+    reads, downloads), long-running generation jobs, LLM calls and CPU-bound PDF parsing
+    each get their own bounded pool, so a burst of one kind of work cannot starve the
+    others. Pools are created on first use and shut down with the application.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools: Dict[str, BoundedPool] = {}
+        self._cpu_unavailable = False
+
+    def _get(self, name: str, factory: Callable[[], BoundedPool]) -> BoundedPool:
+        pool = self._pools.get(name)
+        if pool is None:
+            with self._lock:
+                pool = self._pools.get(name)
+                if pool is None:
+                    pool = self._pools[name] = factory()
+                    logger.info("Started %s pool with %d workers", name, pool.max_workers)
+        return pool
+
+    def _thread_pool(self, name: str, size: int) -> BoundedPool:
+        return BoundedPool(
+            name, ThreadPoolExecutor(max_workers=size, thread_name_prefix=name), size
+        )
+
+    @property
+    def io(self) -> BoundedPool:
+        return self._get("io", lambda: self._thread_pool("io", settings.IO_POOL_SIZE))
+
+    @property
+    def jobs(self) -> BoundedPool:
+        """
+        Runs request orchestration that blocks for a whole generation (single-flight
+        waits, LLM futures). Jobs may wait on the other pools, never the reverse.
+        """
+        return self._get("jobs", lambda: self._thread_pool("jobs", settings.JOB_POOL_SIZE))
+
+    @property
+    def llm(self) -> BoundedPool:
+        return self._get("llm", lambda: self._thread_pool("llm", settings.LLM_POOL_SIZE))
+
+    @property
+    def cpu(self) -> Optional[BoundedPool]:
+        """
+        The process pool for CPU-bound work, or None where processes cannot be started
+        (e.g. AWS Lambda has no /dev/shm); callers then do the work in-process.
+        """
+        if self._cpu_unavailable:
+            return None
+        try:
+            return self._get(
+                "cpu",
+                lambda: BoundedPool(
+                    "cpu",
+                    # spawn keeps the workers clear of locks held by the server's threads
+                    ProcessPoolExecutor(
+                        max_workers=cpu_workers(),
+                        mp_context=multiprocessing.get_context("spawn"),
+                    ),
+                    cpu_workers(),
+                    # Contexts cannot be pickled to another process
+                    copy_context=False,
+                ),
+            )
+        except (OSError, NotImplementedError) as e:
+            logger.warning("CPU process pool unavailable: %s", e)
+            self._cpu_unavailable = True
+            return None
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: pool.stats() for name, pool in self._pools.items()}
+
+    def shutdown(self, wait: bool = True) -> None:
+        with self._lock:
+            pools, self._pools = self._pools, {}
+        for name, pool in pools.items():
+            logger.info("Shutting down %s pool", name)
+            pool.shutdown(wait=wait)
+
+
+pools = ExecutionPools()
+
+
+async def run_in_pool(pool: BoundedPool, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Runs a blocking function on a pool without blocking the event loop.
+    """
+    return await asyncio.wrap_future(pool.submit(fn, *args, **kwargs))
+
+
+def web_concurrency() -> int:
+    """
+    Number of uvicorn workers: WEB_CONCURRENCY if set, otherwise one per core (plus one),
+    capped by how many workers fit in memory at WORKER_MEMORY_MB each.
+    """
+    if settings.WEB_CONCURRENCY:
+        return settings.WEB_CONCURRENCY
+
+    by_cpu = (os.cpu_count() or 1) + 1
+    try:
+        memory = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return by_cpu
+    by_memory = memory // (settings.WORKER_MEMORY_MB * 1024 * 1024)
+    return max(1, min(by_cpu, by_memory))
@@ -1,32 +1,636 @@
+import contextvars
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Future
 from functools import cache
-from typing import TypeAlias
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple, TypeAlias, TypeVar
 
 from langchain_groq import ChatGroq
 from langchain_openai import ChatOpenAI
 
-from app.schemas.llm_models import OpenAIModelName, GroqModelName, AllModelEnum
+from app.core.cassette import cassette
+from app.core.config import settings
+from app.core.executors import pools
+from app.core.tokens import estimate_tokens
+from app.schemas.llm_models import OpenAIModelName, GroqModelName, AllModelEnum, Provider
+
+logger = logging.getLogger(__name__)
 
 _MODEL_TABLE = {
     OpenAIModelName.GPT_4O_MINI: "gpt-4o-mini",
     OpenAIModelName.GPT_4O: "gpt-4o",
+    OpenAIModelName.GPT_4: "gpt-4",
     GroqModelName.LLAMA_31_8B: "llama-3.1-8b-instant",
     GroqModelName.LLAMA_31_70B: "llama-3.1-70b-versatile",
     GroqModelName.LLAMA_GUARD_3_8B: "llama-guard-3-8b",
 }
 
 ModelT: TypeAlias = ChatOpenAI | ChatGroq
+T = TypeVar("T")
+
+
+def resolve_model(name: str | AllModelEnum) -> AllModelEnum:
+    """
+    Looks up a model by its enum value (e.g. ``"gpt-4o-mini"``).
+    """
+    if isinstance(name, (OpenAIModelName, GroqModelName)):
+        return name
+    for enum in (OpenAIModelName, GroqModelName):
+        try:
+            return enum(name)
+        except ValueError:
+            pass
+    raise ValueError(f"Unsupported model: {name}")
+
+
+def api_model_name(model: AllModelEnum) -> str:
+    """
+    The provider's name for a model, e.g. ``"llama-3.1-8b-instant"``.
+    """
+    return _MODEL_TABLE[model]
 
 
 @cache
-def get_model(model_name: AllModelEnum, /) -> ModelT:
+def get_model(model_name: AllModelEnum, /, temperature: float = 0.5) -> ModelT:
     # NOTE: models with streaming=True will send tokens as they are generated
     # if the /stream endpoint is called with stream_tokens=True (the default)
     api_model_name = _MODEL_TABLE.get(model_name)
 
-    if model_name in OpenAIModelName:
-        return ChatOpenAI(model=api_model_name, temperature=0.5, streaming=True)
-    if model_name in GroqModelName:
+    # A bounded timeout and no client-side retries: failures reach the circuit breaker
+    # quickly instead of holding a pool thread through a provider outage
+    timeout = settings.LLM_REQUEST_TIMEOUT
+
+    if isinstance(model_name, OpenAIModelName):
+        return ChatOpenAI(
+            model=api_model_name,
+            temperature=temperature,
+            streaming=True,
+            timeout=timeout,
+            max_retries=0,
+        )
+    if isinstance(model_name, GroqModelName):
         if model_name == GroqModelName.LLAMA_GUARD_3_8B:
-            return ChatGroq(model=api_model_name, temperature=0.0)
-        return ChatGroq(model=api_model_name, temperature=0.5)
+            return ChatGroq(model=api_model_name, temperature=0.0, timeout=timeout, max_retries=0)
+        return ChatGroq(
+            model=api_model_name, temperature=temperature, timeout=timeout, max_retries=0
+        )
     raise ValueError(f"Unsupported model: {model_name}")
+
+
+def provider_of(model: AllModelEnum) -> Provider:
+    return Provider.OPENAI if isinstance(model, OpenAIModelName) else Provider.GROQ
+
+
+def failover_model(model: AllModelEnum) -> Optional[AllModelEnum]:
+    """
+    The configured equivalent of ``model`` on another provider, if any.
+    """
+    if not settings.LLM_FAILOVER:
+        return None
+    target = settings.LLM_FAILOVER_MODELS.get(model.value)
+    return resolve_model(target) if target else None
+
+
+class CircuitOpenError(RuntimeError):
+    """
+    Raised when a model's provider, and its failover, are both rejecting calls.
+    """
+
+
+class ProviderError(RuntimeError):
+    """
+    Wraps an exception raised by the provider (as opposed to by parsing its reply).
+    """
+
+
+class CircuitBreaker:
+    """
+    Tracks the outcome of the last ``window`` calls to a provider. When at least
+    ``min_calls`` have been made and the share of failed or slow calls reaches
+    ``failure_rate`` percent, the breaker opens and calls are rejected for
+    ``open_seconds``. It then goes half-open and lets a single probe through: success
+    closes it again, failure re-opens it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    # Permits: an ordinary call, or the single probe of a half-open breaker
+    CALL = "call"
+    PROBE = "probe"
+
+    def __init__(
+        self,
+        name: str,
+        failure_rate: float,
+        slow_call_seconds: float,
+        min_calls: int,
+        window: int,
+        open_seconds: float,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._lock = threading.Lock()
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        self.rejected = 0
+        self.opened = 0
+
+    def _current_state(self) -> str:
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._state = self.HALF_OPEN
+            self._probing = False
+        return self._state
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def acquire(self) -> Optional[str]:
+        """
+        Returns a permit (``CALL`` or ``PROBE``) if a call may be made now, otherwise
+        None. A permit must be passed back to ``record`` or ``release``.
+        """
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return self.CALL
+            if state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return self.PROBE
+            self.rejected += 1
+            return None
+
+    def release(self, permit: str) -> None:
+        """
+        Gives back a permit whose call never ran (e.g. it was cancelled while queued).
+        """
+        if permit == self.PROBE:
+            with self._lock:
+                self._probing = False
+
+    def record(self, ok: bool, seconds: float, permit: str = CALL) -> None:
+        failed = not ok or seconds >= self.slow_call_seconds
+        with self._lock:
+            state = self._current_state()
+            if permit == self.PROBE:
+                self._probing = False
+                if failed:
+                    self._trip()
+                else:
+                    logger.info("Circuit for %s closed", self.name)
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                return
+            if state != self.CLOSED:
+                # A call let through before the breaker opened says nothing about the probe
+                return
+
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls:
+                rate = 100.0 * sum(self._outcomes) / len(self._outcomes)
+                if rate >= self.failure_rate:
+                    self._trip()
+
+    def _trip(self) -> None:
+        logger.warning("Circuit for %s opened", self.name)
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._outcomes.clear()
+        self.opened += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            outcomes = list(self._outcomes)
+            return {
+                "state": self._current_state(),
+                "calls": len(outcomes),
+                "failure_rate": round(100.0 * sum(outcomes) / len(outcomes), 2) if outcomes else 0.0,
+                "times_opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class _Scheduler:
+    """
+    A single daemon thread that runs callbacks after a delay, so pending hedges do not
+    each hold a thread while they wait for their deadline.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._queue: List[tuple] = []
+        self._counter = itertools.count()
+        self._thread: Optional[threading.Thread] = None
+
+    def call_later(self, delay: float, fn: Callable[[], None]) -> None:
+        with self._condition:
+            heapq.heappush(self._queue, (time.monotonic() + delay, next(self._counter), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="llm-scheduler", daemon=True
+                )
+                self._thread.start()
+            self._condition.notify()
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                    self._condition.wait(timeout)
+                _, _, fn = heapq.heappop(self._queue)
+            try:
+                fn()
+            except Exception:
+                logger.exception("Scheduled LLM callback failed")
+
+
+class LatencyTracker:
+    """
+    Rolling window of latencies per model and metric (``"ttft"`` for time to first
+    token, ``"total"`` for the whole completion), used to pick hedge deadlines.
+    """
+
+    def __init__(self, window: int = 256):
+        self._lock = threading.Lock()
+        self._samples: Dict[tuple, Deque[float]] = defaultdict(
+            lambda: deque(maxlen=window)
+        )
+
+    def record(self, model: AllModelEnum, metric: str, seconds: float) -> None:
+        with self._lock:
+            self._samples[(model, metric)].append(seconds)
+
+    def percentile(
+        self, model: AllModelEnum, metric: str, pct: float, min_samples: int = 20
+    ) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._samples[(model, metric)])
+        if len(samples) < min_samples:
+            return None
+        index = min(len(samples) - 1, int(len(samples) * pct / 100.0))
+        return samples[index]
+
+
+class HedgeBudget:
+    """
+    Token bucket capping hedged requests at ``pct`` percent of all requests: every
+    request earns ``pct / 100`` of a token and every hedge spends a whole one.
+    """
+
+    def __init__(self, pct: float, burst: float = 5.0):
+        self.rate = pct / 100.0
+        self.burst = burst
+        self._tokens = burst
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+
+    def earn(self) -> None:
+        with self._lock:
+            self.requests += 1
+            self._tokens = min(self.burst, self._tokens + self.rate)
+
+    def try_spend(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            self.hedges += 1
+            return True
+
+
+class RateLimiter:
+    """
+    Token buckets for requests and tokens per minute, shared by every LLM call in the
+    worker. ``acquire`` blocks until the request fits; completion tokens are charged
+    after the fact, so the token bucket may go into debt and delay later requests.
+    A limit of 0 disables that bucket.
+    """
+
+    def __init__(self, rpm: int, tpm: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._lock = threading.Lock()
+        self._requests = float(rpm)
+        self._tokens = float(tpm)
+        self._updated = time.monotonic()
+        self.waited = 0.0
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed, self._updated = now - self._updated, now
+        if self.rpm:
+            self._requests = min(self.rpm, self._requests + elapsed * self.rpm / 60.0)
+        if self.tpm:
+            self._tokens = min(self.tpm, self._tokens + elapsed * self.tpm / 60.0)
+
+    def acquire(self, tokens: int) -> None:
+        # A single request larger than the whole bucket only has to wait for a full one
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                self._refill()
+                wait = 0.0
+                if self.rpm and self._requests < 1.0:
+                    wait = (1.0 - self._requests) * 60.0 / self.rpm
+                if self.tpm and self._tokens < tokens:
+                    wait = max(wait, (tokens - self._tokens) * 60.0 / self.tpm)
+                if wait <= 0:
+                    if self.rpm:
+                        self._requests -= 1.0
+                    if self.tpm:
+                        self._tokens -= tokens
+                    return
+                self.waited += wait
+            time.sleep(wait)
+
+    def consume(self, tokens: int) -> None:
+        if not self.tpm:
+            return
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+
+
+class LLMCaller:
+    """
+    The single entry point for LLM completions. Every attempt runs on the worker's
+    bounded LLM pool and streams, so time-to-first-token is known.
+
+    Each provider has a circuit breaker. A model whose provider's breaker is open is
+    swapped for its configured failover model, and an attempt that fails with a
+    provider error is retried once on the failover model, so an outage reroutes or
+    fails fast instead of tying up pool threads.
+
+    With hedging enabled, a request that has produced no token by the configured
+    percentile of recent time-to-first-token, or has not finished by the same
+    percentile of recent completion times, gets a duplicate sent to the same model
+    (or LLM_HEDGE_MODEL), as long as the hedge budget allows. The first attempt that
+    returns a result ``parse`` accepts wins and the other is cancelled; an attempt
+    already in flight cannot be interrupted, so it finishes on its pool thread and
+    its result is dropped.
+    """
+
+    def __init__(self):
+        self.latency = LatencyTracker()
+        self.budget = HedgeBudget(settings.LLM_HEDGE_BUDGET_PCT)
+        self._scheduler = _Scheduler()
+        self.breakers = {
+            provider: CircuitBreaker(
+                provider.value,
+                failure_rate=settings.LLM_BREAKER_FAILURE_RATE,
+                slow_call_seconds=settings.LLM_BREAKER_SLOW_CALL_SECONDS,
+                min_calls=settings.LLM_BREAKER_MIN_CALLS,
+                window=settings.LLM_BREAKER_WINDOW,
+                open_seconds=settings.LLM_BREAKER_OPEN_SECONDS,
+            )
+            for provider in Provider
+        }
+        self.failovers = 0
+        self.limiter = RateLimiter(settings.LLM_MAX_RPM, settings.LLM_MAX_TPM)
+
+    def _route(self, model: AllModelEnum) -> Tuple[AllModelEnum, str]:
+        """
+        Picks the model to call: ``model`` if its provider accepts calls, otherwise its
+        failover. Returns it with the breaker permit taken for it.
+        """
+        permit = self.breakers[provider_of(model)].acquire()
+        if permit is not None:
+            return model, permit
+        fallback = failover_model(model)
+        if fallback is not None:
+            permit = self.breakers[provider_of(fallback)].acquire()
+            if permit is not None:
+                logger.warning("Routing %s request to %s", model.value, fallback.value)
+                self.failovers += 1
+                return fallback, permit
+        raise CircuitOpenError(f"No provider available for {model.value}")
+
+    def _attempt(
+        self,
+        model: AllModelEnum,
+        temperature: float,
+        prompt: str,
+        parse: Callable[[str], T],
+        first_token: threading.Event,
+        permit: str,
+        on_start: Optional[Callable[[], None]] = None,
+    ) -> T:
+        self.limiter.acquire(estimate_tokens(prompt))
+        if on_start is not None:
+            on_start()
+        breaker = self.breakers[provider_of(model)]
+        start = time.monotonic()
+        ttft = None
+
+        def on_first_token() -> None:
+            nonlocal ttft
+            ttft = time.monotonic() - start
+            first_token.set()
+            self.latency.record(model, "ttft", ttft)
+
+        key = cassette.key("llm", model.value, temperature, prompt)
+        try:
+            if cassette.replaying:
+                text = self._replay(key, on_first_token)
+            else:
+                text = self._stream(model, temperature, prompt, on_first_token)
+        except Exception as e:
+            elapsed = time.monotonic() - start
+            breaker.record(False, elapsed, permit)
+            if cassette.recording:
+                cassette.record("llm", key, elapsed=elapsed, error={"message": str(e)})
+            raise ProviderError(f"{model.value}: {e}") from e
+        elapsed = time.monotonic() - start
+        breaker.record(True, elapsed, permit)
+        self.latency.record(model, "total", elapsed)
+        if cassette.recording:
+            cassette.record("llm", key, text, elapsed=elapsed, ttft=ttft)
+        self.limiter.consume(estimate_tokens(text))
+        return parse(text)
+
+    @staticmethod
+    def _stream(
+        model: AllModelEnum,
+        temperature: float,
+        prompt: str,
+        on_first_token: Callable[[], None],
+    ) -> str:
+        llm = get_model(model, temperature=temperature)
+        parts = []
+        for chunk in llm.stream(prompt):
+            if not parts:
+                on_first_token()
+            parts.append(chunk.content)
+        return "".join(parts)
+
+    @staticmethod
+    def _replay(key: str, on_first_token: Callable[[], None]) -> str:
+        entry = cassette.replay("llm", key)
+        ttft = entry.get("ttft") or 0.0
+        cassette.sleep(ttft)
+        if "error" in entry:
+            cassette.sleep(entry["elapsed"] - ttft)
+            raise RuntimeError(entry["error"]["message"])
+        on_first_token()
+        cassette.sleep(entry["elapsed"] - ttft)
+        return entry["response"]
+
+    def _hedge_delay(self, model: AllModelEnum, metric: str) -> Optional[float]:
+        observed = self.latency.percentile(model, metric, settings.LLM_HEDGE_PERCENTILE)
+        if observed is None:
+            # Without enough history only a request with no token at all is hedged
+            return settings.LLM_HEDGE_MAX_DELAY if metric == "ttft" else None
+        return max(settings.LLM_HEDGE_MIN_DELAY, observed)
+
+    def submit(
+        self,
+        model: AllModelEnum,
+        prompt: str,
+        parse: Callable[[str], T],
+        temperature: float = 0.5,
+    ) -> "Future[T]":
+        """
+        Starts a completion and returns a future for its parsed result.
+
+        :param model: The model to use.
+        :param prompt: The fully formatted prompt.
+        :param parse: Turns the completion text into the result; raising marks the attempt invalid.
+        :param temperature: Sampling temperature.
+        :return: A future resolving to the first valid result.
+        :raises CircuitOpenError: Through the future, when no provider accepts the call.
+        """
+        result: Future = Future()
+        attempts: List[Future] = []
+        # Re-entrant: cancelling the losing attempt runs its done callback synchronously
+        lock = threading.RLock()
+        failed_over = False
+        self.budget.earn()
+
+        def launch(
+            requested_model: AllModelEnum, on_start: Optional[Callable[[], None]] = None
+        ) -> None:
+            attempt_model, permit = self._route(requested_model)
+            breaker = self.breakers[provider_of(attempt_model)]
+            first_token = threading.Event()
+            future = pools.llm.submit(
+                self._attempt,
+                attempt_model,
+                temperature,
+                prompt,
+                parse,
+                first_token,
+                permit,
+                on_start,
+            )
+            future.first_token = first_token
+            future.model = attempt_model
+            with lock:
+                attempts.append(future)
+            future.add_done_callback(lambda f: breaker.release(permit) if f.cancelled() else None)
+            future.add_done_callback(settle)
+
+        def settle(future: Future) -> None:
+            nonlocal failed_over
+            with lock:
+                if result.done() or future.cancelled():
+                    return
+                error = future.exception()
+                if error is None:
+                    result.set_result(future.result())
+                    for other in attempts:
+                        if other is not future:
+                            other.cancel()
+                    return
+                if all(attempt.done() for attempt in attempts):
+                    fallback = failover_model(future.model)
+                    if isinstance(error, ProviderError) and fallback and not failed_over:
+                        failed_over = True
+                        try:
+                            logger.warning(
+                                "%s failed, retrying on %s", future.model.value, fallback.value
+                            )
+                            self.failovers += 1
+                            launch(fallback)
+                            return
+                        except CircuitOpenError:
+                            pass
+                    result.set_exception(error)
+
+        def maybe_hedge(metric: str) -> None:
+            with lock:
+                if result.done() or len(attempts) != 1:
+                    return
+                primary = attempts[0]
+                if metric == "ttft" and primary.first_token.is_set():
+                    return
+            if not self.budget.try_spend():
+                return
+            hedge_model = (
+                resolve_model(settings.LLM_HEDGE_MODEL) if settings.LLM_HEDGE_MODEL else model
+            )
+            logger.info("Hedging %s request with %s", model.value, hedge_model.value)
+            try:
+                launch(hedge_model)
+            except CircuitOpenError:
+                pass
+
+        # Hedges are launched from the scheduler thread, in the caller's log context
+        context = contextvars.copy_context()
+
+        def schedule_hedges() -> None:
+            # The hedge clocks start when the request goes out: time queued for the pool
+            # or the rate limiter is not a provider stall
+            for metric in ("ttft", "total"):
+                delay = self._hedge_delay(model, metric)
+                if delay is not None:
+                    self._scheduler.call_later(
+                        delay, lambda m=metric: context.run(maybe_hedge, m)
+                    )
+
+        try:
+            launch(model, schedule_hedges if settings.LLM_HEDGING else None)
+        except CircuitOpenError as e:
+            result.set_exception(e)
+            return result
+        return result
+
+    def call(
+        self,
+        model: AllModelEnum,
+        prompt: str,
+        parse: Callable[[str], T],
+        temperature: float = 0.5,
+    ) -> T:
+        """
+        Runs a completion and waits for its parsed result. See ``submit``.
+        """
+        return self.submit(model, prompt, parse, temperature).result()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hedging": settings.LLM_HEDGING,
+            "requests": self.budget.requests,
+            "hedged_requests": self.budget.hedges,
+            "failovers": self.failovers,
+            "rate_limit_wait_seconds": round(self.limiter.waited, 3),
+            "breakers": {
+                provider.value: breaker.stats() for provider, breaker in self.breakers.items()
+            },
+        }
+
+
+llm_caller = LLMCaller()
@@ -0,0 +1,248 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# The profile of the job the current code is working for; carried into pool threads
+# with the rest of the context
+_active_profile: contextvars.ContextVar[Optional["Profile"]] = contextvars.ContextVar(
+    "profile", default=None
+)
+
+# tracemalloc is process-wide, so only one job is profiled at a time
+_profiling_lock = threading.Lock()
+
+# The files written for each profile, by kind
+PROFILE_FILES = {
+    "flamegraph": ".folded",
+    "allocations": ".allocations.txt",
+    "summary": ".json",
+}
+
+
+class ProfilerBusyError(RuntimeError):
+    """
+    Raised when a profile is requested while another job is being profiled.
+    """
+
+
+def active_profile() -> Optional["Profile"]:
+    return _active_profile.get()
+
+
+def profile_paths(directory: str, job_id: str) -> Dict[str, str]:
+    return {
+        kind: os.path.join(directory, f"{job_id}{suffix}") for kind, suffix in PROFILE_FILES.items()
+    }
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Profile:
+    """
+    Profiles one job: a background thread samples the stacks of the threads working on
+    it, and tracemalloc traces allocations. Threads join the profile while they run the
+    job's work (see ``thread``), so concurrent requests stay out of the stacks; the
+    allocation report covers the whole process.
+
+    Three files are written to ``directory`` when the profile finishes:
+    ``<job_id>.folded`` (collapsed stacks, for flamegraph.pl or speedscope),
+    ``<job_id>.allocations.txt`` and a ``<job_id>.json`` summary.
+    """
+
+    def __init__(
+        self,
+        job_id: str,
+        directory: str,
+        interval: float = 0.005,
+        top_allocations: int = 25,
+        traceback_frames: int = 10,
+    ):
+        self.job_id = job_id
+        self.directory = directory
+        self.interval = interval
+        self.top_allocations = top_allocations
+        self.traceback_frames = traceback_frames
+        self.paths = profile_paths(directory, job_id)
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self._threads: Dict[int, List] = {}
+        self._threads_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+        self._started_tracemalloc = False
+        self._baseline: Optional[tracemalloc.Snapshot] = None
+        self._start = 0.0
+
+    @contextmanager
+    def thread(self) -> Iterator[None]:
+        """
+        Includes the current thread in the stack samples for the duration of the block.
+        """
+        ident = threading.get_ident()
+        with self._threads_lock:
+            entry = self._threads.setdefault(ident, [threading.current_thread().name, 0])
+            entry[1] += 1
+        try:
+            yield
+        finally:
+            with self._threads_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._threads[ident]
+
+    def start(self) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.traceback_frames)
+            self._started_tracemalloc = True
+        tracemalloc.reset_peak()
+        self._baseline = tracemalloc.take_snapshot()
+        self._start = time.monotonic()
+        self._sampler = threading.Thread(
+            target=self._sample, name=f"profiler-{self.job_id[:8]}", daemon=True
+        )
+        self._sampler.start()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._threads_lock:
+                threads = [(ident, entry[0]) for ident, entry in self._threads.items()]
+            for ident, thread_name in threads:
+                frame = frames.get(ident)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                if stack:
+                    # The pool name is the root frame, so time spent waiting on another
+                    # pool shows up side by side with the work itself
+                    stack.append(thread_name.rsplit("_", 1)[0])
+                    self.samples[";".join(reversed(stack))] += 1
+            self.sample_count += 1
+
+    def finish(self) -> dict:
+        """
+        Stops sampling and tracing and writes the reports.
+
+        :return: The summary.
+        """
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        elapsed = time.monotonic() - self._start
+
+        snapshot = tracemalloc.take_snapshot().filter_traces(
+            [
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            ]
+        )
+        current, peak = tracemalloc.get_traced_memory()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        growth = snapshot.compare_to(self._baseline, "traceback")[: self.top_allocations]
+
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.paths["flamegraph"], "w") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+
+        with open(self.paths["allocations"], "w") as f:
+            f.write(f"Peak traced memory: {peak / 2**20:.1f} MiB\n")
+            f.write(f"Traced memory at the end: {current / 2**20:.1f} MiB\n\n")
+            f.write(f"Top {len(growth)} allocation sites by memory still held at the end:\n")
+            for stat in growth:
+                f.write(
+                    f"\n{stat.size_diff / 2**10:+.1f} KiB in {stat.count_diff:+d} blocks "
+                    f"({stat.size / 2**10:.1f} KiB held)\n"
+                )
+                for line in stat.traceback.format(most_recent_first=True):
+                    f.write(f"  {line}\n")
+
+        own_time: Counter = Counter()
+        for stack, count in self.samples.items():
+            own_time[stack.rsplit(";", 1)[-1]] += count
+        summary = {
+            "job_id": self.job_id,
+            "seconds": round(elapsed, 3),
+            "sample_interval": self.interval,
+            "samples": self.sample_count,
+            "peak_memory_bytes": peak,
+            "top_functions": [
+                {"function": name, "samples": count} for name, count in own_time.most_common(20)
+            ],
+            "files": self.paths,
+        }
+        with open(self.paths["summary"], "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(
+            "Profiled job %s: %d samples over %.1fs, peak %.1f MiB",
+            self.job_id,
+            self.sample_count,
+            elapsed,
+            peak / 2**20,
+        )
+        return summary
+
+
+@contextmanager
+def profiled(job_id: str, enabled: bool = True) -> Iterator[Optional[Profile]]:
+    """
+    Profiles the block, including the work it hands to the I/O and LLM pools, if
+    ``enabled``; otherwise yields None and costs nothing.
+
+    :raises ProfilerBusyError: If another job is being profiled.
+    """
+    if not enabled:
+        yield None
+        return
+    if not _profiling_lock.acquire(blocking=False):
+        raise ProfilerBusyError("Another job is being profiled, try again later")
+
+    profile = Profile(
+        job_id,
+        settings.PROFILE_DIR,
+        interval=settings.PROFILE_INTERVAL,
+        top_allocations=settings.PROFILE_TOP_ALLOCATIONS,
+    )
+    token = _active_profile.set(profile)
+    try:
+        profile.start()
+        with profile.thread():
+            yield profile
+    finally:
+        _active_profile.reset(token)
+        try:
+            profile.finish()
+        except Exception:
+            logger.exception("Could not write the profile of job %s", job_id)
+        finally:
+            _profiling_lock.release()
+
+
+def run_profiled(fn, *args, **kwargs):
+    """
+    Calls ``fn``, as part of the active profile if there is one. Pool threads run their
+    work through this.
+    """
+    profile = _active_profile.get()
+    if profile is None:
+        return fn(*args, **kwargs)
+    with profile.thread():
+        return fn(*args, **kwargs)
@@ -0,0 +1,159 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalesce within the process only
+    fcntl = None
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: the first caller runs the work and
+    every caller that arrives while it is running gets the same result.
+
+    Within a process callers wait on a shared future. Across uvicorn workers on the same
+    host an exclusive file lock stands in for a distributed lock: a worker that finds the
+    lock held waits for it, then picks up the JSON result the holder wrote. Results must
+    therefore be JSON serializable. Waiting workers also hold a shared lock on a second
+    file, so the last one to read a result can tell and delete it: results hold
+    generated content and are not kept beyond the call.
+    """
+
+    def __init__(self, lock_dir: str):
+        self.lock_dir = lock_dir
+        self._lock = threading.Lock()
+        self._calls: Dict[str, Future] = {}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        Runs ``fn`` unless an identical call is already in flight, in which case its result
+        (or exception) is returned instead.
+
+        :param key: Identifies the unit of work, e.g. ``"test_case:<user_story_id>"``.
+        :param fn: The work to run.
+        :return: The result of ``fn``, possibly from another caller's execution.
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+
+        if not leader:
+            logger.info("Joining in-flight call %s", key)
+            return call.result()
+
+        try:
+            result = self._do_across_workers(key, fn)
+            call.set_result(result)
+            return result
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+    def _do_across_workers(self, key: str, fn: Callable[[], Any]) -> Any:
+        if fcntl is None:
+            return fn()
+
+        os.makedirs(self.lock_dir, exist_ok=True)
+        base = os.path.join(self.lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest())
+        result_path = base + ".json"
+
+        with open(base + ".lock", "a+") as lock_file, open(base + ".waiters", "a+") as waiters:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is running the same work; wait for it and reuse its result
+                fcntl.flock(waiters, fcntl.LOCK_SH)
+                waiting_since = time.time()
+                logger.info("Waiting for call %s in another worker", key)
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                found = False
+                try:
+                    written = os.path.getmtime(result_path)
+                    if written >= waiting_since:
+                        with open(result_path) as f:
+                            result = json.load(f)
+                        found = True
+                except (OSError, ValueError):
+                    pass
+                fcntl.flock(waiters, fcntl.LOCK_UN)
+                if found:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                    self._drop_result(waiters, result_path, written)
+                    return result
+                # The other worker failed; run the work ourselves while holding the lock
+
+            try:
+                result = fn()
+                tmp_path = f"{result_path}.{os.getpid()}"
+                with open(tmp_path, "w") as f:
+                    json.dump(result, f)
+                os.replace(tmp_path, result_path)
+                written = os.path.getmtime(result_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+            self._drop_result(waiters, result_path, written)
+            return result
+
+    @staticmethod
+    def _drop_result(waiters, result_path: str, written: float) -> None:
+        """
+        Deletes a result file unless a waiting worker has yet to read it.
+        """
+        try:
+            fcntl.flock(waiters, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            # The last waiter to read it deletes it
+            return
+        try:
+            # Leave a newer call's result alone
+            if os.path.getmtime(result_path) == written:
+                os.remove(result_path)
+        except OSError:
+            pass
+        finally:
+            fcntl.flock(waiters, fcntl.LOCK_UN)
+
+
+@contextmanager
+def host_lock(key: str, lock_dir: str = settings.SINGLE_FLIGHT_DIR) -> Iterator[None]:
+    """
+    Holds an exclusive lock for ``key`` shared by every thread and worker on the host,
+    e.g. around a read-modify-write of a PocketBase record.
+    """
+    if fcntl is None:
+        with _fallback_locks.setdefault(key, threading.Lock()):
+            yield
+        return
+
+    os.makedirs(lock_dir, exist_ok=True)
+    path = os.path.join(lock_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".lock")
+    # flock locks belong to the open file, so separate opens exclude each other even
+    # within one process
+    with open(path, "a+") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+_fallback_locks: Dict[str, threading.Lock] = {}
+
+single_flight = SingleFlight(settings.SINGLE_FLIGHT_DIR)
@@ -0,0 +1,8 @@
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap token estimate (~4 characters per token for English prose).
+
+    :param text: The text to measure.
+    :return: Approximate number of LLM tokens.
+    """
+    return (len(text) + 3) // 4
@@ -0,0 +1,188 @@
+from collections import Counter
+from typing import Iterable, Optional
+
+from pocketbase import PocketBase
+
+from app.core.single_flight import host_lock
+from app.crud.pagination import iter_records, quote
+
+COLLECTION = "project_stats"
+
+
+def empty_stats() -> dict:
+    return {
+        "user_stories": 0,
+        "by_priority": {},
+        "by_status": {},
+        "story_points": 0,
+        "stale": 0,
+        "test_cases": 0,
+        "stories_with_test_cases": 0,
+        "criteria_covered": 0,
+        "criteria_reused": 0,
+    }
+
+
+def _get_record(pb: PocketBase, project_id: str):
+    result = pb.collection(COLLECTION).get_list(
+        1, 1, {"filter": f"project={quote(project_id)}", "skipTotal": 1}
+    )
+    return result.items[0] if result.items else None
+
+
+def _save(pb: PocketBase, project_id: str, record, stats: dict) -> None:
+    if record is None:
+        pb.collection(COLLECTION).create({"project": project_id, "aggregates": stats})
+    else:
+        pb.collection(COLLECTION).update(record.id, {"aggregates": stats})
+
+
+def _update(pb: PocketBase, project_id: str, apply) -> None:
+    """
+    Applies an in-place change to a project's aggregates under a host-wide lock, so
+    concurrent writers in different workers do not lose each other's updates.
+    """
+    with host_lock(f"project_stats:{project_id}"):
+        record = _get_record(pb, project_id)
+        if record is None:
+            # Nothing to increment yet; build the aggregates from the records instead
+            stats = _scan(pb, project_id)
+        else:
+            stats = {**empty_stats(), **(record.aggregates or {})}
+            apply(stats)
+        _save(pb, project_id, record, stats)
+
+
+def _bump(counts: dict, key: Optional[str], delta: int = 1) -> None:
+    key = key or "Unknown"
+    counts[key] = counts.get(key, 0) + delta
+
+
+def record_user_stories(pb: PocketBase, project_id: str, stories: Iterable) -> None:
+    """
+    Adds newly created user stories (``UserStory`` models) to the project's aggregates.
+    """
+    stories = list(stories)
+    if not stories:
+        return
+
+    def apply(stats: dict) -> None:
+        for story in stories:
+            stats["user_stories"] += 1
+            _bump(stats["by_priority"], story.priority.value)
+            _bump(stats["by_status"], story.status.value)
+            stats["story_points"] += story.story_points or 0
+
+    _update(pb, project_id, apply)
+
+
+def record_stale(pb: PocketBase, project_id: str, count: int) -> None:
+    """
+    Counts user stories that were just marked stale.
+    """
+    if not count:
+        return
+
+    def apply(stats: dict) -> None:
+        stats["stale"] += count
+
+    _update(pb, project_id, apply)
+
+
+def record_test_cases(
+    pb: PocketBase, project_id: str, before: int, after: int
+) -> None:
+    """
+    Updates the test case totals after a user story's test cases were replaced.
+
+    :param before: The number of test cases the story had before the change.
+    :param after: The number of test cases the story has now.
+    """
+    if before == after:
+        return
+
+    def apply(stats: dict) -> None:
+        stats["test_cases"] += after - before
+        stats["stories_with_test_cases"] += int(after > 0) - int(before > 0)
+
+    _update(pb, project_id, apply)
+
+
+def record_test_case_reuse(
+    pb: PocketBase, project_id: str, criteria: int, criteria_reused: int
+) -> None:
+    """
+    Counts the acceptance criteria of a test case generation and how many of them were
+    covered from the project's test case library.
+    """
+    if not criteria:
+        return
+
+    def apply(stats: dict) -> None:
+        stats["criteria_covered"] += criteria
+        stats["criteria_reused"] += criteria_reused
+
+    _update(pb, project_id, apply)
+
+
+def _scan(pb: PocketBase, project_id: str) -> dict:
+    """
+    Computes a project's aggregates from scratch by reading all of its records.
+    """
+    stats = empty_stats()
+    priorities: Counter = Counter()
+    statuses: Counter = Counter()
+    for story in iter_records(
+        pb,
+        "user_story",
+        [f"project={quote(project_id)}"],
+        ("priority", "status", "story_points", "stale"),
+    ):
+        stats["user_stories"] += 1
+        priorities[story["priority"] or "Unknown"] += 1
+        statuses[story["status"] or "Unknown"] += 1
+        stats["story_points"] += story["story_points"] or 0
+        stats["stale"] += int(bool(story["stale"]))
+
+    covered = set()
+    for test_case in iter_records(
+        pb, "test_case", [f"user_story.project={quote(project_id)}"], ("user_story",)
+    ):
+        stats["test_cases"] += 1
+        covered.add(test_case["user_story"])
+
+    stats["by_priority"] = dict(priorities)
+    stats["by_status"] = dict(statuses)
+    stats["stories_with_test_cases"] = len(covered)
+    return stats
+
+
+def recompute(pb: PocketBase, project_id: str) -> dict:
+    """
+    Rebuilds a project's aggregates from its records and stores them.
+    """
+    with host_lock(f"project_stats:{project_id}"):
+        stats = _scan(pb, project_id)
+        _save(pb, project_id, _get_record(pb, project_id), stats)
+    return stats
+
+
+def get_summary(pb: PocketBase, project_id: str) -> dict:
+    """
+    Returns a project's dashboard summary from its stored aggregates: a single record
+    read regardless of project size. The aggregates are built on first access.
+    """
+    record = _get_record(pb, project_id)
+    stats = {**empty_stats(), **(record.aggregates or {})} if record else recompute(pb, project_id)
+    stats["coverage_pct"] = (
+        round(100.0 * stats["stories_with_test_cases"] / stats["user_stories"], 2)
+        if stats["user_stories"]
+        else 0.0
+    )
+    # Criteria counts are run history and restart from zero when aggregates are rebuilt
+    stats["reuse_rate_pct"] = (
+        round(100.0 * stats["criteria_reused"] / stats["criteria_covered"], 2)
+        if stats["criteria_covered"]
+        else 0.0
+    )
+    return stats
@@ -0,0 +1,141 @@
+from typing import Iterable, List, Optional, Sequence
+
+from pocketbase import PocketBase
+
+from app.core.cache import project_namespace, read_cache, user_story_namespace
+from app.crud.pagination import quote
+from app.crud.project_stats import record_test_cases
+from app.crud.user_story import any_of, batched
+
+TEST_CASE_FIELDS = (
+    "id",
+    "name",
+    "description",
+    "preconditions",
+    "steps",
+    "expected_result",
+    "reused_from",
+)
+
+
+def test_case_to_dict(record) -> dict:
+    return {field: getattr(record, field, None) for field in TEST_CASE_FIELDS}
+
+
+def list_test_cases(pb: PocketBase, user_story_id: str) -> List[dict]:
+    """
+    Returns the test cases of a user story.
+    """
+    records = pb.collection("test_case").get_full_list(
+        query_params={
+            "filter": f"user_story={quote(user_story_id)}",
+            "fields": ",".join(TEST_CASE_FIELDS),
+        }
+    )
+    return [test_case_to_dict(record) for record in records]
+
+
+def count_test_cases(pb: PocketBase, user_story_id: str) -> int:
+    """
+    Returns the number of test cases of a user story, generated or added by hand.
+    """
+    result = pb.collection("test_case").get_list(
+        1, 1, {"filter": f"user_story={quote(user_story_id)}", "fields": "id"}
+    )
+    return result.total_items
+
+
+def delete_generated_test_cases(pb: PocketBase, user_story_id: str) -> List[str]:
+    """
+    Deletes the previously generated test cases of a user story. Test cases without a
+    generation fingerprint were added by hand and are kept.
+
+    :return: The IDs of the test cases deleted.
+    """
+    records = pb.collection("test_case").get_full_list(
+        query_params={
+            "filter": f'user_story={quote(user_story_id)} && fingerprint!=""',
+            "fields": "id",
+        }
+    )
+    for record in records:
+        pb.collection("test_case").delete(record.id)
+    return [record.id for record in records]
+
+
+def clear_reuse_links(pb: PocketBase, test_case_ids: Sequence[str]) -> int:
+    """
+    Clears ``reused_from`` on the copies of deleted test cases, so no copy links to a
+    record that no longer exists.
+
+    :return: The number of copies updated.
+    """
+    cleared = 0
+    for batch in batched(test_case_ids):
+        records = pb.collection("test_case").get_full_list(
+            query_params={"filter": any_of("reused_from", batch), "fields": "id"}
+        )
+        for record in records:
+            pb.collection("test_case").update(record.id, {"reused_from": ""})
+        cleared += len(records)
+    return cleared
+
+
+def save_test_cases(
+    pb: PocketBase,
+    user_story_id: str,
+    test_cases: Iterable,
+    user_id: str,
+    fingerprint: str,
+    reused_from: Optional[Sequence[Optional[str]]] = None,
+) -> List[dict]:
+    """
+    Saves generated test cases for a user story, tagged with the generation fingerprint.
+
+    :param reused_from: For each test case, the test case it was copied from, if any.
+    """
+    saved = []
+    for position, test_case in enumerate(test_cases):
+        record = pb.collection("test_case").create(
+            {
+                "user_story": user_story_id,
+                "name": test_case.name,
+                "description": test_case.description,
+                "preconditions": test_case.preconditions,
+                "steps": test_case.steps,
+                "expected_result": test_case.expected_result,
+                "created_by": user_id,
+                "fingerprint": fingerprint,
+                "reused_from": (reused_from[position] if reused_from else None) or "",
+            }
+        )
+        saved.append(test_case_to_dict(record))
+    return saved
+
+
+def replace_generated_test_cases(
+    pb: PocketBase,
+    user_story,
+    test_cases: Sequence,
+    user_id: str,
+    fingerprint: str,
+    reused_from: Optional[Sequence[Optional[str]]] = None,
+) -> List[dict]:
+    """
+    Replaces the previously generated test cases of a user story record with a new set,
+    then records the set's fingerprint on the story last, so an interrupted run is
+    regenerated on the next call. Copies of the deleted test cases in other stories lose
+    their link to them. Project aggregates and cached reads are updated.
+
+    :return: The saved test cases.
+    """
+    before = count_test_cases(pb, user_story.id)
+    deleted = delete_generated_test_cases(pb, user_story.id)
+    clear_reuse_links(pb, deleted)
+    saved = save_test_cases(pb, user_story.id, test_cases, user_id, fingerprint, reused_from)
+    pb.collection("user_story").update(user_story.id, {"test_cases_fingerprint": fingerprint})
+    record_test_cases(pb, user_story.project, before, before - len(deleted) + len(saved))
+    read_cache.invalidate(
+        project_namespace(user_story.project), user_story_namespace(user_story.id)
+    )
+    return saved
@@ -0,0 +1,79 @@
+from typing import Iterable, Iterator, List, Set
+
+from pocketbase import PocketBase
+
+from app.crud.pagination import quote
+
+# Keep OR-filters short enough for a query string
+FILTER_BATCH_SIZE = 50
+
+
+def batched(values: Iterable[str], size: int = FILTER_BATCH_SIZE) -> Iterator[List[str]]:
+    batch: List[str] = []
+    for value in values:
+        batch.append(value)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def any_of(field: str, values: Iterable[str]) -> str:
+    """
+    Builds a PocketBase filter matching records whose ``field`` equals any of ``values``.
+    """
+    return "(" + " || ".join(f"{field}={quote(value)}" for value in values) + ")"
+
+
+def get_chunk_fingerprints(pb: PocketBase, project_id: str) -> Set[str]:
+    """
+    Returns the chunk fingerprints stored for the project's current BRD version.
+    """
+    records = pb.collection("brd_chunk").get_full_list(
+        query_params={"filter": f"project={quote(project_id)}", "fields": "fingerprint"}
+    )
+    return {record.fingerprint for record in records}
+
+
+def save_chunk_fingerprints(
+    pb: PocketBase, project_id: str, added: Iterable[str], removed: Iterable[str]
+) -> None:
+    """
+    Brings the stored chunk fingerprints of a project in line with a new BRD version.
+    """
+    for fingerprint in added:
+        pb.collection("brd_chunk").create(
+            {"project": project_id, "fingerprint": fingerprint}
+        )
+    for batch in batched(removed):
+        records = pb.collection("brd_chunk").get_full_list(
+            query_params={
+                "filter": f"project={quote(project_id)} && {any_of('fingerprint', batch)}",
+                "fields": "id",
+            }
+        )
+        for record in records:
+            pb.collection("brd_chunk").delete(record.id)
+
+
+def mark_stories_stale(
+    pb: PocketBase, project_id: str, fingerprints: Iterable[str]
+) -> int:
+    """
+    Flags the user stories generated from the given chunks as stale.
+
+    :return: The number of user stories marked stale.
+    """
+    count = 0
+    for batch in batched(fingerprints):
+        records = pb.collection("user_story").get_full_list(
+            query_params={
+                "filter": f"project={quote(project_id)} && stale=false && {any_of('source_chunk', batch)}",
+                "fields": "id",
+            }
+        )
+        for record in records:
+            pb.collection("user_story").update(record.id, {"stale": True})
+            count += 1
+    return count
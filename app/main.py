@@ -1,7 +1,9 @@
 import logging
+from contextlib import asynccontextmanager
 from sqlalchemy import text
 from fastapi import FastAPI
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from mangum import Mangum
 from sqlmodel import Session, SQLModel
 
@@ -11,19 +13,35 @@ import sys
 sys.path.append("")
 
 from app.api.main import api_router
+from app.api.middleware import REQUEST_ID_HEADER, RequestIdMiddleware
+from app.core.cassette import cassette
 from app.core.config import settings
+from app.core.email_outbox import outbox
+from app.core.executors import pools, web_concurrency
+from app.core.logs import setup_logging, shutdown_logging
 
 from dotenv import load_dotenv
 
-# Set up logging
-logging.basicConfig(level=logging.INFO)
+# Set up logging: JSON records written by a background thread (see LOG_* settings)
+setup_logging()
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Pools are started lazily by the first request that needs them
+    pools.shutdown()
+    outbox.close()
+    cassette.close()
+    shutdown_logging()
+
+
 app = FastAPI(
     title=settings.PROJECT_NAME,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
+    lifespan=lifespan,
 )
 
 
@@ -37,8 +55,14 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["ETag", REQUEST_ID_HEADER],
     )
 
+# Compress large responses (list pages, exports)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+# Outermost, so every log record of a request carries its ID
+app.add_middleware(RequestIdMiddleware)
 
 
 
@@ -67,5 +91,5 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=args.dev,  # Enable auto-reload in dev mode
-        workers=1 if args.dev else 4,  # Single worker in dev mode
+        workers=1 if args.dev else web_concurrency(),  # Single worker in dev mode
     )
@@ -0,0 +1,22 @@
+from enum import Enum
+from typing import TypeAlias
+
+
+class Provider(str, Enum):
+    OPENAI = "openai"
+    GROQ = "groq"
+
+
+class OpenAIModelName(str, Enum):
+    GPT_4O_MINI = "gpt-4o-mini"
+    GPT_4O = "gpt-4o"
+    GPT_4 = "gpt-4"
+
+
+class GroqModelName(str, Enum):
+    LLAMA_31_8B = "groq-llama-3.1-8b"
+    LLAMA_31_70B = "groq-llama-3.1-70b"
+    LLAMA_GUARD_3_8B = "groq-llama-guard-3-8b"
+
+
+AllModelEnum: TypeAlias = OpenAIModelName | GroqModelName
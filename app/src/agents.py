@@ -1,3 +1,5 @@
+import logging
+import os
 from typing import List
 from langchain_openai import ChatOpenAI
 from langchain.prompts import PromptTemplate
@@ -8,6 +10,8 @@ from langchain.text_splitter import CharacterTextSplitter
 from pydantic import BaseModel
 from app.schemas.user_story import UserStory
 
+logger = logging.getLogger(__name__)
+
 # Pydantic model for User Stories
 class UserStories(BaseModel):
     user_stories: List[UserStory]
@@ -73,7 +77,7 @@ class UserStoryGenerator:
         user_stories = {}
 
         for i, chunk in enumerate(requirement_chunks):
-            print(f"Processing chunk {i + 1}/{len(requirement_chunks)}...")
+            logger.info("Processing chunk %d/%d", i + 1, len(requirement_chunks))
 
             result = chain.run(
                 requirement_text=chunk,
@@ -81,7 +85,6 @@ class UserStoryGenerator:
             )
 
             parsed_result = parser.parse(result)
-            print(parsed_result)
 
             user_stories[f"chunk_{i + 1}"] = parsed_result
 
@@ -127,6 +130,7 @@ class TestCaseGenerator:
         result = chain.run(
             user_story=user_story,
             acceptance_criteria=acceptance_criteria,
+            format_instructions=parser.get_format_instructions(),
         )
 
         # Parse the result into structured test case format
@@ -136,7 +140,12 @@ class TestCaseGenerator:
 
 
 if __name__ == "__main__":
-    pdf_path = "app\\src\\BRD - HRMS.pdf"
+    import sys
+
+    # The BRD to process, e.g. "app/src/BRD - HRMS.pdf"
+    pdf_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(
+        os.path.dirname(__file__), "BRD - HRMS.pdf"
+    )
 
     # Initialize the UserStoryGenerator
     user_story_generator = UserStoryGenerator(model="gpt-4", temperature=0.7)
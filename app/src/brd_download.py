@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator
+
+import requests
+from fastapi import UploadFile
+
+PDF_MAGIC = b"%PDF-"
+
+
+class BRDTooLargeError(ValueError):
+    """
+    Raised when a BRD document exceeds the configured maximum size.
+    """
+
+
+class BRDNotPDFError(ValueError):
+    """
+    Raised when a BRD document does not start with the PDF header.
+    """
+
+
+@dataclass
+class StoredBRD:
+    """
+    A BRD document streamed to a temporary file.
+    """
+
+    path: str
+    sha256: str
+    size: int
+
+
+class _BRDWriter:
+    """
+    Writes chunks to a temporary file while hashing them and enforcing the size limit,
+    so the document is never held in memory as a whole.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._hash = hashlib.sha256()
+        self._file = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf")
+        self.path = self._file.name
+
+    def write(self, chunk: bytes) -> None:
+        if not chunk:
+            return
+        if self.size == 0 and not chunk.startswith(PDF_MAGIC[: len(chunk)]):
+            raise BRDNotPDFError("BRD document is not a PDF")
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise BRDTooLargeError(
+                f"BRD document exceeds the {self.max_bytes} byte limit"
+            )
+        self._hash.update(chunk)
+        self._file.write(chunk)
+
+    def finish(self) -> StoredBRD:
+        self._file.close()
+        return StoredBRD(path=self.path, sha256=self._hash.hexdigest(), size=self.size)
+
+    def discard(self) -> None:
+        self._file.close()
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+@contextmanager
+def download_brd(
+    url: str, max_bytes: int, chunk_size: int = 1 << 20, timeout: float = 30.0
+) -> Iterator[StoredBRD]:
+    """
+    Streams a BRD document to a temporary file in fixed-size chunks. The file is
+    removed when the context exits, whether or not processing succeeded.
+
+    :param url: URL of the PDF (e.g. a PocketBase file URL).
+    :param max_bytes: Maximum accepted document size.
+    :param chunk_size: Size of each read from the network.
+    :param timeout: Connect/read timeout in seconds.
+    :return: The stored document (path, SHA-256 and size).
+    """
+    writer = _BRDWriter(max_bytes)
+    try:
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            declared = int(response.headers.get("Content-Length") or 0)
+            if declared > max_bytes:
+                raise BRDTooLargeError(
+                    f"BRD document exceeds the {max_bytes} byte limit"
+                )
+            for chunk in response.iter_content(chunk_size=chunk_size):
+                writer.write(chunk)
+        yield writer.finish()
+    finally:
+        writer.discard()
+
+
+@asynccontextmanager
+async def receive_brd(
+    upload: UploadFile, max_bytes: int, chunk_size: int = 1 << 20
+) -> AsyncIterator[StoredBRD]:
+    """
+    Streams an uploaded BRD document to a temporary file in fixed-size chunks, with the
+    same size guard, hashing and cleanup as ``download_brd``.
+
+    :param upload: The multipart upload.
+    :param max_bytes: Maximum accepted document size.
+    :param chunk_size: Size of each read from the upload.
+    :return: The stored document (path, SHA-256 and size).
+    """
+    writer = _BRDWriter(max_bytes)
+    try:
+        while chunk := await upload.read(chunk_size):
+            writer.write(chunk)
+        yield writer.finish()
+    finally:
+        writer.discard()
+        await upload.close()
@@ -0,0 +1,66 @@
+import hashlib
+import re
+import zlib
+from typing import List
+
+_WS_RE = re.compile(r"\s+")
+
+
+def _is_boundary(line: str, span: int) -> bool:
+    # A line ends a chunk with a probability proportional to its length, so chunks grow
+    # by ``span`` characters on average past the minimum whatever the document's line
+    # lengths. The decision depends on the line alone, never on the rest of the document.
+    # crc32 is stable across processes, unlike hash(), so boundaries are reproducible.
+    return zlib.crc32(line.strip().encode("utf-8")) % span < len(line) + 1
+
+
+def chunk_text(
+    text: str, chunk_size: int = 1000, min_size: int = 400, max_size: int = 1600
+) -> List[str]:
+    """
+    Splits text into chunks on line boundaries chosen from the content itself: a chunk
+    ends after a line whose checksum falls below a threshold set by the line's length
+    (once it is at least ``min_size`` long), or when the next line would push it past ``max_size``.
+
+    Unlike fixed-size splitting, an edit only moves the boundaries of the chunk it
+    lands in; the chunks after it line up again, so an edited document keeps the
+    fingerprints of its unchanged sections.
+
+    :param text: The document text.
+    :param chunk_size: The average chunk size to aim for, in characters.
+    :param min_size: Chunks are never cut on content before reaching this size.
+    :param max_size: Chunks are cut before exceeding this size (a single longer line stays whole).
+    :return: List of text chunks.
+    """
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+
+    span = max(1, chunk_size - min_size)
+
+    chunks: List[str] = []
+    current: List[str] = []
+    size = 0
+    for line in lines:
+        if current and size + len(line) + 1 > max_size:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(line)
+        size += len(line) + 1
+        if size >= min_size and _is_boundary(line, span):
+            chunks.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+
+
+def fingerprint(chunk: str) -> str:
+    """
+    Returns a fingerprint of a chunk that ignores case and whitespace differences.
+
+    :param chunk: A text chunk.
+    :return: A 32 character hex digest.
+    """
+    normalized = _WS_RE.sub(" ", chunk).strip().lower()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()[:32]
@@ -0,0 +1,409 @@
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Set, Tuple
+
+from pocketbase import PocketBase
+from pocketbase.utils import ClientResponseError
+
+from app.core.batch_api import (
+    FAILED,
+    FINISHED,
+    BatchRequest,
+    get_batch_provider,
+    read_batch_output,
+    write_batch_file,
+)
+from app.core.config import settings
+from app.core.single_flight import host_lock
+from app.crud.pagination import iter_records, quote
+from app.crud.test_case import replace_generated_test_cases
+from app.crud.user_story import get_chunk_fingerprints
+from app.src.chunking import fingerprint
+from app.src.test_case_generator import TestCaseGenerator
+from app.src.test_case_library import update_library
+from app.src.user_story_generator import UserStoryGenerator
+from app.src.vector_index import retrieve_context
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "batch_job"
+# The BRD chunks of a user story job are only read when its results are saved
+_JOB_FIELDS = "id,project,user,kind,status,data,created"
+_RECORD_KEYS = ("id", "kind", "project_id", "user_id", "status", "created")
+
+# Job states: being submitted (a job left here never reached the provider), submitted to
+# the provider, finished with some results not saved yet (the next poll retries them),
+# results saved to PocketBase, or no results
+SUBMITTING = "submitting"
+SUBMITTED = "submitted"
+PARTIAL = "partial"
+APPLIED = "applied"
+JOB_FAILED = "failed"
+
+
+def _to_job(record) -> dict:
+    return {
+        **(record.data or {}),
+        "id": record.id,
+        "kind": record.kind,
+        "project_id": record.project,
+        "user_id": record.user,
+        "status": record.status,
+        "created": str(record.created),
+    }
+
+
+def _save_job(pb: PocketBase, job: dict) -> None:
+    data = {key: value for key, value in job.items() if key not in _RECORD_KEYS}
+    pb.collection(COLLECTION).update(job["id"], {"status": job["status"], "data": data})
+
+
+def load_job(pb: PocketBase, job_id: str) -> Optional[dict]:
+    """
+    Returns a job as of its last poll, or None if there is no such job (or the user
+    cannot see it).
+    """
+    try:
+        record = pb.collection(COLLECTION).get_one(job_id, {"fields": _JOB_FIELDS})
+    except ClientResponseError as e:
+        if e.status == 404:
+            return None
+        raise
+    return _to_job(record)
+
+
+def list_jobs(pb: PocketBase, project_id: str) -> List[dict]:
+    """
+    Returns the deferred jobs of a project, newest first.
+    """
+    records = pb.collection(COLLECTION).get_full_list(
+        query_params={
+            "filter": f"project={quote(project_id)}",
+            "sort": "-created",
+            "fields": _JOB_FIELDS,
+        }
+    )
+    return [_to_job(record) for record in records]
+
+
+def _submit(
+    pb: PocketBase,
+    kind: str,
+    requests: List[BatchRequest],
+    project_id: str,
+    user_id: str,
+    model: str,
+    chunks: Optional[List[str]] = None,
+    **extra,
+) -> dict:
+    provider = get_batch_provider()
+    for request in requests:
+        provider.check_model(request.model)
+
+    # The job is saved before the batch is submitted, so a batch that has been paid for
+    # always has a job to poll. The whole BRD is kept with a user story job, to record
+    # its fingerprints and rebuild the project's chunk index when the results are saved.
+    record = pb.collection(COLLECTION).create(
+        {
+            "project": project_id,
+            "user": user_id,
+            "kind": kind,
+            "status": SUBMITTING,
+            "data": {},
+            "chunks": chunks,
+        }
+    )
+    job = {
+        "id": record.id,
+        "kind": kind,
+        "project_id": project_id,
+        "user_id": user_id,
+        "status": SUBMITTING,
+        "created": str(record.created),
+        "model": model,
+        "requests": len(requests),
+        "provider": None,
+        "batch_id": None,
+        **extra,
+    }
+    if not requests:
+        job.update(status=APPLIED, result={}, applied_ids=[], failed_ids=[])
+        _save_job(pb, job)
+        return job
+
+    fd, input_path = tempfile.mkstemp(suffix=".jsonl")
+    os.close(fd)
+    try:
+        write_batch_file(input_path, requests)
+        batch_id = provider.submit(input_path)
+    except Exception as e:
+        job.update(status=JOB_FAILED, error=str(e))
+        _save_job(pb, job)
+        raise
+    finally:
+        os.remove(input_path)
+    job.update(status=SUBMITTED, provider=provider.name, batch_id=batch_id)
+    _save_job(pb, job)
+    logger.info("Submitted %s batch %s with %d requests", kind, batch_id, len(requests))
+    return job
+
+
+def defer_user_stories(
+    generator: UserStoryGenerator,
+    chunks: List[str],
+    project_id: str,
+    user_id: str,
+    incremental: bool,
+) -> dict:
+    """
+    Submits the user story prompts of a BRD's chunks as a batch. The stories are saved
+    when ``poll_job`` finds the batch finished, exactly as a synchronous import (or, if
+    ``incremental``, a re-import) would have saved them.
+
+    :return: The job.
+    """
+    chunks_by_fingerprint = {fingerprint(chunk): chunk for chunk in chunks}
+    if incremental:
+        previous = get_chunk_fingerprints(generator.pb, project_id)
+        chunks_by_fingerprint = {
+            fp: chunk for fp, chunk in chunks_by_fingerprint.items() if fp not in previous
+        }
+    requests = [
+        BatchRequest(fp, generator.model, generator.build_prompt(chunk), generator.temperature)
+        for fp, chunk in chunks_by_fingerprint.items()
+    ]
+    job = _submit(
+        generator.pb,
+        "user_stories",
+        requests,
+        project_id,
+        user_id,
+        generator.model.value,
+        chunks=chunks,
+        incremental=incremental,
+    )
+    if job["status"] == APPLIED:
+        # Nothing to generate, but removed sections still need their stories marked stale
+        job["result"], _, _ = _apply_user_stories(generator.pb, job, {})
+        _save_job(generator.pb, job)
+    return job
+
+
+def defer_test_cases(
+    generator: TestCaseGenerator,
+    pb: PocketBase,
+    project_id: str,
+    user_id: str,
+    force: bool = False,
+) -> dict:
+    """
+    Submits the test case prompts of a project's current user stories as a batch, one
+    request per story, skipping stories whose test cases are up to date unless ``force``.
+
+    :return: The job.
+    """
+    requests = []
+    fingerprints = {}
+    for story in iter_records(
+        pb,
+        "user_story",
+        [f"project={quote(project_id)}", "stale=false"],
+        ("id", "title", "acceptance_criteria", "test_cases_fingerprint"),
+    ):
+        if not story["title"] or not story["acceptance_criteria"]:
+            continue
+        context = retrieve_context(
+            project_id,
+            f"{story['title']}\n{story['acceptance_criteria']}",
+            k=settings.RAG_TOP_K,
+            token_budget=settings.RAG_TOKEN_BUDGET,
+            min_score=settings.RAG_MIN_SCORE,
+        )
+        story_fingerprint = generator.fingerprint(
+            story["title"], story["acceptance_criteria"], context
+        )
+        if not force and story["test_cases_fingerprint"] == story_fingerprint:
+            continue
+        fingerprints[story["id"]] = story_fingerprint
+        requests.append(
+            BatchRequest(
+                story["id"],
+                generator.model,
+                generator.build_prompt(story["title"], story["acceptance_criteria"], context),
+                generator.temperature,
+            )
+        )
+    return _submit(
+        pb,
+        "test_cases",
+        requests,
+        project_id,
+        user_id,
+        generator.model.value,
+        fingerprints=fingerprints,
+    )
+
+
+def poll_job(pb: PocketBase, job_id: str) -> Optional[dict]:
+    """
+    Checks a submitted job with its provider and, once the batch has finished, saves its
+    results to PocketBase. The IDs of the results saved (or that failed for good) are
+    recorded on the job, and a job with results that could not be saved stays ``partial``
+    so the next poll retries only those. Safe to call repeatedly; concurrent polls on one
+    host are serialized.
+
+    :return: The job, or None if there is no such job.
+    """
+    with host_lock(f"batch_job:{job_id}"):
+        job = load_job(pb, job_id)
+        if job is None or job["status"] not in (SUBMITTED, PARTIAL):
+            return job
+
+        provider = get_batch_provider(job["provider"])
+        if job["status"] == SUBMITTED:
+            job["batch_status"] = provider.status(job["batch_id"])
+            if job["batch_status"]["status"] in FAILED:
+                job["status"] = JOB_FAILED
+        if job["status"] == PARTIAL or job["batch_status"]["status"] in FINISHED:
+            _apply(pb, job, read_batch_output(provider.output(job["batch_id"])))
+        _save_job(pb, job)
+        return job
+
+
+def _apply(
+    pb: PocketBase, job: dict, results: Dict[str, Tuple[Optional[str], Optional[str]]]
+) -> None:
+    """
+    Saves the results of a finished batch that no earlier poll has saved, and updates
+    the job's status, result summary and applied and failed IDs.
+    """
+    applied_ids = set(job.get("applied_ids", ()))
+    failed_ids = set(job.get("failed_ids", ()))
+    pending = {
+        custom_id: result
+        for custom_id, result in results.items()
+        if custom_id not in applied_ids and custom_id not in failed_ids
+    }
+    if job["kind"] == "user_stories":
+        result, applied, failed = _apply_user_stories(pb, job, pending)
+    else:
+        result, applied, failed = _apply_test_cases(pb, job, pending)
+    applied_ids |= applied
+    failed_ids |= failed
+    unsaved = len(pending) - len(applied) - len(failed)
+
+    # Counts of saved records add up over the polls it takes to save everything; the
+    # rest describe the first
+    summary = dict(job.get("result") or {})
+    for key, value in result.items():
+        if key in _SUMMED:
+            summary[key] = summary.get(key, 0) + value
+        else:
+            summary.setdefault(key, value)
+    if job["kind"] == "user_stories":
+        summary["failed_sections"] = job["requests"] - len(applied_ids)
+    else:
+        summary["user_stories"] = len(applied_ids)
+        summary["failed_user_stories"] = job["requests"] - len(applied_ids)
+
+    job.update(
+        result=summary,
+        applied_ids=sorted(applied_ids),
+        failed_ids=sorted(failed_ids),
+        unsaved=unsaved,
+    )
+    if unsaved:
+        logger.warning("%d results of batch job %s could not be saved yet", unsaved, job["id"])
+        job["status"] = PARTIAL
+    else:
+        job["status"] = APPLIED
+        job["applied"] = time.time()
+
+
+# Result counts that accumulate when a partial job is polled again
+_SUMMED = ("user_stories_created", "user_stories_stale", "test_cases_created")
+
+
+def _apply_user_stories(
+    pb: PocketBase, job: dict, results: Dict[str, Tuple[Optional[str], Optional[str]]]
+) -> Tuple[dict, Set[str], Set[str]]:
+    """
+    :return: The result counts, the fingerprints of the chunks whose stories are saved
+        and those of the chunks whose generation failed.
+    """
+    generator = UserStoryGenerator(pb=pb, model=job["model"])
+    chunks = pb.collection(COLLECTION).get_one(job["id"], {"fields": "chunks"}).chunks or []
+
+    finished: List[Tuple[str, Future]] = []
+    failed = set()
+    for chunk_fingerprint, (output, error) in results.items():
+        future: Future = Future()
+        try:
+            if error is not None:
+                raise RuntimeError(error)
+            future.set_result(generator.parse_output(output))
+        except Exception as e:
+            logger.warning("No user stories for chunk %s: %s", chunk_fingerprint[:12], e)
+            failed.add(chunk_fingerprint)
+            continue
+        finished.append((chunk_fingerprint, future))
+
+    saved: Set[str] = set()
+    if job["incremental"]:
+        changes = generator.regenerate_user_stories(
+            chunks, job["project_id"], job["user_id"], results=finished, saved_chunks=saved
+        )
+        # Chunks another import recorded in the meantime were skipped, and are done too
+        recorded = get_chunk_fingerprints(pb, job["project_id"])
+        saved |= {chunk_fingerprint for chunk_fingerprint, _ in finished} & recorded
+        result = {key: value for key, value in changes.items() if key != "failed_sections"}
+    else:
+        user_stories = generator.generate_user_stories(
+            chunks, job["project_id"], job["user_id"], results=finished, saved_chunks=saved
+        )
+        result = {"user_stories_created": len(user_stories)}
+    return result, saved, failed
+
+
+def _apply_test_cases(
+    pb: PocketBase, job: dict, results: Dict[str, Tuple[Optional[str], Optional[str]]]
+) -> Tuple[dict, Set[str], Set[str]]:
+    """
+    :return: The result counts, the IDs of the user stories whose test cases are saved
+        and those of the stories whose generation failed.
+    """
+    generator = TestCaseGenerator(model=job["model"])
+    created = 0
+    saved = set()
+    failed = set()
+    for user_story_id, (output, error) in results.items():
+        try:
+            if error is not None:
+                raise RuntimeError(error)
+            test_cases = generator.parse_output(output).test_cases
+        except Exception as e:
+            logger.warning("No test cases for user story %s: %s", user_story_id, e)
+            failed.add(user_story_id)
+            continue
+        try:
+            user_story = pb.collection("user_story").get_one(user_story_id)
+            created += len(
+                replace_generated_test_cases(
+                    pb,
+                    user_story,
+                    test_cases,
+                    job["user_id"],
+                    job["fingerprints"][user_story_id],
+                )
+            )
+            # The story's library entries describe test cases that were just replaced
+            update_library(job["project_id"], user_story_id, [])
+        except Exception:
+            # Left out of both sets, so the next poll tries again
+            logger.exception("Could not save the test cases of user story %s", user_story_id)
+            continue
+        saved.add(user_story_id)
+    return {"test_cases_created": created}, saved, failed
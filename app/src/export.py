@@ -0,0 +1,230 @@
+import csv
+import io
+import json
+import re
+import zipfile
+from collections import defaultdict
+from enum import Enum
+from typing import Iterator, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from pocketbase import PocketBase
+
+from app.crud.pagination import fetch_page, iter_records, quote
+from app.crud.user_story import any_of, batched
+
+STORY_FIELDS = (
+    "id",
+    "title",
+    "description",
+    "acceptance_criteria",
+    "priority",
+    "story_points",
+    "status",
+    "stale",
+)
+TEST_CASE_FIELDS = (
+    "id",
+    "user_story",
+    "name",
+    "description",
+    "preconditions",
+    "steps",
+    "expected_result",
+)
+
+# Flat layout used by CSV and XLSX: one row per test case, story columns repeated
+COLUMNS = [f"story_{field}" for field in STORY_FIELDS] + [
+    f"test_case_{field}" for field in TEST_CASE_FIELDS if field != "user_story"
+]
+
+# Excel limits a cell to 32767 characters and rejects XML-invalid control characters
+_XLSX_CELL_LIMIT = 32767
+_XML_INVALID_RE = re.compile("[\x00-\x08\x0b\x0c\x0e-\x1f]")
+
+
+class ExportFormat(str, Enum):
+    JSONL = "jsonl"
+    CSV = "csv"
+    XLSX = "xlsx"
+
+
+MEDIA_TYPES = {
+    ExportFormat.JSONL: "application/x-ndjson",
+    ExportFormat.CSV: "text/csv",
+    ExportFormat.XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+
+
+def iter_project(
+    pb: PocketBase, project_id: str, page_size: int = 100
+) -> Iterator[Tuple[dict, List[dict]]]:
+    """
+    Yields each user story of a project with its test cases. Stories are fetched a page
+    at a time and the test cases of a page in a few batched queries, so memory stays
+    bounded by the page size regardless of the project size.
+    """
+    cursor = None
+    while True:
+        stories, cursor = fetch_page(
+            pb, "user_story", [f"project={quote(project_id)}"], STORY_FIELDS, cursor, page_size
+        )
+        test_cases = defaultdict(list)
+        for batch in batched(story["id"] for story in stories):
+            for test_case in iter_records(
+                pb, "test_case", [any_of("user_story", batch)], TEST_CASE_FIELDS
+            ):
+                test_cases[test_case["user_story"]].append(test_case)
+
+        for story in stories:
+            yield story, test_cases.get(story["id"], [])
+        if cursor is None:
+            return
+
+
+def _flat_rows(story: dict, test_cases: List[dict]) -> Iterator[list]:
+    story_values = [story.get(field) for field in STORY_FIELDS]
+    if not test_cases:
+        yield story_values + [None] * (len(COLUMNS) - len(story_values))
+    for test_case in test_cases:
+        yield story_values + [
+            test_case.get(field) for field in TEST_CASE_FIELDS if field != "user_story"
+        ]
+
+
+def export_jsonl(pb: PocketBase, project_id: str) -> Iterator[bytes]:
+    """
+    One JSON object per user story, with its test cases nested.
+    """
+    for story, test_cases in iter_project(pb, project_id):
+        line = json.dumps({**story, "test_cases": test_cases}, default=str)
+        yield (line + "\n").encode("utf-8")
+
+
+def export_csv(pb: PocketBase, project_id: str) -> Iterator[bytes]:
+    """
+    One row per test case (or per user story without test cases).
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for story, test_cases in iter_project(pb, project_id):
+        writer.writerows(_flat_rows(story, test_cases))
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+
+class _Pipe(io.RawIOBase):
+    """
+    A write-only, non-seekable sink that hands written bytes back to the generator, so
+    ``zipfile`` streams the archive instead of building it in memory.
+    """
+
+    def __init__(self):
+        self._chunks: List[bytes] = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _xlsx_cell(ref: str, value: Optional[object]) -> str:
+    if value is None or value == "":
+        return ""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c r="{ref}"><v>{value}</v></c>'
+    text = _XML_INVALID_RE.sub("", str(value))[:_XLSX_CELL_LIMIT]
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{escape(text)}</t></is></c>'
+
+
+def _column_letter(index: int) -> str:
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+_XLSX_STATIC = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        "</Relationships>"
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Test cases" sheetId="1" r:id="rId1"/></sheets>'
+        "</workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet1.xml"/>'
+        "</Relationships>"
+    ),
+}
+
+
+def export_xlsx(pb: PocketBase, project_id: str) -> Iterator[bytes]:
+    """
+    A single-sheet workbook with the same layout as the CSV export, written with inline
+    strings so rows can be streamed without a shared string table.
+    """
+    pipe = _Pipe()
+    letters = [_column_letter(i) for i in range(len(COLUMNS))]
+
+    def row_xml(number: int, values: list) -> str:
+        cells = "".join(
+            _xlsx_cell(f"{letter}{number}", value) for letter, value in zip(letters, values)
+        )
+        return f'<row r="{number}">{cells}</row>'
+
+    with zipfile.ZipFile(pipe, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in _XLSX_STATIC.items():
+            archive.writestr(name, content)
+        yield pipe.drain()
+
+        with archive.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            )
+            sheet.write(row_xml(1, COLUMNS).encode("utf-8"))
+            number = 1
+            for story, test_cases in iter_project(pb, project_id):
+                for values in _flat_rows(story, test_cases):
+                    number += 1
+                    sheet.write(row_xml(number, values).encode("utf-8"))
+                yield pipe.drain()
+            sheet.write(b"</sheetData></worksheet>")
+    yield pipe.drain()
+
+
+EXPORTERS = {
+    ExportFormat.JSONL: export_jsonl,
+    ExportFormat.CSV: export_csv,
+    ExportFormat.XLSX: export_xlsx,
+}
@@ -0,0 +1,247 @@
+import logging
+import math
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+from app.core.tokens import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# A cell of an exploded pypdf table: words separated by single spaces. Runs of two or
+# more spaces, or tabs, separate cells.
+_CELL_RE = re.compile(r"[^\t ]+(?: [^\t ]+)*")
+# How far (in characters) a column may drift from the first row and still line up
+_COLUMN_TOLERANCE = 2
+# Untabbed rows only count as a table from this many aligned rows on; pypdf often
+# leaves double spaces in ordinary prose
+_MIN_TABLE_ROWS = 3
+_INLINE_WS_RE = re.compile(r"[ \t\u00a0]+")
+_DIGITS_RE = re.compile(r"\d+")
+_PAGE_NUMBER_RE = re.compile(
+    r"^(?:page\s*)?[-–(]?\s*#\s*[-–)]?(?:\s*(?:of|/)\s*#)?$", re.IGNORECASE
+)
+
+
+@dataclass
+class CleanupReport:
+    """
+    Summary of what the cleanup stage removed from a document.
+    """
+
+    pages: int = 0
+    removed_lines: int = 0
+    tables: int = 0
+    raw_chars: int = 0
+    clean_chars: int = 0
+    raw_tokens: int = 0
+    clean_tokens: int = 0
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.raw_tokens - self.clean_tokens
+
+    @property
+    def reduction_pct(self) -> float:
+        if not self.raw_tokens:
+            return 0.0
+        return round(100.0 * self.tokens_saved / self.raw_tokens, 2)
+
+    def as_dict(self) -> dict:
+        return {
+            "pages": self.pages,
+            "removed_lines": self.removed_lines,
+            "tables": self.tables,
+            "raw_tokens": self.raw_tokens,
+            "clean_tokens": self.clean_tokens,
+            "tokens_saved": self.tokens_saved,
+            "reduction_pct": self.reduction_pct,
+        }
+
+
+def _signature(line: str) -> str:
+    return _INLINE_WS_RE.sub(" ", line).strip().lower()
+
+
+def _masked(signature: str) -> str:
+    # Page numbers and dates change from page to page, so compare with digits masked
+    return _DIGITS_RE.sub("#", signature)
+
+
+def _edge_indexes(lines: List[str], edge_lines: int) -> List[int]:
+    """
+    Returns the indexes of the first and last ``edge_lines`` non-blank lines of a page,
+    which is where running headers and footers live.
+    """
+    non_blank = [i for i, line in enumerate(lines) if line.strip()]
+    if len(non_blank) <= 2 * edge_lines:
+        return non_blank
+    return non_blank[:edge_lines] + non_blank[-edge_lines:]
+
+
+def _outer_indexes(lines: List[str]) -> set:
+    non_blank = [i for i, line in enumerate(lines) if line.strip()]
+    return {non_blank[0], non_blank[-1]} if non_blank else set()
+
+
+def _find_repeated(
+    pages: List[List[str]], edge_lines: int, min_page_ratio: float
+) -> Tuple[set, set]:
+    """
+    Counts each edge-line signature once per page and returns the signatures that
+    repeat across enough pages to be page furniture rather than content.
+
+    Exact matches are collected from the whole edge zone; digit-masked matches
+    (``Page 3 of 40``, dated footers) only from the outermost line of each page so
+    numbered section headings are left alone.
+    """
+    exact: Counter = Counter()
+    masked: Counter = Counter()
+    for lines in pages:
+        exact.update({_signature(lines[i]) for i in _edge_indexes(lines, edge_lines)})
+        masked.update({_masked(_signature(lines[i])) for i in _outer_indexes(lines)})
+
+    threshold = max(2, math.ceil(min_page_ratio * len(pages)))
+    return (
+        {sig for sig, count in exact.items() if sig and count >= threshold},
+        {sig for sig, count in masked.items() if sig and count >= threshold},
+    )
+
+
+@dataclass
+class _Row:
+    line: str
+    cells: List[str]
+    offsets: List[int]
+    tabbed: bool
+
+
+def _table_row(line: str) -> Optional[_Row]:
+    matches = list(_CELL_RE.finditer(line))
+    if len(matches) < 2:
+        return None
+    return _Row(
+        line,
+        [match.group() for match in matches],
+        [match.start() for match in matches],
+        "\t" in line,
+    )
+
+
+def _same_table(row: _Row, first: _Row) -> bool:
+    if len(row.cells) != len(first.cells):
+        return False
+    if row.tabbed and first.tabbed:
+        return True
+    return all(
+        abs(offset - column) <= _COLUMN_TOLERANCE
+        for offset, column in zip(row.offsets, first.offsets)
+    )
+
+
+def _is_table(rows: List[_Row]) -> bool:
+    if all(row.tabbed for row in rows):
+        return len(rows) >= 2
+    return len(rows) >= _MIN_TABLE_ROWS
+
+
+def _markdown_table(rows: List[List[str]]) -> List[str]:
+    width = len(rows[0])
+    out = ["| " + " | ".join(rows[0]) + " |", "|" + "---|" * width]
+    out.extend("| " + " | ".join(row) + " |" for row in rows[1:])
+    return out
+
+
+def _compact_lines(lines: List[str], report: CleanupReport) -> List[str]:
+    """
+    Collapses inline whitespace and turns exploded tables into markdown: runs of at
+    least three lines with the same number (>= 2) of cells starting at the same
+    columns, or of two or more tab-separated lines with the same number of cells.
+    """
+    out: List[str] = []
+    pending: List[_Row] = []
+
+    def append(line: str) -> None:
+        compact = _INLINE_WS_RE.sub(" ", line).strip()
+        # Keep at most one blank line in a row
+        if compact or (out and out[-1]):
+            out.append(compact)
+
+    def flush() -> None:
+        if pending and _is_table(pending):
+            out.extend(_markdown_table([row.cells for row in pending]))
+            report.tables += 1
+        else:
+            for row in pending:
+                append(row.line)
+        pending.clear()
+
+    for line in lines:
+        row = _table_row(line)
+        if row is not None and (not pending or _same_table(row, pending[0])):
+            pending.append(row)
+            continue
+        flush()
+        if row is not None:
+            pending.append(row)
+            continue
+        append(line)
+    flush()
+    return out
+
+
+def clean_pages(
+    pages: List[str], edge_lines: int = 3, min_page_ratio: float = 0.5
+) -> Tuple[str, CleanupReport]:
+    """
+    Removes running headers, footers and page numbers, collapses whitespace and
+    compacts exploded tables into markdown. Runs in linear time over the page text.
+
+    :param pages: Raw text of each PDF page, in order.
+    :param edge_lines: How many lines at the top and bottom of a page are checked for repetition.
+    :param min_page_ratio: Fraction of pages a line must appear on to be treated as a header/footer.
+    :return: The cleaned document text and a report of the token reduction.
+    """
+    report = CleanupReport(pages=len(pages))
+    split_pages = [page.splitlines() for page in pages]
+    repeated, repeated_masked = (
+        _find_repeated(split_pages, edge_lines, min_page_ratio)
+        if len(split_pages) > 1
+        else (set(), set())
+    )
+
+    cleaned_pages = []
+    for lines in split_pages:
+        drop = set()
+        outer = _outer_indexes(lines)
+        for i in _edge_indexes(lines, edge_lines):
+            sig = _signature(lines[i])
+            masked = _masked(sig)
+            if (
+                sig in repeated
+                or _PAGE_NUMBER_RE.match(masked)
+                or (i in outer and masked in repeated_masked)
+            ):
+                drop.add(i)
+        report.removed_lines += len(drop)
+        kept = [line for i, line in enumerate(lines) if i not in drop]
+        cleaned_pages.append("\n".join(_compact_lines(kept, report)).strip())
+
+    raw_text = "\n".join(pages)
+    text = "\n\n".join(page for page in cleaned_pages if page)
+
+    report.raw_chars = len(raw_text)
+    report.clean_chars = len(text)
+    report.raw_tokens = estimate_tokens(raw_text)
+    report.clean_tokens = estimate_tokens(text)
+    logger.info(
+        "PDF cleanup: %d pages, %d lines removed, %d tables, tokens %d -> %d (-%.1f%%)",
+        report.pages,
+        report.removed_lines,
+        report.tables,
+        report.raw_tokens,
+        report.clean_tokens,
+        report.reduction_pct,
+    )
+    return text, report
@@ -0,0 +1,109 @@
+import logging
+import math
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from pypdf import PdfReader
+
+logger = logging.getLogger(__name__)
+
+# Smallest page range handed to a worker; below this the IPC cost outweighs the parse time
+MIN_SHARD_PAGES = 8
+
+
+def _extract_range(pdf_path: str, start: int, stop: int) -> List[str]:
+    """
+    Extracts the text of pages ``[start, stop)``. Runs inside a worker process, so it
+    opens its own reader instead of receiving one from the parent.
+    """
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def count_pages(pdf_path: str) -> int:
+    return len(PdfReader(pdf_path).pages)
+
+
+def default_workers() -> int:
+    return max(1, (os.cpu_count() or 1) - 1)
+
+
+def shard_ranges(page_count: int, workers: int) -> List[Tuple[int, int]]:
+    """
+    Splits ``page_count`` pages into contiguous ranges, a few per worker so a slow
+    range (scanned images, huge tables) does not leave the other workers idle.
+    """
+    shard = max(MIN_SHARD_PAGES, math.ceil(page_count / (workers * 4)))
+    return [(start, min(start + shard, page_count)) for start in range(0, page_count, shard)]
+
+
+def _iter_sequential(pdf_path: str, page_count: int) -> Iterator[str]:
+    reader = PdfReader(pdf_path)
+    for i in range(page_count):
+        yield reader.pages[i].extract_text() or ""
+
+
+def _iter_sharded(
+    executor: Executor, pdf_path: str, ranges: List[Tuple[int, int]]
+) -> Iterator[str]:
+    futures = [executor.submit(_extract_range, pdf_path, start, stop) for start, stop in ranges]
+    try:
+        # Wait on the futures in submission order so pages stream out in document order
+        for future in futures:
+            yield from future.result()
+    finally:
+        for future in futures:
+            future.cancel()
+
+
+def iter_pages(
+    pdf_path: str,
+    max_workers: Optional[int] = None,
+    min_parallel_pages: int = 40,
+    executor: Optional[Executor] = None,
+) -> Iterator[str]:
+    """
+    Yields the text of every page of a PDF in page order. Large documents are sharded
+    by page range across worker processes; small ones are parsed in-process, where
+    starting a pool would cost more than it saves.
+
+    :param pdf_path: Path to the PDF file.
+    :param max_workers: Number of worker processes (default: one less than the CPU count).
+    :param min_parallel_pages: Documents with fewer pages are parsed in a single process.
+    :param executor: An existing process pool to run the shards on instead of starting one.
+    :return: An iterator over page texts.
+    """
+    page_count = count_pages(pdf_path)
+    workers = max_workers or default_workers()
+    if page_count < min_parallel_pages or workers < 2:
+        yield from _iter_sequential(pdf_path, page_count)
+        return
+
+    ranges = shard_ranges(page_count, workers)
+    if executor is not None:
+        yield from _iter_sharded(executor, pdf_path, ranges)
+        return
+
+    try:
+        # spawn keeps the workers clear of locks held by the web server's threads
+        pool = ProcessPoolExecutor(
+            max_workers=min(workers, len(ranges)),
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    except (OSError, NotImplementedError) as e:
+        # e.g. AWS Lambda, which has no /dev/shm for the pool's semaphores
+        logger.warning("Process pool unavailable (%s), parsing %s in-process", e, pdf_path)
+        yield from _iter_sequential(pdf_path, page_count)
+        return
+
+    with pool:
+        yield from _iter_sharded(pool, pdf_path, ranges)
+
+
+def extract_pages(pdf_path: str, **kwargs) -> List[str]:
+    """
+    Returns the text of every page of a PDF, in page order. See ``iter_pages``.
+    """
+    return list(iter_pages(pdf_path, **kwargs))
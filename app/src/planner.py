@@ -0,0 +1,255 @@
+import math
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional
+
+from pocketbase import PocketBase
+
+from app.core.config import settings
+from app.core.llm import llm_caller
+from app.core.tokens import estimate_tokens
+from app.crud.user_story import get_chunk_fingerprints
+from app.schemas.llm_models import AllModelEnum, GroqModelName, OpenAIModelName
+from app.src.chunking import fingerprint
+from app.src.test_case_generator import TestCaseGenerator
+from app.src.user_story_generator import UserStoryGenerator
+
+# USD per million (prompt, completion) tokens
+PRICING: Dict[AllModelEnum, tuple] = {
+    OpenAIModelName.GPT_4O_MINI: (0.15, 0.60),
+    OpenAIModelName.GPT_4O: (2.50, 10.00),
+    OpenAIModelName.GPT_4: (30.00, 60.00),
+    GroqModelName.LLAMA_31_8B: (0.05, 0.08),
+    GroqModelName.LLAMA_31_70B: (0.59, 0.79),
+    GroqModelName.LLAMA_GUARD_3_8B: (0.20, 0.20),
+}
+
+# Typical completion speed in tokens per second, used until a model has latency history
+THROUGHPUT: Dict[AllModelEnum, float] = {
+    OpenAIModelName.GPT_4O_MINI: 80.0,
+    OpenAIModelName.GPT_4O: 60.0,
+    OpenAIModelName.GPT_4: 25.0,
+    GroqModelName.LLAMA_31_8B: 500.0,
+    GroqModelName.LLAMA_31_70B: 250.0,
+    GroqModelName.LLAMA_GUARD_3_8B: 500.0,
+}
+FIRST_TOKEN_SECONDS = 0.6
+
+# Share of the synchronous price charged for requests deferred to the batch API
+BATCH_API_PRICE_FACTOR = 0.5
+
+# Observed averages of the user story pipeline
+STORIES_PER_CHUNK = 2.5
+COMPLETION_TOKENS_PER_STORY = 250
+COMPLETION_TOKENS_PER_TEST_CASE_SET = 1200
+STORY_TOKENS = 150
+CRITERIA_PER_STORY = 4
+
+
+
+class ImportTooLargeError(ValueError):
+    """
+    Raised when a BRD import is estimated to exceed the configured limits.
+    """
+
+
+@dataclass
+class StagePlan:
+    """
+    The estimated LLM work of one stage of an import.
+    """
+
+    model: AllModelEnum
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+    @property
+    def cost_usd(self) -> float:
+        prompt_price, completion_price = PRICING.get(self.model, (0.0, 0.0))
+        return (self.prompt_tokens * prompt_price + self.completion_tokens * completion_price) / 1e6
+
+    def call_seconds(self) -> float:
+        """
+        Expected latency of one call: the model's recent median if known, otherwise
+        first-token time plus completion time at the model's typical speed.
+        """
+        observed = llm_caller.latency.percentile(self.model, "total", 50.0)
+        if observed is not None:
+            return observed
+        if not self.calls:
+            return 0.0
+        per_call = self.completion_tokens / self.calls
+        return FIRST_TOKEN_SECONDS + per_call / THROUGHPUT.get(self.model, 50.0)
+
+    def as_dict(self) -> dict:
+        return {
+            "model": self.model.value,
+            "llm_calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "cost_usd": round(self.cost_usd, 4),
+        }
+
+
+def wall_time(stages: Iterable[StagePlan]) -> Dict[str, float]:
+    """
+    Predicted wall time of running stages one after another under each constraint: LLM
+    pool concurrency, requests per minute and tokens per minute. The work takes as long
+    as the tightest one.
+    """
+    stages = list(stages)
+    concurrency = 0.0
+    for stage in stages:
+        if stage.calls:
+            waves = math.ceil(stage.calls / settings.LLM_POOL_SIZE)
+            concurrency += waves * stage.call_seconds()
+    bounds = {"concurrency": concurrency}
+    if settings.LLM_MAX_RPM:
+        calls = sum(stage.calls for stage in stages)
+        bounds["requests_per_minute"] = 60.0 * calls / settings.LLM_MAX_RPM
+    if settings.LLM_MAX_TPM:
+        tokens = sum(stage.prompt_tokens + stage.completion_tokens for stage in stages)
+        bounds["tokens_per_minute"] = 60.0 * tokens / settings.LLM_MAX_TPM
+    return bounds
+
+
+@dataclass
+class ImportPlan:
+    """
+    The estimated cost and duration of importing a BRD, computed without LLM calls.
+    ``stages`` are what the import itself runs, and what its totals and limits cover;
+    ``follow_up`` is work users usually run afterwards (test cases, generated per story),
+    estimated separately.
+    """
+
+    chunks: int = 0
+    chunks_to_process: int = 0
+    stages: Dict[str, StagePlan] = field(default_factory=dict)
+    follow_up: Dict[str, StagePlan] = field(default_factory=dict)
+
+    @property
+    def calls(self) -> int:
+        return sum(stage.calls for stage in self.stages.values())
+
+    @property
+    def tokens(self) -> int:
+        return sum(s.prompt_tokens + s.completion_tokens for s in self.stages.values())
+
+    @property
+    def cost_usd(self) -> float:
+        return sum(stage.cost_usd for stage in self.stages.values())
+
+    def wall_time(self) -> Dict[str, float]:
+        return wall_time(self.stages.values())
+
+    def as_dict(self) -> dict:
+        bounds = self.wall_time()
+        bottleneck = max(bounds, key=bounds.get)
+        follow_up = {}
+        for name, stage in self.follow_up.items():
+            stage_bounds = wall_time([stage])
+            follow_up[name] = {
+                **stage.as_dict(),
+                "deferred_cost_usd": round(stage.cost_usd * BATCH_API_PRICE_FACTOR, 4),
+                "wall_time_seconds": round(max(stage_bounds.values()), 1),
+            }
+        return {
+            "chunks": self.chunks,
+            "chunks_to_process": self.chunks_to_process,
+            "llm_calls": self.calls,
+            "tokens": self.tokens,
+            "cost_usd": round(self.cost_usd, 4),
+            "deferred_cost_usd": round(self.cost_usd * BATCH_API_PRICE_FACTOR, 4),
+            "wall_time_seconds": round(bounds[bottleneck], 1),
+            "bottleneck": bottleneck,
+            "stages": {name: stage.as_dict() for name, stage in self.stages.items()},
+            "follow_up": follow_up,
+            "limits": {
+                "max_llm_calls": settings.IMPORT_MAX_LLM_CALLS,
+                "max_cost_usd": settings.IMPORT_MAX_COST_USD,
+                "within_limits": self.violation() is None,
+            },
+        }
+
+    def violation(self) -> Optional[str]:
+        """
+        Describes the configured limit the import would exceed, if any. Follow-up work
+        does not count.
+        """
+        calls = self.calls
+        if settings.IMPORT_MAX_LLM_CALLS and calls > settings.IMPORT_MAX_LLM_CALLS:
+            return (
+                f"Import needs an estimated {calls} LLM calls, more than the limit "
+                f"of {settings.IMPORT_MAX_LLM_CALLS}"
+            )
+        cost = self.cost_usd
+        if settings.IMPORT_MAX_COST_USD and cost > settings.IMPORT_MAX_COST_USD:
+            return (
+                f"Import is estimated to cost ${cost:.2f}, more than the limit "
+                f"of ${settings.IMPORT_MAX_COST_USD:.2f}"
+            )
+        return None
+
+    def check_limits(self) -> None:
+        """
+        :raises ImportTooLargeError: If the import exceeds a configured limit.
+        """
+        message = self.violation()
+        if message:
+            raise ImportTooLargeError(message)
+
+
+def plan_import(
+    generator: UserStoryGenerator,
+    chunks: List[str],
+    pb: Optional[PocketBase] = None,
+    project_id: Optional[str] = None,
+    incremental: bool = False,
+) -> ImportPlan:
+    """
+    Estimates the LLM work of importing a chunked BRD: one user story call per chunk to
+    process, and as follow-up work one test case call per expected user story. Prompt tokens are
+    measured on the exact prompts; completion sizes are typical averages.
+
+    :param generator: The generator that would run the import.
+    :param chunks: The chunks of the BRD.
+    :param pb: PocketBase, to look up unchanged chunks in incremental mode.
+    :param project_id: The project the BRD belongs to.
+    :param incremental: Only count chunks that changed since the previous BRD version.
+    :return: The plan.
+    """
+    to_process = chunks
+    if incremental and pb is not None and project_id:
+        previous = get_chunk_fingerprints(pb, project_id)
+        to_process = [chunk for chunk in chunks if fingerprint(chunk) not in previous]
+
+    stories = round(len(to_process) * STORIES_PER_CHUNK)
+    user_story_stage = StagePlan(
+        generator.model,
+        calls=len(to_process),
+        prompt_tokens=sum(estimate_tokens(generator.build_prompt(chunk)) for chunk in to_process),
+        completion_tokens=stories * COMPLETION_TOKENS_PER_STORY,
+    )
+
+    test_case_generator = TestCaseGenerator()
+    # Every test case prompt carries a story and up to the full retrieval budget
+    test_case_prompt = estimate_tokens(test_case_generator.build_prompt("", ""))
+    test_case_prompt += STORY_TOKENS + settings.RAG_TOKEN_BUDGET
+    calls_per_story = 1
+    if settings.TEST_CASE_FANOUT or settings.TEST_CASE_REUSE:
+        # Each call repeats the prompt around a share of the criteria and one category.
+        # Reuse only removes calls, so without knowing the library this is an upper bound
+        calls_per_story = min(settings.TEST_CASE_FANOUT_MAX_CALLS, 2 * CRITERIA_PER_STORY)
+    test_case_stage = StagePlan(
+        test_case_generator.model,
+        calls=stories * calls_per_story,
+        prompt_tokens=stories * calls_per_story * test_case_prompt,
+        completion_tokens=stories * COMPLETION_TOKENS_PER_TEST_CASE_SET,
+    )
+
+    return ImportPlan(
+        chunks=len(chunks),
+        chunks_to_process=len(to_process),
+        stages={"user_stories": user_story_stage},
+        follow_up={"test_cases": test_case_stage},
+    )
@@ -1,9 +1,12 @@
-from typing import List
-from langchain_openai import ChatOpenAI
+import hashlib
+import json
+import re
+from concurrent.futures import Future
+from typing import Iterable, List, Sequence, Tuple
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
 from langchain.output_parsers import PydanticOutputParser
 from pydantic import BaseModel, Field
+from app.core.llm import llm_caller, resolve_model
 
 
 # Pydantic model for Test Cases
@@ -31,8 +34,59 @@ class TestCases(BaseModel):
     )
 
 
+# Leading bullets and numbering of acceptance criteria points, e.g. "-", "2.", "b)"
+_BULLET_RE = re.compile(r"^\s*(?:[-*\u2022]|\(?\w{1,2}[.)])\s+")
+_NORMALIZE_RE = re.compile(r"[^a-z0-9]+")
+
+CATEGORY_GUIDANCE = {
+    "functional": "functional test cases: positive paths, negative paths, validation and boundary values",
+    "non-functional": "non-functional test cases: performance, security, usability, accessibility and reliability",
+}
+
+
+def split_criteria(acceptance_criteria: str) -> List[str]:
+    """
+    Splits acceptance criteria into their individual points, one per line or bullet.
+    Criteria written as a single paragraph are split into sentences.
+
+    :param acceptance_criteria: The acceptance criteria of a user story.
+    :return: The points, without their bullets or numbering.
+    """
+    lines = [line.strip() for line in acceptance_criteria.splitlines() if line.strip()]
+    if len(lines) == 1:
+        lines = [s for s in re.split(r"(?<=[.;])\s+(?=[A-Z])", lines[0]) if s.strip()]
+    return [_BULLET_RE.sub("", line).strip() for line in lines]
+
+
+def normalize(text: str) -> str:
+    """
+    Lowercases text and collapses everything but letters and digits to single spaces.
+    """
+    return _NORMALIZE_RE.sub(" ", text.lower()).strip()
+
+
+def merge_test_cases(results: Iterable["TestCases"]) -> List["TestCase"]:
+    """
+    Concatenates test cases from several generations, dropping any whose name or steps
+    repeat an earlier one's (ignoring case, spacing and punctuation).
+    """
+    seen = set()
+    merged = []
+    for result in results:
+        for test_case in result.test_cases:
+            keys = {("name", normalize(test_case.name)), ("steps", normalize(test_case.steps))}
+            if keys & seen:
+                continue
+            seen |= keys
+            merged.append(test_case)
+    return merged
+
+
 # Class for generating Test Cases
 class TestCaseGenerator:
+    # Bump whenever the prompt changes so previously generated sets are regenerated
+    PROMPT_VERSION = "2"
+
     def __init__(self, model="gpt-4", temperature=0.7):
         """
         Initializes the TestCaseGenerator with a shared LLM instance.
@@ -40,9 +94,52 @@ class TestCaseGenerator:
         :param model: The language model to use (default: GPT-4). Options like GPT-3.5, GPT-4, or other variants can be used.
         :param temperature: The creativity or randomness in the output (default: 0.7). A higher value generates more varied outputs.
         """
-        self.llm = ChatOpenAI(temperature=temperature, model=model)
+        self.model = resolve_model(model)
+        self.temperature = temperature
+
+    def fingerprint(
+        self,
+        user_story: str,
+        acceptance_criteria: str,
+        context: Sequence[str] = (),
+        fanout: bool = False,
+        reuse: bool = False,
+    ) -> str:
+        """
+        Returns a fingerprint of everything that determines the generated test cases, so an
+        unchanged story is not sent to the LLM again.
+
+        :param user_story: The user story title.
+        :param acceptance_criteria: The acceptance criteria of the user story.
+        :param context: The BRD excerpts included in the prompt.
+        :param fanout: Whether the test cases are generated in fan-out mode.
+        :param reuse: Whether test cases are reused from the project's library.
+        :return: A hex digest of the story content, context, mode, prompt version and model.
+        """
+        if reuse:
+            mode = "reuse"
+        else:
+            mode = "fanout" if fanout else "single"
+        payload = json.dumps(
+            [
+                user_story,
+                acceptance_criteria,
+                list(context),
+                mode,
+                self.PROMPT_VERSION,
+                self.model.value,
+            ]
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
 
-    def generate_test_cases(self, user_story: str, acceptance_criteria: str) -> dict:
+    def generate_test_cases(
+        self,
+        user_story: str,
+        acceptance_criteria: str,
+        context: Sequence[str] = (),
+        fanout: bool = False,
+        max_calls: int = 16,
+    ) -> TestCases:
         """
         Generates detailed test cases based on the user story and acceptance criteria.
         This method prompts a language model to analyze the user story and acceptance criteria
@@ -51,17 +148,133 @@ class TestCaseGenerator:
 
         :param user_story: A description of the user story outlining the feature or functionality to be tested.
         :param acceptance_criteria: A description of the conditions that must be met for the user story to be considered complete.
+        :param context: Excerpts of the BRD relevant to the user story, if any.
+        :param fanout: Generate each acceptance criterion and category in its own, smaller
+            call, in parallel, and merge the results.
+        :param max_calls: The maximum number of parallel calls in fan-out mode.
         :return: A structured test case based on the input user story and acceptance criteria.
         """
+        if fanout:
+            return self._generate_fanout(user_story, acceptance_criteria, context, max_calls)
+
+        parser, prompt = self._prompt()
+
+        # Generate the test cases on the worker's bounded LLM pool and parse them into a
+        # structured format; a reply that does not parse counts as a failed attempt
+        return llm_caller.call(
+            self.model,
+            self._format(parser, prompt, user_story, acceptance_criteria, context),
+            parser.parse,
+            temperature=self.temperature,
+        )
+
+    def generate_by_criterion(
+        self,
+        user_story: str,
+        criteria: List[str],
+        context: Sequence[str] = (),
+        max_calls: int = 16,
+    ) -> List[Tuple[str, List[TestCase]]]:
+        """
+        Generates test cases for the given acceptance criteria in fan-out mode, keeping
+        track of the criterion each test case was generated for.
+
+        :param user_story: The user story title.
+        :param criteria: The acceptance criteria points to cover.
+        :param context: Excerpts of the BRD relevant to the user story, if any.
+        :param max_calls: The maximum number of parallel calls.
+        :return: Each criterion with its test cases. Neighbouring criteria that had to
+            share a call are returned together, one per line.
+        """
+        calls = self._submit_fanout(user_story, criteria, context, max_calls)
+        return [
+            ("\n".join(group), merge_test_cases(future.result() for future in futures))
+            for group, futures in calls
+        ]
+
+    def _generate_fanout(
+        self,
+        user_story: str,
+        acceptance_criteria: str,
+        context: Sequence[str],
+        max_calls: int,
+    ) -> TestCases:
+        points = split_criteria(acceptance_criteria) or [acceptance_criteria]
+        calls = self._submit_fanout(user_story, points, context, max_calls)
+        # All or nothing: a partial set would be cached under the story's fingerprint
+        return TestCases(
+            test_cases=merge_test_cases(
+                future.result() for _, futures in calls for future in futures
+            )
+        )
+
+    def _submit_fanout(
+        self,
+        user_story: str,
+        points: List[str],
+        context: Sequence[str],
+        max_calls: int,
+    ) -> List[Tuple[List[str], List[Future]]]:
+        """
+        Issues one call per group of acceptance criteria and category, all at once, so the
+        wall time is that of the slowest small completion rather than one long one. If
+        there are more points than calls allowed, neighbouring points share a call.
+        """
+        groups_count = max(1, min(len(points), max_calls // len(CATEGORY_GUIDANCE)))
+        size = -(-len(points) // groups_count)
+        groups = [points[i : i + size] for i in range(0, len(points), size)]
+
+        parser, prompt = self._prompt()
+        return [
+            (
+                group,
+                [
+                    llm_caller.submit(
+                        self.model,
+                        self._format(
+                            parser,
+                            prompt,
+                            user_story,
+                            "\n".join(f"- {point}" for point in group),
+                            context,
+                            focus=guidance,
+                        ),
+                        parser.parse,
+                        temperature=self.temperature,
+                    )
+                    for guidance in CATEGORY_GUIDANCE.values()
+                ],
+            )
+            for group in groups
+        ]
+
+    def build_prompt(
+        self, user_story: str, acceptance_criteria: str, context: Sequence[str] = ()
+    ) -> str:
+        """
+        Returns the exact prompt sent to the LLM for a user story, e.g. to estimate its size.
+        """
+        parser, prompt = self._prompt()
+        return self._format(parser, prompt, user_story, acceptance_criteria, context)
+
+    def parse_output(self, output: str) -> TestCases:
+        """
+        Parses the LLM's reply to a test case prompt, e.g. one returned by a deferred batch.
+        """
+        parser, _ = self._prompt()
+        return parser.parse(output)
+
+    @staticmethod
+    def _prompt() -> Tuple[PydanticOutputParser, PromptTemplate]:
         prompt_template = """
         You are a QA analyst. Based on the following user story and acceptance criteria, generate detailed test cases as an array.
         Include all relevant information: preconditions, test steps, expected results, and data requirements.
-        Split functional and non-functional test case generation, and ensure that each set of test cases is appropriately categorized.
+        {focus}
         
         User Story: {user_story}
         Acceptance Criteria:
         {acceptance_criteria}
-        
+        {context}
         {format_instructions}
         """
 
@@ -73,24 +286,47 @@ class TestCaseGenerator:
             input_variables=[
                 "user_story",
                 "acceptance_criteria",
+                "focus",
+                "context",
                 "format_instructions",
             ],
             template=prompt_template,
         )
+        return parser, prompt
 
-        chain = LLMChain(llm=self.llm, prompt=prompt)
-
-        # Generate test case using the chain
-        result = chain.run(
+    def _format(
+        self,
+        parser: PydanticOutputParser,
+        prompt: PromptTemplate,
+        user_story: str,
+        acceptance_criteria: str,
+        context: Sequence[str],
+        focus: str = "",
+    ) -> str:
+        if focus:
+            focus = f"Only generate {focus}, for the acceptance criteria below."
+        else:
+            focus = (
+                "Split functional and non-functional test case generation, and ensure that "
+                "each set of test cases is appropriately categorized."
+            )
+        return prompt.format(
             user_story=user_story,
             acceptance_criteria=acceptance_criteria,
+            focus=focus,
+            context=self._format_context(context),
             format_instructions=parser.get_format_instructions(),
         )
 
-        # Parse the result into a structured test case format
-        parsed_result = parser.parse(result)
-
-        return parsed_result
+    @staticmethod
+    def _format_context(context: Sequence[str]) -> str:
+        if not context:
+            return ""
+        excerpts = "\n---\n".join(context)
+        return (
+            "\nRelevant excerpts from the business requirements document, for domain "
+            f"details such as field rules, limits and roles:\n{excerpts}\n"
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,328 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import FrozenSet, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.single_flight import host_lock
+from app.src.test_case_generator import TestCase, TestCaseGenerator, normalize, split_criteria
+from app.src.vector_index import get_embedder
+
+logger = logging.getLogger(__name__)
+
+_VECTORS_FILE = "vectors.npy"
+_ENTRIES_FILE = "entries.json"
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_NUMBER_WORDS = {
+    word: str(number)
+    for number, word in enumerate(
+        "zero one two three four five six seven eight nine ten eleven twelve".split()
+    )
+}
+# Words that do not change what an acceptance criterion requires
+_FILLER_WORDS = frozenset(
+    """
+    a an the and or of to in on at by for with from as into via that this these those
+    it its their they them he she his her be is are was were been being has have had
+    must should shall will would can could may might able system
+    """.split()
+)
+
+
+def key_terms(criterion: str) -> FrozenSet[str]:
+    """
+    The words of an acceptance criterion that decide what it requires: everything but
+    filler words and modal verbs, with number words as digits and plurals folded. Two
+    criteria that differ in any of them (a limit of 3 or 5, export as PDF or CSV) need
+    different test cases, however similar their embeddings.
+    """
+    terms = set()
+    for word in _WORD_RE.findall(criterion.lower()):
+        if word in _FILLER_WORDS:
+            continue
+        word = _NUMBER_WORDS.get(word, word)
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+    return frozenset(terms)
+
+
+def signature(test_case: TestCase) -> str:
+    """
+    Identifies a test case by its normalized steps and expected result, so copies that
+    differ only in wording of the name, case or punctuation are stored once.
+    """
+    payload = f"{normalize(test_case.steps)}\n{normalize(test_case.expected_result)}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class TestCaseLibrary:
+    """
+    A project's generated test cases, each stored with the acceptance criterion it was
+    generated for and that criterion's embedding. Criteria are compared with criteria:
+    two stories with the same login or search rule are worded alike far more reliably
+    than a rule and the steps that test it. Test cases are copied verbatim, so a match
+    also needs the same key terms (see ``key_terms``), not just a similar embedding.
+    """
+
+    def __init__(self, vectors: np.ndarray, entries: List[dict], embedder: str):
+        self.vectors = vectors
+        self.entries = entries
+        self.embedder = embedder
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def match(
+        self,
+        criteria: Sequence[str],
+        criterion_vectors: np.ndarray,
+        min_score: float,
+        exclude_user_story: Optional[str] = None,
+    ) -> List[List[dict]]:
+        """
+        Finds, for each criterion, the most similar library criterion that scores at
+        least ``min_score`` and has the same key terms, and returns all test cases
+        generated for that one, or none if there is no such criterion.
+        """
+        if not len(self):
+            return [[] for _ in criterion_vectors]
+        scores = criterion_vectors @ self.vectors.T
+        if exclude_user_story is not None:
+            # A story being regenerated must not reuse its own previous test cases
+            own = [entry["user_story"] == exclude_user_story for entry in self.entries]
+            scores[:, np.asarray(own, dtype=bool)] = -1.0
+
+        matches = []
+        for criterion, row in zip(criteria, scores):
+            terms = key_terms(criterion)
+            source = None
+            for index in np.argsort(-row):
+                if row[index] < min_score:
+                    break
+                if key_terms(self.entries[index]["criterion"]) == terms:
+                    source = self.entries[index]
+                    break
+            if source is None:
+                matches.append([])
+                continue
+            matches.append(
+                [
+                    entry
+                    for entry in self.entries
+                    if entry["user_story"] == source["user_story"]
+                    and entry["criterion"] == source["criterion"]
+                ]
+            )
+        return matches
+
+    def save(self, directory: str) -> None:
+        """
+        Writes the library atomically: vectors first, then the entries that make them
+        visible to readers.
+        """
+        os.makedirs(directory, exist_ok=True)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        vectors_path = os.path.join(directory, _VECTORS_FILE)
+        entries_path = os.path.join(directory, _ENTRIES_FILE)
+
+        with open(vectors_path + suffix, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(entries_path + suffix, "w") as f:
+            json.dump({"embedder": self.embedder, "entries": self.entries}, f)
+        os.replace(vectors_path + suffix, vectors_path)
+        os.replace(entries_path + suffix, entries_path)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["TestCaseLibrary"]:
+        """
+        Loads a library, or returns None if there is none.
+        """
+        try:
+            with open(os.path.join(directory, _ENTRIES_FILE)) as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(directory, _VECTORS_FILE))
+        except (OSError, ValueError):
+            return None
+        if vectors.shape[0] != len(meta["entries"]):
+            # Caught between the two renames of a save; the next load will be consistent
+            return None
+        return cls(vectors, meta["entries"], meta["embedder"])
+
+
+def library_dir(project_id: str) -> str:
+    return os.path.join(settings.TEST_CASE_LIBRARY_DIR, project_id)
+
+
+@dataclass
+class ReuseResult:
+    """
+    The test cases of a user story, each either copied from the library or newly
+    generated, with the acceptance criterion it covers.
+    """
+
+    test_cases: List[TestCase] = field(default_factory=list)
+    criteria: List[str] = field(default_factory=list)
+    # The library entry each test case was copied from, or None if generated
+    sources: List[Optional[dict]] = field(default_factory=list)
+    criteria_total: int = 0
+    criteria_reused: int = 0
+
+    def add(self, test_case: TestCase, criterion: str, source: Optional[dict] = None) -> None:
+        self.test_cases.append(test_case)
+        self.criteria.append(criterion)
+        self.sources.append(source)
+
+    @property
+    def test_cases_reused(self) -> int:
+        return sum(source is not None for source in self.sources)
+
+    def report(self) -> dict:
+        return {
+            "criteria": self.criteria_total,
+            "criteria_reused": self.criteria_reused,
+            "test_cases_reused": self.test_cases_reused,
+            "test_cases_generated": len(self.test_cases) - self.test_cases_reused,
+            "reuse_rate_pct": (
+                round(100.0 * self.criteria_reused / self.criteria_total, 2)
+                if self.criteria_total
+                else 0.0
+            ),
+        }
+
+
+def generate_with_reuse(
+    generator: TestCaseGenerator,
+    project_id: str,
+    user_story_id: str,
+    user_story: str,
+    acceptance_criteria: str,
+    context: Sequence[str] = (),
+    max_calls: int = 16,
+    min_score: float = 0.88,
+) -> ReuseResult:
+    """
+    Covers each acceptance criterion with test cases from the project's library when a
+    similar enough criterion was covered before, and generates test cases only for the
+    rest, one fan-out call per criterion and category.
+
+    :param generator: The generator for criteria the library does not cover.
+    :param project_id: The project whose library to search.
+    :param user_story_id: The user story, whose own entries are not reused.
+    :param user_story: The user story title.
+    :param acceptance_criteria: The acceptance criteria of the user story.
+    :param context: Excerpts of the BRD relevant to the user story, if any.
+    :param max_calls: The maximum number of parallel calls for uncovered criteria.
+    :param min_score: The minimum cosine similarity between criteria to reuse.
+    :return: The test cases and what was reused.
+    """
+    points = split_criteria(acceptance_criteria) or [acceptance_criteria]
+    library = TestCaseLibrary.load(library_dir(project_id))
+    if library is not None and len(library):
+        vectors = get_embedder(library.embedder).embed(points)
+        matches = library.match(points, vectors, min_score, exclude_user_story=user_story_id)
+    else:
+        matches = [[] for _ in points]
+
+    result = ReuseResult(criteria_total=len(points))
+    seen = set()
+    uncovered = []
+    for point, entries in zip(points, matches):
+        if not entries:
+            uncovered.append(point)
+            continue
+        result.criteria_reused += 1
+        for entry in entries:
+            if entry["signature"] not in seen:
+                seen.add(entry["signature"])
+                result.add(TestCase(**entry["test_case"]), point, entry)
+
+    if uncovered:
+        for criterion, test_cases in generator.generate_by_criterion(
+            user_story, uncovered, context, max_calls
+        ):
+            for test_case in test_cases:
+                key = signature(test_case)
+                if key not in seen:
+                    seen.add(key)
+                    result.add(test_case, criterion)
+
+    logger.info(
+        "Reused test cases for %d of %d criteria",
+        result.criteria_reused,
+        result.criteria_total,
+    )
+    return result
+
+
+def update_library(
+    project_id: str,
+    user_story_id: str,
+    generated: Sequence[Tuple[str, TestCase, str]],
+) -> None:
+    """
+    Replaces a user story's entries in the project's library with its newly generated
+    test cases. Test cases the library already holds (by signature) are not added again.
+    With nothing ``generated`` the story's entries are just removed, e.g. after its test
+    cases were regenerated without the library.
+
+    :param project_id: The project the user story belongs to.
+    :param user_story_id: The user story the test cases were generated for.
+    :param generated: The criterion, test case and saved record ID of each test case.
+    """
+    with host_lock(f"test_case_library:{project_id}"):
+        directory = library_dir(project_id)
+        library = TestCaseLibrary.load(directory)
+
+        keep: List[int] = []
+        if library is not None:
+            keep = [
+                i
+                for i, entry in enumerate(library.entries)
+                if entry["user_story"] != user_story_id
+            ]
+        entries = [library.entries[i] for i in keep]
+        known = {entry["signature"] for entry in entries}
+
+        added = []
+        for criterion, test_case, record_id in generated:
+            key = signature(test_case)
+            if key in known:
+                continue
+            known.add(key)
+            added.append(
+                {
+                    "signature": key,
+                    "criterion": criterion,
+                    "user_story": user_story_id,
+                    "test_case_id": record_id,
+                    "test_case": test_case.model_dump(),
+                }
+            )
+        if not added and (library is None or len(keep) == len(library)):
+            # Nothing to add or remove
+            return
+
+        embedder = get_embedder(library.embedder if library is not None else None)
+
+        parts = [library.vectors[keep]] if keep else []
+        if added:
+            parts.append(embedder.embed([entry["criterion"] for entry in added]))
+        vectors = (
+            np.concatenate(parts) if parts else np.zeros((0, embedder.dim), dtype=np.float32)
+        )
+        TestCaseLibrary(vectors, entries + added, embedder.name).save(directory)
+
+    logger.info(
+        "Test case library of project %s: %d entries (%d added)",
+        project_id,
+        len(entries) + len(added),
+        len(added),
+    )
@@ -0,0 +1,130 @@
+from typing import Optional
+
+from pocketbase import PocketBase
+from pocketbase.utils import ClientResponseError
+
+from app.core.config import settings
+from app.crud.project_stats import record_test_case_reuse
+from app.crud.test_case import list_test_cases, replace_generated_test_cases
+from app.src.test_case_generator import TestCaseGenerator
+from app.src.test_case_library import generate_with_reuse, update_library
+from app.src.vector_index import retrieve_context
+
+
+class UserStoryNotFoundError(LookupError):
+    """
+    Raised when the user story to generate test cases for does not exist.
+    """
+
+
+class IncompleteUserStoryError(ValueError):
+    """
+    Raised when a user story has no title or no acceptance criteria to test.
+    """
+
+
+def generate_for_user_story(
+    pb: PocketBase,
+    user_story_id: str,
+    user_id: str,
+    *,
+    force: bool = False,
+    fanout: bool = False,
+    reuse: bool = False,
+    model: Optional[str] = None,
+) -> dict:
+    """
+    Generates and saves the test cases of a user story, or returns the existing set if
+    the story is unchanged. With ``reuse``, criteria already covered elsewhere in the
+    project get copies of those test cases.
+
+    :param pb: PocketBase, authenticated as the user.
+    :param user_story_id: The user story to generate test cases for.
+    :param user_id: The user the test cases are saved for.
+    :param force: Regenerate even if the user story has not changed.
+    :param fanout: Generate per acceptance criterion and category in parallel calls.
+    :param reuse: Copy the test cases of similar criteria from the project's library.
+    :param model: The test case model (default: the generator's).
+    :return: Whether the existing set was kept (``cached``), the ``test_cases`` and, in
+        reuse mode, the ``reuse`` counts.
+    :raises UserStoryNotFoundError: If the user story does not exist.
+    :raises IncompleteUserStoryError: If it has no title or acceptance criteria.
+    """
+    try:
+        user_story = pb.collection("user_story").get_one(user_story_id)
+    except ClientResponseError as e:
+        if e.status == 404:
+            raise UserStoryNotFoundError("User story not found.") from e
+        raise
+
+    story_text = user_story.title
+    acceptance_criteria = user_story.acceptance_criteria
+    if not story_text or not acceptance_criteria:
+        raise IncompleteUserStoryError("User story or acceptance criteria is missing.")
+
+    generator = TestCaseGenerator(model=model) if model else TestCaseGenerator()
+
+    # Look up the parts of the project's BRD the story was written from
+    context = retrieve_context(
+        user_story.project,
+        f"{story_text}\n{acceptance_criteria}",
+        k=settings.RAG_TOP_K,
+        token_budget=settings.RAG_TOKEN_BUDGET,
+        min_score=settings.RAG_MIN_SCORE,
+    )
+
+    # Keep the existing set if it was generated from the same content
+    fingerprint = generator.fingerprint(story_text, acceptance_criteria, context, fanout, reuse)
+    if not force and getattr(user_story, "test_cases_fingerprint", "") == fingerprint:
+        return {"cached": True, "test_cases": list_test_cases(pb, user_story_id)}
+
+    # Generate test cases for the user story, or only for the criteria the project's
+    # library does not cover yet
+    reused = None
+    if reuse:
+        reused = generate_with_reuse(
+            generator,
+            user_story.project,
+            user_story_id,
+            story_text,
+            acceptance_criteria,
+            context=context,
+            max_calls=settings.TEST_CASE_FANOUT_MAX_CALLS,
+            min_score=settings.TEST_CASE_REUSE_MIN_SCORE,
+        )
+        test_cases = reused.test_cases
+        reused_from = [source and source["test_case_id"] for source in reused.sources]
+    else:
+        test_cases = generator.generate_test_cases(
+            user_story=story_text,
+            acceptance_criteria=acceptance_criteria,
+            context=context,
+            fanout=fanout,
+            max_calls=settings.TEST_CASE_FANOUT_MAX_CALLS,
+        ).test_cases
+        reused_from = None
+
+    saved = replace_generated_test_cases(
+        pb, user_story, test_cases, user_id, fingerprint, reused_from
+    )
+    result = {"cached": False, "test_cases": saved}
+    if reused is None:
+        # The story's library entries describe test cases that were just replaced
+        update_library(user_story.project, user_story_id, [])
+    else:
+        update_library(
+            user_story.project,
+            user_story_id,
+            [
+                (criterion, test_case, record["id"])
+                for criterion, test_case, source, record in zip(
+                    reused.criteria, reused.test_cases, reused.sources, saved
+                )
+                if source is None
+            ],
+        )
+        record_test_case_reuse(
+            pb, user_story.project, reused.criteria_total, reused.criteria_reused
+        )
+        result["reuse"] = reused.report()
+    return result
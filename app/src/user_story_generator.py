@@ -1,15 +1,30 @@
 import json
-from typing import List
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from langchain_openai import ChatOpenAI
+import logging
+from typing import Iterable, Iterator, List, Optional, Set, Tuple
+from concurrent.futures import Future, as_completed
 from langchain.prompts import PromptTemplate
-from langchain.chains import LLMChain
-from langchain_community.document_loaders import PyPDFLoader
 from langchain.output_parsers import PydanticOutputParser
-from langchain.text_splitter import CharacterTextSplitter
 from pocketbase import PocketBase
 from pydantic import BaseModel
+from app.core.cache import project_namespace, read_cache
+from app.core.config import settings
+from app.core.executors import cpu_workers, pools
+from app.core.llm import llm_caller, resolve_model
+from app.core.logs import log_context
+from app.core.profiling import active_profile
+from app.crud.project_stats import record_stale, record_user_stories
+from app.crud.user_story import (
+    get_chunk_fingerprints,
+    mark_stories_stale,
+    save_chunk_fingerprints,
+)
 from app.schemas.user_story import UserStory
+from app.src.chunking import chunk_text, fingerprint
+from app.src.pdf_cleanup import CleanupReport, clean_pages
+from app.src.pdf_parsing import extract_pages
+from app.src.vector_index import build_index
+
+logger = logging.getLogger(__name__)
 
 
 class UserStories(BaseModel):
@@ -25,139 +40,328 @@ class UserStoryGenerator:
     A class to extract text from a PDF and generate user stories based on the requirements.
     """
 
-    def __init__(self, pb: PocketBase, model="gpt-4o-mini", temperature=0.7):
+    def __init__(self, pb: Optional[PocketBase] = None, model="gpt-4o-mini", temperature=0.7):
         """
         Initializes the UserStoryGenerator with a shared LLM instance.
 
+        :param pb: PocketBase, for the methods that save user stories (optional otherwise).
         :param model: The language model to use (default: GPT-4).
         :param temperature: The creativity/variability of the output (default: 0.7).
         """
-        self.llm = ChatOpenAI(temperature=temperature, model=model)
+        self.model = resolve_model(model)
+        self.temperature = temperature
         self.pb = pb
+        self.cleanup_report: CleanupReport | None = None
 
     def extract_text_from_pdf(self, pdf_path: str) -> List[str]:
         """
         Extracts text from a PDF document and splits it into manageable chunks for processing.
+        Large documents are parsed across a process pool; running headers/footers and page
+        numbers are stripped and tables compacted before chunking, and the token reduction
+        is kept in ``self.cleanup_report``.
 
         :param pdf_path: Path to the PDF file.
         :return: List of text chunks extracted from the PDF.
         """
-        # Use Langchain's PyPDFLoader to extract text from PDF
-        loader = PyPDFLoader(pdf_path)
-        documents = loader.load()
+        # Extract the text of each page, sharding large documents across the CPU pool;
+        # a profiled job parses in-process so the parsing shows up in its stacks
+        profiling = active_profile() is not None
+        cpu_pool = None if profiling else pools.cpu
+        pages = extract_pages(
+            pdf_path,
+            max_workers=1 if profiling else cpu_workers(),
+            min_parallel_pages=settings.PDF_PARALLEL_MIN_PAGES,
+            executor=cpu_pool.executor if cpu_pool else None,
+        )
 
-        # Combine all the extracted text from each page into a single string
-        text = "".join(doc.page_content for doc in documents)
+        # Drop page furniture and compact tables, then join the pages into a single string
+        text, self.cleanup_report = clean_pages(pages)
 
-        # Use Langchain's CharacterTextSplitter to split the text into chunks
-        text_splitter = CharacterTextSplitter(
-            separator="\n",  # Define a suitable separator based on PDF structure
-            chunk_size=1000,  # Define the chunk size in terms of characters
-            chunk_overlap=10,  # Define how much overlap you want between chunks
-        )
-        chunks = text_splitter.split_text(text)
+        # Split on content-defined boundaries so unchanged sections keep their
+        # fingerprints when a revised BRD is uploaded
+        chunks = chunk_text(text, chunk_size=1000)
         return chunks
 
+    @staticmethod
+    def _prompt() -> Tuple[PydanticOutputParser, PromptTemplate]:
+        prompt_template = """
+        You are a software analyst. Based on the following requirement text, extract key user stories and define acceptance criteria for each:
+        
+        If you encounter a section that doesn't contain user stories, return an empty list of user stories.
+        
+        Document Chunk: {requirement_text}
+        {format_instructions}
+        """
+
+        parser = PydanticOutputParser(pydantic_object=UserStories)
+        prompt = PromptTemplate(
+            input_variables=["requirement_text", "format_instructions"],
+            template=prompt_template,
+        )
+        return parser, prompt
+
+    def build_prompt(self, chunk: str) -> str:
+        """
+        Returns the exact prompt sent to the LLM for a chunk, e.g. to estimate its size.
+        """
+        parser, prompt = self._prompt()
+        return prompt.format(
+            requirement_text=chunk,
+            format_instructions=parser.get_format_instructions(),
+        )
+
+    def parse_output(self, output: str) -> List[UserStory]:
+        """
+        Parses the LLM's reply to a chunk prompt, e.g. one returned by a deferred batch.
+        """
+        parser, _ = self._prompt()
+        return parser.parse(output).user_stories
+
     def process_chunk(
-        self, chunk: str, parser: PydanticOutputParser, chain: LLMChain
-    ) -> List[UserStory]:
+        self, chunk: str, parser: PydanticOutputParser, prompt: PromptTemplate
+    ) -> "Future[List[UserStory]]":
         """
-        Processes a single chunk of text to generate user stories.
+        Starts generating user stories for a single chunk of text.
 
         :param chunk: A text chunk to process.
         :param parser: The output parser for the UserStory model.
-        :param chain: The LLM chain to process the chunk.
-        :return: A list of user stories for the given chunk.
+        :param prompt: The prompt template to fill with the chunk.
+        :return: A future resolving to the list of user stories for the given chunk.
         """
         try:
-            # Run the LLM chain to generate the user story based on the requirement text
-            result = chain.run(
-                requirement_text=chunk,
-                format_instructions=parser.get_format_instructions(),
+            # A reply that does not parse counts as a failed attempt, so a hedged duplicate
+            # can still provide the result
+            return llm_caller.submit(
+                self.model,
+                prompt.format(
+                    requirement_text=chunk,
+                    format_instructions=parser.get_format_instructions(),
+                ),
+                lambda output: parser.parse(output).user_stories,
+                temperature=self.temperature,
             )
-
-            # Parse the result into structured user story using the output parser
-            parsed_result = parser.parse(result)
-
-            return parsed_result.user_stories
         except Exception as e:
-            print(f"Error processing chunk: {e}")
-            return []
+            # Fail this chunk alone rather than the whole import; the chunk is left
+            # unrecorded so the next import retries it
+            logger.warning("Error processing chunk: %s", e)
+            future: Future = Future()
+            future.set_exception(e)
+            return future
 
     def generate_user_stories(
         self, requirement_chunks: List[str],
         project_id: str,
-        user_id : str
+        user_id : str,
+        results: Optional[Iterable[Tuple[str, Future]]] = None,
+        saved_chunks: Optional[Set[str]] = None,
     ) -> List[UserStory]:
         """
-        Generates user stories and saves them to PocketBase.
-        """
-        prompt_template = """
-        You are a software analyst. Based on the following requirement text, extract key user stories and define acceptance criteria for each:
-        
-        If you encounter a section that doesn't contain user stories, return an empty list of user stories.
-        
-        Document Chunk: {requirement_text}
-        {format_instructions}
+        Generates user stories for every chunk and saves them to PocketBase, recording the
+        chunk fingerprints so a later revision of the BRD can be processed incrementally.
+
+        :param results: Finished generations to save instead of calling the LLM, as
+            (chunk fingerprint, future) pairs, e.g. from a deferred batch.
+        :param saved_chunks: Collects the fingerprints of the chunks whose stories were saved.
         """
+        chunks_by_fingerprint = {fingerprint(chunk): chunk for chunk in requirement_chunks}
+        previous = get_chunk_fingerprints(self.pb, project_id)
 
-        parser = PydanticOutputParser(pydantic_object=UserStories)
-        prompt = PromptTemplate(
-            input_variables=["requirement_text", "format_instructions"],
-            template=prompt_template,
+        user_stories, processed = self._generate_and_save(
+            chunks_by_fingerprint, project_id, user_id, results
+        )
+        if saved_chunks is not None:
+            saved_chunks.update(processed)
+        save_chunk_fingerprints(
+            self.pb,
+            project_id,
+            added=processed - previous,
+            removed=previous - chunks_by_fingerprint.keys(),
         )
-        chain = LLMChain(llm=self.llm, prompt=prompt)
+        record_user_stories(self.pb, project_id, user_stories)
+        read_cache.invalidate(project_namespace(project_id))
+        self.index_chunks(requirement_chunks, project_id)
+        return user_stories
+
+    def regenerate_user_stories(
+        self, requirement_chunks: List[str],
+        project_id: str,
+        user_id: str,
+        results: Optional[Iterable[Tuple[str, Future]]] = None,
+        saved_chunks: Optional[Set[str]] = None,
+    ) -> dict:
+        """
+        Incrementally updates a project's user stories for a revised BRD. Only chunks whose
+        fingerprint was not stored for the previous version are sent to the LLM; stories
+        generated from chunks that no longer exist are marked stale, and stories from
+        unchanged chunks (and their test cases) are left untouched.
+
+        :param requirement_chunks: Chunks of the revised BRD.
+        :param project_id: The project the BRD belongs to.
+        :param user_id: The user running the import.
+        :param results: Finished generations to save instead of calling the LLM, as
+            (chunk fingerprint, future) pairs, e.g. from a deferred batch.
+        :param saved_chunks: Collects the fingerprints of the chunks whose stories were saved.
+        :return: Counts of added, removed and unchanged sections and affected user stories.
+        """
+        chunks_by_fingerprint = {fingerprint(chunk): chunk for chunk in requirement_chunks}
+        previous = get_chunk_fingerprints(self.pb, project_id)
+
+        added = {fp: chunk for fp, chunk in chunks_by_fingerprint.items() if fp not in previous}
+        removed = previous - chunks_by_fingerprint.keys()
+
+        user_stories, processed = self._generate_and_save(added, project_id, user_id, results)
+        if saved_chunks is not None:
+            saved_chunks.update(processed)
+        stale = mark_stories_stale(self.pb, project_id, removed)
+        # Chunks that failed are left unrecorded so the next revision retries them
+        save_chunk_fingerprints(self.pb, project_id, added=processed, removed=removed)
+        record_user_stories(self.pb, project_id, user_stories)
+        record_stale(self.pb, project_id, stale)
+        read_cache.invalidate(project_namespace(project_id))
+        self.index_chunks(requirement_chunks, project_id)
+
+        return {
+            "added_sections": len(added),
+            "removed_sections": len(removed),
+            "unchanged_sections": len(chunks_by_fingerprint) - len(added),
+            "failed_sections": len(added) - len(processed),
+            "user_stories_created": len(user_stories),
+            "user_stories_stale": stale,
+        }
+
+    def index_chunks(self, requirement_chunks: List[str], project_id: str) -> None:
+        """
+        Replaces the project's BRD chunk index, used to give test case generation the
+        relevant BRD context. A failure is logged rather than failing the import.
+        """
+        try:
+            build_index(project_id, requirement_chunks)
+        except Exception:
+            logger.exception("Could not index BRD chunks for project %s", project_id)
+
+    def iter_chunk_results(self, chunks_by_fingerprint: dict) -> Iterator[Tuple[str, Future]]:
+        """
+        Starts generating user stories for every chunk at once and yields each chunk's
+        fingerprint with its finished future, in completion order.
+
+        :param chunks_by_fingerprint: The chunks to process, keyed by fingerprint.
+        """
+        parser, prompt = self._prompt()
+
+        # LLM calls go through the worker's bounded LLM pool, shared with every other request;
+        # each runs with its chunk's ID in the log context
+        future_to_chunk = {}
+        for chunk_fingerprint, chunk in chunks_by_fingerprint.items():
+            with log_context(chunk_id=chunk_fingerprint[:12]):
+                future = self.process_chunk(chunk, parser, prompt)
+            future_to_chunk[future] = chunk_fingerprint
+
+        for future in as_completed(future_to_chunk):
+            yield future_to_chunk[future], future
+
+    def _generate_and_save(
+        self, chunks_by_fingerprint: dict,
+        project_id: str,
+        user_id: str,
+        results: Optional[Iterable[Tuple[str, Future]]] = None,
+    ) -> Tuple[List[UserStory], Set[str]]:
+        """
+        Generates user stories for the given chunks in parallel and saves them to PocketBase,
+        tagged with the fingerprint of the chunk they came from.
+
+        :return: The saved user stories and the fingerprints of the chunks processed successfully.
+        """
         user_stories = []
+        processed = set()
 
-        with ThreadPoolExecutor() as executor:
-            future_to_chunk = {
-                executor.submit(self.process_chunk, chunk, parser, chain): chunk
-                for chunk in requirement_chunks
-            }
+        if results is None:
+            results = self.iter_chunk_results(chunks_by_fingerprint)
+        for chunk_fingerprint, future in results:
+            if chunk_fingerprint not in chunks_by_fingerprint:
+                # Generated for a chunk that another import has processed in the meantime
+                continue
+            with log_context(chunk_id=chunk_fingerprint[:12]):
+                self._save_chunk_stories(
+                    future, chunk_fingerprint, project_id, user_id, user_stories, processed
+                )
 
-            for future in as_completed(future_to_chunk):
-                try:
-                    chunk_user_stories = future.result()
-                    for story in chunk_user_stories:
-                        # Prepare data for PocketBase
-                        data = {
-                            "title": story.title,
-                            "description": story.description,
-                            "acceptance_criteria": story.acceptance_criteria,
-                            "priority": story.priority.value,
-                            "story_points": story.story_points,
-                            "status": story.status.value,
-                            "project": project_id,
-                            "user": user_id,
-                        }
-                        # Insert into PocketBase
-                        self.pb.collection("user_story").create(data)
-                        user_stories.append(story)
-
-                except Exception as e:
-                    print(f"Error in thread: {e}")
+        logger.info(
+            "Generated %d user stories from %d of %d chunks",
+            len(user_stories),
+            len(processed),
+            len(chunks_by_fingerprint),
+        )
+        return user_stories, processed
 
-        return user_stories
+    def _save_chunk_stories(
+        self,
+        future: Future,
+        chunk_fingerprint: str,
+        project_id: str,
+        user_id: str,
+        user_stories: List[UserStory],
+        processed: Set[str],
+    ) -> None:
+        """
+        Saves the user stories generated for one chunk, logging (not raising) a failure so
+        the other chunks are still saved. The stories of a chunk that failed part way are
+        deleted again, so a retry does not duplicate them.
+        """
+        created = []
+        try:
+            chunk_user_stories = future.result()
+            for story in chunk_user_stories:
+                # Prepare data for PocketBase
+                data = {
+                    "title": story.title,
+                    "description": story.description,
+                    "acceptance_criteria": story.acceptance_criteria,
+                    "priority": story.priority.value,
+                    "story_points": story.story_points,
+                    "status": story.status.value,
+                    "project": project_id,
+                    "user": user_id,
+                    "source_chunk": chunk_fingerprint,
+                    "stale": False,
+                }
+                # Insert into PocketBase
+                created.append(self.pb.collection("user_story").create(data).id)
+            user_stories.extend(chunk_user_stories)
+            processed.add(chunk_fingerprint)
+        except Exception:
+            logger.exception("Could not generate user stories for chunk")
+            for record_id in created:
+                try:
+                    self.pb.collection("user_story").delete(record_id)
+                except Exception:
+                    logger.warning("Could not delete partly saved user story %s", record_id)
 
 
 if __name__ == "__main__":
-    pdf_path = "app\src\BRD - HRMS.pdf"
+    import argparse
 
-    # Initialize the UserStoryGenerator
-    user_story_generator = UserStoryGenerator(model="gpt-4o", temperature=0.7)
+    arg_parser = argparse.ArgumentParser(
+        description="Print the user stories generated from a BRD, without saving them "
+        "(use python -m app.batch for imports)"
+    )
+    arg_parser.add_argument("pdf_path", help="The BRD as a PDF")
+    arg_parser.add_argument("--model", default="gpt-4o-mini")
+    args = arg_parser.parse_args()
+
+    user_story_generator = UserStoryGenerator(model=args.model, temperature=0.7)
 
-    # Extract text from PDF and split it into chunks
     print("Extracting text from PDF...")
-    requirement_chunks = user_story_generator.extract_text_from_pdf(pdf_path)
+    requirement_chunks = user_story_generator.extract_text_from_pdf(args.pdf_path)
+    print(json.dumps(user_story_generator.cleanup_report.as_dict()))
 
-    # Generate user stories from the extracted chunks
     print("Generating user stories from requirements...")
-    user_stories = user_story_generator.generate_user_stories(requirement_chunks)
-
-    # Print the final user stories
-    print(json.dumps([story.model_dump() for story in user_stories], indent=4))
+    user_stories = []
+    chunks = {fingerprint(chunk): chunk for chunk in requirement_chunks}
+    for _, future in user_story_generator.iter_chunk_results(chunks):
+        if future.exception() is None:
+            user_stories.extend(future.result())
 
-    # print the length of the user_stories list
+    print(json.dumps([story.model_dump(mode="json") for story in user_stories], indent=4))
     print("Length of user_stories list:", len(user_stories))
 
-    # Now for each user story, generate test cases
+    pools.shutdown()
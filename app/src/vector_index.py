@@ -0,0 +1,284 @@
+import json
+import logging
+import os
+import re
+import threading
+import zlib
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import settings
+from app.core.single_flight import host_lock
+from app.core.tokens import estimate_tokens
+from app.src.chunking import fingerprint
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+_VECTORS_FILE = "vectors.npy"
+_CHUNKS_FILE = "chunks.json"
+
+
+class Embedder(ABC):
+    """
+    Turns texts into L2-normalized float32 vectors, so a dot product is the cosine
+    similarity.
+    """
+
+    name: str = ""
+    dim: int = 0
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """
+        :return: One row per text.
+        """
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.maximum(norms, 1e-12)).astype(np.float32)
+
+
+class HashingEmbedder(Embedder):
+    """
+    A local embedder for offline use: word unigrams and bigrams are hashed into ``dim``
+    signed buckets and weighted by log term frequency. It captures lexical rather than
+    semantic similarity, which is usually enough to find the BRD sections a story was
+    written from.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> Tuple[List[int], List[float]]:
+        words = _TOKEN_RE.findall(text.lower())
+        counts: Dict[int, float] = {}
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            h = zlib.crc32(feature.encode("utf-8"))
+            # The low bits pick the bucket and the top bit the sign, so collisions cancel
+            # out on average instead of piling up
+            bucket = h % self.dim
+            counts[bucket] = counts.get(bucket, 0.0) + (1.0 if h >> 31 else -1.0)
+        return list(counts), [np.sign(v) * np.log1p(abs(v)) for v in counts.values()]
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            buckets, weights = self._features(text)
+            vectors[row, buckets] = weights
+        return self._normalize(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """
+    Semantic embeddings from the OpenAI embeddings API.
+    """
+
+    def __init__(self, model: str = "text-embedding-3-small"):
+        from langchain_openai import OpenAIEmbeddings
+
+        self.name = f"openai-{model}"
+        self._client = OpenAIEmbeddings(model=model)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        vectors = np.asarray(self._client.embed_documents(texts), dtype=np.float32)
+        self.dim = vectors.shape[1]
+        return self._normalize(vectors)
+
+
+def get_embedder(name: Optional[str] = None) -> Embedder:
+    """
+    Returns the configured embedder, or the one an index was built with (by its name).
+    """
+    name = name or settings.EMBEDDER
+    if name == "hashing" or name.startswith("hashing-"):
+        dim = int(name.split("-", 1)[1]) if "-" in name else settings.EMBEDDING_DIM
+        return HashingEmbedder(dim)
+    if name == "openai" or name.startswith("openai-"):
+        return OpenAIEmbedder(name.split("-", 1)[1]) if "-" in name else OpenAIEmbedder()
+    raise ValueError(f"Unsupported embedder: {name}")
+
+
+class VectorIndex:
+    """
+    A project's BRD chunks and their embeddings, searched by brute-force cosine
+    similarity. A BRD has at most a few thousand chunks, so one matrix-vector product
+    is faster than maintaining an approximate index.
+    """
+
+    def __init__(self, vectors: np.ndarray, chunks: List[str], fingerprints: List[str], embedder: str):
+        self.vectors = vectors
+        self.chunks = chunks
+        self.fingerprints = fingerprints
+        self.embedder = embedder
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    def search(self, query: np.ndarray, k: int) -> List[Tuple[int, float]]:
+        """
+        Returns the positions and scores of the ``k`` chunks most similar to ``query``,
+        best first.
+        """
+        if not len(self) or k <= 0:
+            return []
+        scores = self.vectors @ query
+        k = min(k, len(scores))
+        # argpartition finds the top k in linear time; only those k are sorted
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(i), float(scores[i])) for i in top]
+
+    def save(self, directory: str) -> None:
+        """
+        Writes the index atomically: vectors first, then the chunk list that makes them
+        visible to readers.
+        """
+        os.makedirs(directory, exist_ok=True)
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        vectors_path = os.path.join(directory, _VECTORS_FILE)
+        chunks_path = os.path.join(directory, _CHUNKS_FILE)
+
+        with open(vectors_path + suffix, "wb") as f:
+            np.save(f, np.ascontiguousarray(self.vectors, dtype=np.float32))
+        with open(chunks_path + suffix, "w") as f:
+            json.dump(
+                {"embedder": self.embedder, "chunks": self.chunks, "fingerprints": self.fingerprints},
+                f,
+            )
+        os.replace(vectors_path + suffix, vectors_path)
+        os.replace(chunks_path + suffix, chunks_path)
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["VectorIndex"]:
+        """
+        Loads an index with its vectors memory-mapped, or returns None if there is none.
+        """
+        try:
+            with open(os.path.join(directory, _CHUNKS_FILE)) as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(directory, _VECTORS_FILE), mmap_mode="r")
+        except (OSError, ValueError):
+            return None
+        if vectors.shape[0] != len(meta["chunks"]):
+            # Caught between the two renames of a save; the next load will be consistent
+            return None
+        return cls(vectors, meta["chunks"], meta["fingerprints"], meta["embedder"])
+
+
+def index_dir(project_id: str) -> str:
+    return os.path.join(settings.VECTOR_INDEX_DIR, project_id)
+
+
+_loaded: Dict[str, Tuple[float, VectorIndex]] = {}
+_loaded_lock = threading.Lock()
+
+
+def load_index(project_id: str) -> Optional[VectorIndex]:
+    """
+    Returns a project's index, reusing the loaded copy until the files change.
+    """
+    directory = index_dir(project_id)
+    try:
+        mtime = os.path.getmtime(os.path.join(directory, _CHUNKS_FILE))
+    except OSError:
+        return None
+    with _loaded_lock:
+        cached = _loaded.get(project_id)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    index = VectorIndex.load(directory)
+    if index is not None:
+        with _loaded_lock:
+            _loaded[project_id] = (mtime, index)
+    return index
+
+
+def build_index(project_id: str, chunks: List[str]) -> VectorIndex:
+    """
+    Builds and stores the index of a project's current BRD chunks. Chunks that were in
+    the previous index keep their vectors, so a revised BRD only embeds changed sections.
+
+    :param project_id: The project the BRD belongs to.
+    :param chunks: The chunks of the latest BRD.
+    :return: The new index.
+    """
+    embedder = get_embedder()
+    with host_lock(f"vector_index:{project_id}"):
+        previous = VectorIndex.load(index_dir(project_id))
+        known: Dict[str, np.ndarray] = {}
+        if previous is not None and previous.embedder == embedder.name:
+            known = {fp: previous.vectors[i] for i, fp in enumerate(previous.fingerprints)}
+
+        fingerprints = [fingerprint(chunk) for chunk in chunks]
+        missing = [i for i, fp in enumerate(fingerprints) if fp not in known]
+        embedded = embedder.embed([chunks[i] for i in missing])
+
+        if missing:
+            dim = embedded.shape[1]
+        elif known:
+            dim = next(iter(known.values())).shape[0]
+        else:
+            dim = embedder.dim
+        vectors = np.zeros((len(chunks), dim), dtype=np.float32)
+        for row, fp in enumerate(fingerprints):
+            if fp in known:
+                vectors[row] = known[fp]
+        if missing:
+            vectors[missing] = embedded
+
+        index = VectorIndex(vectors, list(chunks), fingerprints, embedder.name)
+        index.save(index_dir(project_id))
+
+    logger.info(
+        "Indexed %d BRD chunks for project %s (%d embedded)", len(chunks), project_id, len(missing)
+    )
+    return index
+
+
+def retrieve_context(
+    project_id: str,
+    query: str,
+    k: int = 3,
+    token_budget: int = 600,
+    min_score: float = 0.1,
+) -> List[str]:
+    """
+    Returns the BRD chunks most relevant to ``query`` that fit in ``token_budget``
+    tokens together, best first. The best chunk is truncated if it alone exceeds the
+    budget; others that would not fit are skipped.
+
+    :param project_id: The project whose BRD to search.
+    :param query: The text to find context for, e.g. a user story and its criteria.
+    :param k: The maximum number of chunks.
+    :param token_budget: The maximum total tokens of the returned chunks.
+    :param min_score: The minimum cosine similarity for a chunk to be relevant.
+    :return: The selected chunks, possibly empty.
+    """
+    index = load_index(project_id)
+    if index is None or not len(index):
+        return []
+
+    query_vector = get_embedder(index.embedder).embed([query])[0]
+    context: List[str] = []
+    remaining = token_budget
+    for position, score in index.search(query_vector, k):
+        if score < min_score:
+            break
+        chunk = index.chunks[position]
+        tokens = estimate_tokens(chunk)
+        if tokens > remaining:
+            if context:
+                continue
+            chunk = chunk[: remaining * 4]
+            tokens = estimate_tokens(chunk)
+        context.append(chunk)
+        remaining -= tokens
+    return context
@@ -0,0 +1,32 @@
+import random
+
+from app.src.chunking import chunk_text, fingerprint
+
+
+def _document(lines: int, seed: int = 7) -> list:
+    rng = random.Random(seed)
+    words = "user shall system login report export account admin field page order".split()
+    return [
+        " ".join(rng.choice(words) for _ in range(rng.randint(3, 18))) + f" {number}."
+        for number in range(lines)
+    ]
+
+
+def test_chunks_stay_within_bounds():
+    chunks = chunk_text("\n".join(_document(600)), chunk_size=1000, min_size=400, max_size=1600)
+
+    assert len(chunks) > 1
+    assert all(len(chunk) <= 1600 for chunk in chunks)
+    assert all(len(chunk) >= 400 for chunk in chunks[:-1])
+
+
+def test_local_edit_keeps_untouched_chunk_fingerprints():
+    lines = _document(600)
+    edited = lines[:300] + ["Note.", "See below.", "Ok."] + lines[300:]
+
+    before = {fingerprint(chunk) for chunk in chunk_text("\n".join(lines))}
+    after = {fingerprint(chunk) for chunk in chunk_text("\n".join(edited))}
+
+    # Only the chunks around the insertion change
+    assert len(before - after) <= 2
+    assert len(after - before) <= 2
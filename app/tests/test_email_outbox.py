@@ -0,0 +1,42 @@
+import threading
+
+import pytest
+
+pytest.importorskip("pydantic_settings")
+
+from app.core import email_outbox
+from app.core.config import settings
+from app.core.email_outbox import EmailOutbox
+from scripts.smtp_sink import SMTPSink
+
+
+@pytest.fixture
+def sink(monkeypatch):
+    server = SMTPSink(("127.0.0.1", 0), rejected={"nobody@example.com"})
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(settings, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(settings, "SMTP_PORT", server.server_address[1])
+    monkeypatch.setattr(settings, "SMTP_TLS", False)
+    monkeypatch.setattr(settings, "SMTP_SSL", False)
+    monkeypatch.setattr(settings, "SMTP_USER", None)
+    monkeypatch.setattr(settings, "EMAILS_FROM_EMAIL", "qa@example.com")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_rejected_recipient_is_dropped_without_retrying(sink, monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(email_outbox.time, "sleep", sleeps.append)
+    outbox = EmailOutbox(synchronous=True)
+
+    outbox.enqueue("someone@example.com", "Accepted", "<p>Hello</p>")
+    outbox.enqueue("nobody@example.com", "Rejected", "<p>Hello</p>")
+
+    assert outbox.sent == 1
+    assert outbox.failed == 1
+    assert sink.stats["messages"] == 1
+    # A refusal is not a broken connection: no backoff and no reconnect
+    assert sleeps == []
+    assert outbox.connections == sink.stats["connections"] == 2
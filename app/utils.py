@@ -1,16 +1,24 @@
 import logging
 from dataclasses import dataclass
 from datetime import datetime, timedelta, timezone
+from functools import cache
 from pathlib import Path
 from typing import Any
 
 import emails  # type: ignore
 import jwt
-from jinja2 import Template
+from jinja2 import (
+    Environment,
+    FileSystemBytecodeCache,
+    FileSystemLoader,
+    select_autoescape,
+)
 from jwt.exceptions import InvalidTokenError
 
 from app.core.config import settings
 
+logger = logging.getLogger(__name__)
+
 
 @dataclass
 class EmailData:
@@ -18,11 +26,21 @@ class EmailData:
     subject: str
 
 
+@cache
+def _email_templates() -> Environment:
+    # Templates are compiled once per process and their bytecode is cached on disk, so
+    # a restarted worker skips the compilation as well
+    Path(settings.EMAIL_TEMPLATE_CACHE_DIR).mkdir(parents=True, exist_ok=True)
+    return Environment(
+        loader=FileSystemLoader(Path(__file__).parent / "email-templates" / "build"),
+        bytecode_cache=FileSystemBytecodeCache(settings.EMAIL_TEMPLATE_CACHE_DIR),
+        autoescape=select_autoescape(["html"]),
+        auto_reload=False,
+    )
+
+
 def render_email_template(*, template_name: str, context: dict[str, Any]) -> str:
-    template_str = (
-        Path(__file__).parent / "email-templates" / "build" / template_name
-    ).read_text()
-    html_content = Template(template_str).render(context)
+    html_content = _email_templates().get_template(template_name).render(context)
     return html_content
 
 
@@ -48,7 +66,7 @@ def send_email(
     if settings.SMTP_PASSWORD:
         smtp_options["password"] = settings.SMTP_PASSWORD
     response = message.send(to=email_to, smtp=smtp_options)
-    logging.info(f"send email result: {response}")
+    logger.info("send email result: %s", response)
 
 
 def generate_test_email(email_to: str) -> EmailData:
@@ -96,6 +114,23 @@ def generate_new_account_email(
     return EmailData(html_content=html_content, subject=subject)
 
 
+def generate_import_complete_email(
+    email_to: str, project_name: str, summary: dict[str, Any]
+) -> EmailData:
+    subject = f"{settings.PROJECT_NAME} - BRD import finished for {project_name}"
+    html_content = render_email_template(
+        template_name="import_complete.html",
+        context={
+            "project_name": settings.PROJECT_NAME,
+            "project": project_name,
+            "email": email_to,
+            "summary": summary,
+            "link": settings.server_host,
+        },
+    )
+    return EmailData(html_content=html_content, subject=subject)
+
+
 def generate_password_reset_token(email: str) -> str:
     delta = timedelta(hours=settings.EMAIL_RESET_TOKEN_EXPIRE_HOURS)
     now = datetime.now(timezone.utc)
@@ -0,0 +1,53 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.append("")
+
+from app.src.pdf_parsing import count_pages, iter_pages
+
+
+def parse_worker_counts(value):
+    """Parse a comma separated list of worker counts, e.g. '1,2,4'."""
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def benchmark(pdf_path, workers, repeat):
+    """Return the best pages/sec over `repeat` runs with the given worker count."""
+    best = 0.0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        # min_parallel_pages=0 forces the pool even for small files so every count is measured
+        pages = sum(1 for _ in iter_pages(pdf_path, max_workers=workers, min_parallel_pages=0))
+        elapsed = time.perf_counter() - start
+        best = max(best, pages / elapsed if elapsed else 0.0)
+    return best
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    default_counts = sorted({1, 2, 4, 8, cpu_count} & set(range(1, cpu_count + 1)))
+
+    parser = argparse.ArgumentParser(description="Benchmark PDF parsing throughput vs. worker count")
+    parser.add_argument("pdf_path", help="PDF to parse")
+    parser.add_argument(
+        "-w", "--workers", type=parse_worker_counts,
+        default=default_counts, help="Comma separated worker counts to try",
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="Runs per worker count")
+    args = parser.parse_args()
+
+    page_count = count_pages(args.pdf_path)
+    print(f"{args.pdf_path}: {page_count} pages, {cpu_count} CPUs")
+    print(f"{'workers':>8} {'pages/sec':>12} {'speedup':>9}")
+
+    baseline = None
+    for workers in args.workers:
+        rate = benchmark(args.pdf_path, workers, args.repeat)
+        baseline = baseline or rate
+        print(f"{workers:>8} {rate:>12.1f} {rate / baseline:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+import argparse
+import os
+import socketserver
+import threading
+import time
+
+
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """
+    Speaks just enough SMTP for smtplib to deliver mail, and writes each message to
+    the output directory instead of relaying it. Recipients in the server's
+    ``rejected`` set are refused. STARTTLS is not offered, so run the
+    app with SMTP_TLS=False against it.
+    """
+
+    def reply(self, line):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        self.server.stats["connections"] += 1
+        self.reply("220 smtp-sink ready")
+        recipients = []
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+
+            if verb in ("EHLO", "HELO"):
+                self.reply("250-smtp-sink" if verb == "EHLO" else "250 smtp-sink")
+                if verb == "EHLO":
+                    self.reply("250-AUTH PLAIN LOGIN")
+                    self.reply("250 8BITMIME")
+            elif verb == "AUTH":
+                # Accept any credentials
+                self.reply("235 Authentication successful")
+            elif verb == "MAIL":
+                recipients = []
+                self.reply("250 OK")
+            elif verb == "RCPT":
+                recipient = command.split(":", 1)[-1].strip(" <>")
+                if recipient in self.server.rejected:
+                    self.reply("550 No such user here")
+                    continue
+                recipients.append(recipient)
+                self.reply("250 OK")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                self.save(self.read_data(), recipients)
+                self.reply("250 OK queued")
+            elif verb in ("RSET", "NOOP"):
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+    def read_data(self):
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if not line or line in (b".\r\n", b".\n"):
+                return b"".join(lines)
+            # Undo dot-stuffing
+            lines.append(line[1:] if line.startswith(b"..") else line)
+
+    def save(self, data, recipients):
+        with self.server.lock:
+            self.server.stats["messages"] += 1
+            count = self.server.stats["messages"]
+        if self.server.output_dir:
+            path = os.path.join(self.server.output_dir, f"{time.time():.6f}-{count}.eml")
+            with open(path, "wb") as f:
+                f.write(data)
+        print(f"Message {count} for {', '.join(recipients)} ({len(data)} bytes)", flush=True)
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, output_dir=None, rejected=()):
+        super().__init__(address, SMTPSinkHandler)
+        self.output_dir = output_dir
+        self.rejected = set(rejected)
+        self.lock = threading.Lock()
+        self.stats = {"connections": 0, "messages": 0}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local SMTP stand-in that accepts all mail, for testing the email outbox"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("-o", "--output-dir", help="Write each message to this directory as .eml")
+    parser.add_argument(
+        "--reject", action="append", default=[], help="Refuse this recipient (repeatable)"
+    )
+    args = parser.parse_args()
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    with SMTPSink((args.host, args.port), args.output_dir, args.reject) as server:
+        print(f"SMTP sink listening on {args.host}:{args.port}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        print(
+            f"{server.stats['messages']} messages over {server.stats['connections']} connections"
+        )
+
+
+if __name__ == "__main__":
+    main()